@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Build time, size and lookup throughput of the Charite supervision pairs of the gene-pheno
+supervision UDFs: the legacy set of (hpo id, gene) tuples expanded with the direct parents of
+each term, against dutil.GenePhenoIndex, in 'parents' (same pairs) and 'ancestors' (full
+closure) modes.
+
+Queries are deterministic (see --seed): half are pairs of the file, or a term of the pair
+replaced by one of its parents / ancestors, the others random (term, gene) pairs, as most of
+the relations supervised are. 'parents' mode must answer every query as the legacy set does,
+and 'ancestors' mode as a walk of the ancestors of the gene's terms. Sizes are those of all of
+the objects held, except the node ids of the HPO DAG, which the index shares. Usage (GDD_HOME
+must be set):
+
+  python bench/charite_index.py [--pairs TSV] [--queries N] [--seed S] [--repeat R]
+
+--pairs defaults to $GDD_HOME/onto/manual/charite_supervision.tsv, as made by
+onto/create_charite_supervision_data.sh.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+import data_util as dutil
+
+
+def read_pairs(path):
+  with open(path) as f:
+    return [tuple(line.strip().split('\t')) for line in f]
+
+
+def legacy_read_supervision(pairs, hpo_dag):
+  supervision_pairs = set()
+  for hpo_id, gene_name in pairs:
+    if hpo_id in hpo_dag.edges:
+      hpo_ids = [hpo_id] + [parent for parent in hpo_dag.edges[hpo_id]]
+    else:
+      hpo_ids = [hpo_id]
+    for h in hpo_ids:
+      supervision_pairs.add((h, gene_name))
+  return supervision_pairs
+
+
+def deep_size(objs, exclude=()):
+  """The total size of objs & of the objects they hold (once each), except those of exclude"""
+  seen = set(id(o) for o in exclude)
+  total = 0
+  stack = list(objs)
+  while stack:
+    o = stack.pop()
+    if id(o) in seen:
+      continue
+    seen.add(id(o))
+    total += sys.getsizeof(o)
+    if isinstance(o, dict):
+      stack.extend(o.iterkeys())
+      stack.extend(o.itervalues())
+    elif isinstance(o, (list, tuple, set, frozenset)):
+      stack.extend(o)
+  return total
+
+
+def synthetic_queries(pairs, hpo_dag, n, seed):
+  rnd = random.Random(seed)
+  terms = sorted(hpo_dag.node_set)
+  genes = sorted(set(gene for _, gene in pairs))
+  for q in xrange(n):
+    if q % 2:
+      yield rnd.choice(terms), rnd.choice(genes)
+      continue
+    hpo_id, gene = rnd.choice(pairs)
+    if hpo_id in hpo_dag.node_set and rnd.random() < 0.5:
+      hpo_id = rnd.choice(sorted(hpo_dag.ancestors(hpo_id)))
+    yield hpo_id, gene
+
+
+def expected_ancestors(pairs, hpo_dag):
+  gene_terms = {}
+  for hpo_id, gene in pairs:
+    gene_terms.setdefault(gene, set()).add(hpo_id)
+  def contains(query):
+    hpo_id, gene = query
+    return any(hpo_id == t or (t in hpo_dag.node_set and hpo_id in hpo_dag.ancestors(t))
+               for t in gene_terms.get(gene, ()))
+  return contains
+
+
+def run(pairs, queries):
+  start = time.time()
+  rv = [q in pairs for q in queries]
+  return time.time() - start, rv
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  arg_parser.add_argument('--pairs', default='%s/onto/manual/charite_supervision.tsv' % os.environ['GDD_HOME'])
+  arg_parser.add_argument('--queries', type=int, default=200000)
+  arg_parser.add_argument('--seed', type=int, default=0)
+  arg_parser.add_argument('--repeat', type=int, default=3)
+  args = arg_parser.parse_args()
+
+  hpo_dag = dutil.read_hpo_dag()
+  pairs = read_pairs(args.pairs)
+  queries = list(synthetic_queries(pairs, hpo_dag, args.queries, args.seed))
+  print '%d pairs of %d genes, %d queries' % (len(pairs), len(set(g for _, g in pairs)), len(queries))
+
+  builds = [('legacy', lambda: legacy_read_supervision(pairs, hpo_dag)),
+            ('parents', lambda: dutil.GenePhenoIndex(pairs, hpo_dag, 'parents')),
+            ('ancestors', lambda: dutil.GenePhenoIndex(pairs, hpo_dag, 'ancestors'))]
+  for name, build in builds:
+    start = time.time()
+    index = build()
+    build_time = time.time() - start
+    if name == 'legacy':
+      size = deep_size([index])
+    else:
+      size = deep_size([index.ids, index.genes, index.bits], exclude=[hpo_dag.ids])
+    best, answers = min(run(index, queries) for i in xrange(args.repeat))
+    if name == 'legacy':
+      legacy_answers, legacy_time = answers, best
+    elif name == 'parents' and answers != legacy_answers:
+      sys.stderr.write('ERROR: parents index does not hold the legacy pairs\n')
+      sys.exit(1)
+    elif name == 'ancestors':
+      contains = expected_ancestors(pairs, hpo_dag)
+      if any(a != contains(q) for q, a in zip(queries[:5000], answers)):
+        sys.stderr.write('ERROR: ancestors index does not hold the closure of the pairs\n')
+        sys.exit(1)
+    print '%-9s  %9d pairs  build %6.3fs  %8.1f MB  %10.0f lookups/s  x%.2f' % (
+      name, len(index), build_time, size / 1e6, len(queries) / best, legacy_time / best)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Feature throughput of genepheno_extract_features, before and after compiling the bad
+feature filter: the legacy path generates every generic ddlib feature family and tries
+each bad_features pattern in turn with re.match; the current path skips the filtered
+families in ddlib and matches the residual features against one compiled alternation.
+
+Relations are synthetic & deterministic (see --seed); both paths must emit exactly the
+same features. Usage (GDD_HOME must be set):
+
+  python bench/feature_filter.py [--relations N] [--seed S] [--repeat R]
+"""
+import argparse
+from collections import namedtuple
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+import ddlib
+import extractor_util as util
+import genepheno_extract_features as gpf
+
+FILLER = ['the', 'a', 'of', 'in', 'to', 'and', 'with', 'as', 'for', 'have', 'be', 'is',
+          'was', 'patient', 'result', 'responsible', 'in', 'we', 'gene', 'protein']
+NERS = ['O', 'O', 'O', 'O', 'PERSON', 'NUMBER', 'LOCATION']
+POSES = ['NN', 'NNS', 'VB', 'VBZ', 'DT', 'IN', 'JJ']
+DEP_PATHS = ['nsubj', 'dobj', 'prep_of', 'prep_in', 'amod', 'det', 'conj_and', 'nn']
+
+SentenceRow = namedtuple('SentenceRow', ['words', 'lemmas', 'poses', 'ners', 'dep_paths', 'dep_parents'])
+
+
+def synthetic_sentences(n, seed):
+  """Yield (ddlib sentence, gene span, pheno span) tuples"""
+  rnd = random.Random(seed)
+  keywords = sorted(w for ws in gpf.fr['synonyms'].itervalues() for w in ws)
+  for _ in xrange(n):
+    length = rnd.randint(8, 40)
+    words = [rnd.choice(keywords) if rnd.random() < 0.15 else rnd.choice(FILLER)
+             for i in xrange(length)]
+    words = [w.capitalize() if rnd.random() < 0.1 else w for w in words]
+    order = range(length)
+    rnd.shuffle(order)
+    dep_parents = [-1] * length
+    for k, i in enumerate(order[1:], 1):
+      dep_parents[i] = order[rnd.randint(0, k - 1)]
+    dds = util.create_ddlib_sentence(SentenceRow(
+      words=words, lemmas=[w.lower() for w in words],
+      poses=[rnd.choice(POSES) for i in xrange(length)],
+      ners=[rnd.choice(NERS) for i in xrange(length)],
+      dep_paths=[rnd.choice(DEP_PATHS) for i in xrange(length)],
+      dep_parents=dep_parents))
+    g, p = rnd.sample(xrange(length - 2), 2)
+    if abs(g - p) < 3:
+      p = min(g + 3, length - 3) if g < p else max(g - 3, 0)
+    gene_span = ddlib.Span(begin_word_id=g, length=1)
+    pheno_span = ddlib.Span(begin_word_id=p, length=rnd.randint(1, 2))
+    yield dds, gene_span, pheno_span
+
+
+def legacy_take_feature(feat):
+  for bad_feature_pattern in gpf.bad_features:
+    if re.match(bad_feature_pattern, feat):
+      return False
+  return True
+
+
+def legacy_features(dds, gene_span, pheno_span):
+  return [feat for feat in ddlib.get_generic_features_relation(dds, gene_span, pheno_span)
+          if legacy_take_feature(feat)]
+
+
+def compiled_features(dds, gene_span, pheno_span):
+  return [feat for feat in ddlib.get_generic_features_relation(dds, gene_span, pheno_span,
+                                                               skip=gpf.SKIPPED_FAMILIES)
+          if gpf.take_feature(feat)]
+
+
+def run(fn, relations):
+  rv = []
+  start = time.time()
+  for dds, gene_span, pheno_span in relations:
+    rv.append(fn(dds, gene_span, pheno_span))
+  return time.time() - start, rv
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  arg_parser.add_argument('--relations', type=int, default=5000)
+  arg_parser.add_argument('--seed', type=int, default=0)
+  arg_parser.add_argument('--repeat', type=int, default=3)
+  args = arg_parser.parse_args()
+
+  ddlib.load_dictionary_map(gpf.fr['synonyms'])
+  relations = list(synthetic_sentences(args.relations, args.seed))
+  print 'skipped feature families: %s' % ', '.join(sorted(gpf.SKIPPED_FAMILIES))
+  for name, fn in [('legacy', legacy_features), ('compiled', compiled_features)]:
+    best, features = min(run(fn, relations) for i in xrange(args.repeat))
+    if name == 'legacy':
+      expected = features
+      legacy_time = best
+    elif features != expected:
+      sys.stderr.write('ERROR: %s features differ from legacy features\n' % name)
+      sys.exit(1)
+    n = sum(len(f) for f in features)
+    print '%-8s  %8d features  %7.3fs  %10.0f features/s  %8.0f relations/s  x%.2f' % (
+      name, n, best, n / best, len(relations) / best, legacy_time / best)
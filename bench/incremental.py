@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Output & throughput of incremental runs of run_main_tsv (see incremental.py), serially and
+with workers: a first run processes part of the input rows, and a second one all of them,
+reusing the cached rows. The output, side output & counters of the second run must be those
+of a plain serial run, in input order. Small chunks (see --chunk-rows) interleave reused and
+new rows in each chunk sent to the workers.
+
+Rows are synthetic & deterministic (see --seed); row_fn writes a varying number of records,
+some side output, and updates counters. The cache is kept in a temporary directory under
+$GDD_HOME/<cache-dir>, removed at the end. Usage (GDD_HOME must be set):
+
+  python bench/incremental.py [--rows N] [--cached F] [--workers W] [--chunk-rows C] [--seed S]
+"""
+import argparse
+import os
+import random
+import shutil
+import StringIO
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+import config
+import extractor_util as util
+
+
+class Counts:
+  def __init__(self):
+    self.rows = 0
+    self.records = 0
+
+
+def make_row_fn(counts, side):
+  def row_fn(line):
+    n = int(line.split('\t')[1])
+    counts.rows += 1
+    counts.records += n
+    print >>side, 'side of', line.split('\t')[0]
+    return [(line.split('\t')[0], k) for k in xrange(n)]
+  return row_fn
+
+
+def run(lines, workers, incremental):
+  counts = Counts()
+  side_text = StringIO.StringIO()
+  side = util.SideOutput(side_text)
+  out = StringIO.StringIO()
+  start = time.time()
+  util.run_main_tsv(lambda line: line, make_row_fn(counts, side),
+                    instream=StringIO.StringIO(''.join(lines)), outstream=out, workers=workers,
+                    counters=util.ModuleCounters(counts, ['rows', 'records'], balancing=False),
+                    sides=side, incremental=incremental, instrument=False, profile=False)
+  return time.time() - start, (out.getvalue(), side_text.getvalue(), counts.rows, counts.records)
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  arg_parser.add_argument('--rows', type=int, default=20000)
+  arg_parser.add_argument('--cached', type=float, default=0.5)
+  arg_parser.add_argument('--workers', type=int, default=3)
+  arg_parser.add_argument('--chunk-rows', type=int, default=7)
+  arg_parser.add_argument('--seed', type=int, default=0)
+  args = arg_parser.parse_args()
+
+  rnd = random.Random(args.seed)
+  lines = ['r%d\t%d\n' % (i, rnd.randint(0, 3)) for i in xrange(args.rows)]
+  first = [line for line in lines if rnd.random() < args.cached]
+  util.CHUNK_ROWS = args.chunk_rows
+  cache_dir = 'incremental_cache/bench.%d' % os.getpid()
+  config.INCREMENTAL['cache-dir'] = cache_dir
+
+  plain_time, expected = run(lines, 0, False)
+  print '%-16s  %8d rows  %7.3fs  %10.0f rows/s' % ('plain', len(lines), plain_time,
+                                                    len(lines) / plain_time)
+  failed = False
+  try:
+    for workers in [0, args.workers]:
+      shutil.rmtree('%s/%s' % (os.environ['GDD_HOME'], cache_dir), ignore_errors=True)
+      run(first, workers, True)
+      best, got = run(lines, workers, True)
+      name = 'workers=%d' % workers
+      if got != expected:
+        sys.stderr.write('ERROR: incremental run with %s differs from a plain serial run\n' % name)
+        failed = True
+      print '%-16s  %8d rows  %7.3fs  %10.0f rows/s  (%d cached)' % (
+        name, len(lines), best, len(lines) / best, len(first))
+  finally:
+    shutil.rmtree('%s/%s' % (os.environ['GDD_HOME'], cache_dir), ignore_errors=True)
+  sys.exit(1 if failed else 0)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Throughput of pheno_mentions_remove_super_dag_phenos on spans which map to many HPO terms,
+before and after filtering with the ancestor bitsets of the HPO Dag: the legacy filter
+compares each mention with every kept one, walking the DAG up recursively (get_parents) for
+each check; the current one ORs the ancestor bitsets of the span's terms once.
+
+Spans are synthetic & deterministic (see --seed): each one holds a random term, some of its
+ancestors and some unrelated terms. The current filter must keep exactly the terms which
+have no descendant among the others, going up no further than HP:0000118 (as get_parents). Usage (GDD_HOME must be set):
+
+  python bench/super_dag_phenos.py [--spans N] [--terms K] [--seed S] [--repeat R]
+"""
+import argparse
+from collections import namedtuple
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+import pheno_mentions_remove_super_dag_phenos as pmr
+
+Row = namedtuple('Row', ['doc_id', 'section_id', 'sent_id', 'wordidxs', 'mention_ids', 'supertypes',
+                         'subtypes', 'entities', 'words', 'is_corrects'])
+
+
+def synthetic_spans(hpo_dag, n, k, seed):
+  rnd = random.Random(seed)
+  nodes = sorted(hpo_dag.node_set)
+  for s in xrange(n):
+    term = rnd.choice(nodes)
+    ancestors = sorted(hpo_dag.ancestors(term) & hpo_dag.node_set)
+    entities = [term] + rnd.sample(ancestors, min(len(ancestors), k // 2))
+    entities += [rnd.choice(nodes) for i in xrange(k - len(entities))]
+    rnd.shuffle(entities)
+    yield Row('doc%d' % s, 'Abstract', 0, [3, 4], ['m%d_%d' % (s, i) for i in xrange(k)],
+              ['EXACT'] * k, [None] * k, entities, ['foo', 'bar'], [None] * k)
+
+
+def legacy_get_parents(bottom_id, dag, root_id='HP:0000118'):
+  if bottom_id == root_id:
+    return set([bottom_id])
+  rv = set()
+  if bottom_id in dag.edges:
+    for parent in dag.edges[bottom_id]:
+      rv |= legacy_get_parents(parent, dag)
+  rv.add(bottom_id)
+  return rv
+
+
+def legacy_filter_phenos(row):
+  cands = []
+  for i in xrange(len(row.mention_ids)):
+    current = pmr.Mention(None, row.doc_id, row.section_id, row.sent_id, row.wordidxs,
+                          row.mention_ids[i], row.supertypes[i], row.subtypes[i], row.entities[i],
+                          row.words, row.is_corrects[i])
+    found = False
+    for j in xrange(len(cands)):
+      if current.entity in legacy_get_parents(cands[j].entity, pmr.hpo_dag):
+        found = True
+        break
+      if cands[j].entity in legacy_get_parents(current.entity, pmr.hpo_dag):
+        cands[j] = current
+        found = True
+        break
+    if not found:
+      cands.append(current)
+  return cands
+
+
+def expected_entities(row):
+  dag = pmr.hpo_dag
+  entities = set(row.entities)
+  return set(e for e in entities
+             if not any(f != e and e in legacy_get_parents(f, dag) for f in entities))
+
+
+def run(fn, rows):
+  rv = []
+  start = time.time()
+  for row in rows:
+    rv.append(fn(row))
+  return time.time() - start, rv
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  arg_parser.add_argument('--spans', type=int, default=500)
+  arg_parser.add_argument('--terms', type=int, default=30)
+  arg_parser.add_argument('--seed', type=int, default=0)
+  arg_parser.add_argument('--repeat', type=int, default=3)
+  args = arg_parser.parse_args()
+
+  rows = list(synthetic_spans(pmr.hpo_dag, args.spans, args.terms, args.seed))
+  for name, fn in [('legacy', legacy_filter_phenos), ('bitset', pmr.filter_phenos)]:
+    best, mentions = min(run(fn, rows) for i in xrange(args.repeat))
+    if name == 'legacy':
+      legacy_time = best
+    elif any(set(m.entity for m in ms) != expected_entities(row) for ms, row in zip(mentions, rows)):
+      sys.stderr.write('ERROR: %s filter did not keep the most specific terms\n' % name)
+      sys.exit(1)
+    n = sum(len(ms) for ms in mentions)
+    print '%-8s  %8d mentions kept  %7.3fs  %10.0f spans/s  x%.2f' % (
+      name, n, best, len(rows) / best, legacy_time / best)
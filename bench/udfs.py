@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+"""
+Throughput of every UDF of app.ddlog, on a deterministic synthetic sentences_input corpus
+(or on a recorded one), stored as JSON so that runs on different commits can be compared.
+
+Synthetic sentences have realistic lengths, random dependency trees, and gene symbols,
+phenotype names, variants and acronyms drawn from the onto dictionaries, planted at known
+positions. The input of each UDF is derived from these sentences & mentions, following the
+fields of its RowParser; each UDF then runs as a separate process with --instrument (see
+extractor_util.Instruments), once on empty input, which measures its startup time, and once
+on its input. For each UDF, rows/sec, peak RSS, startup time and the per-stage & per-rule
+timings are recorded in bench/results/<label>.json (label: by default, git describe).
+Usage (GDD_HOME must be set):
+
+  python bench/udfs.py generate [--sentences N] [--seed S] > sentences_input.tsv
+  python bench/udfs.py run [--sentences N] [--seed S] [--corpus sentences_input.tsv]
+                           [--udfs REGEX] [--workers W] [--repeat R] [--label L]
+  python bench/udfs.py compare BASE NEW [--threshold T]
+
+A recorded corpus is a dump of the sentences_input table (see create_small_sentences_input.sh);
+its mentions are found by looking its words up in the same dictionaries. compare takes two
+labels (or paths of result files), and exits with 1 if any UDF got slower or bigger by more
+than the threshold.
+"""
+import argparse
+import ast
+from collections import namedtuple, OrderedDict
+import datetime
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'code'))
+import extractor_util as util
+
+APP_HOME = os.environ['GDD_HOME']
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+SENTENCE_COLUMNS = ['doc_id', 'section_id', 'sent_id', 'words', 'lemmas', 'poses', 'ners',
+                    'dep_paths', 'dep_parents']
+sentence_parser = util.RowParser([
+            ('doc_id', 'text'),
+            ('section_id', 'text'),
+            ('sent_id', 'int'),
+            ('words', 'text[]'),
+            ('lemmas', 'text[]'),
+            ('poses', 'text[]'),
+            ('ners', 'text[]'),
+            ('dep_paths', 'text[]'),
+            ('dep_parents', 'int[]')])
+
+Sentence = namedtuple('Sentence', SENTENCE_COLUMNS + ['mentions'])
+# kind: gene, pheno, variant or acronym; entities: the HPO terms of a phenotype span;
+# long_wordidxs: the long form of an acronym
+Mention = namedtuple('Mention', ['kind', 'id', 'wordidxs', 'name', 'entity', 'entities',
+                                 'supertype', 'is_correct', 'long_wordidxs'])
+
+FILLER = [('the', 'the', 'DT'), ('a', 'a', 'DT'), ('of', 'of', 'IN'), ('in', 'in', 'IN'),
+          ('with', 'with', 'IN'), ('and', 'and', 'CC'), ('to', 'to', 'TO'), (',', ',', ','),
+          ('patients', 'patient', 'NNS'), ('mutations', 'mutation', 'NNS'),
+          ('mutation', 'mutation', 'NN'), ('gene', 'gene', 'NN'), ('protein', 'protein', 'NN'),
+          ('was', 'be', 'VBD'), ('is', 'be', 'VBZ'), ('were', 'be', 'VBD'),
+          ('causes', 'cause', 'VBZ'), ('caused', 'cause', 'VBN'), ('associated', 'associate', 'VBN'),
+          ('found', 'find', 'VBN'), ('identified', 'identify', 'VBN'), ('we', 'we', 'PRP'),
+          ('not', 'not', 'RB'), ('family', 'family', 'NN'), ('expression', 'expression', 'NN'),
+          ('novel', 'novel', 'JJ'), ('heterozygous', 'heterozygous', 'JJ'),
+          ('homozygous', 'homozygous', 'JJ'), ('cells', 'cell', 'NNS'), ('by', 'by', 'IN'),
+          ('2', '2', 'CD'), ('that', 'that', 'WDT'), ('showed', 'show', 'VBD'),
+          ('syndrome', 'syndrome', 'NN'), ('disease', 'disease', 'NN'), ('result', 'result', 'NN')]
+DEP_LABELS = ['nsubj', 'nsubjpass', 'dobj', 'prep_of', 'prep_in', 'prep_with', 'amod', 'det',
+              'nn', 'conj_and', 'auxpass', 'advmod', 'appos', 'num']
+AMINO_ACIDS = ['Ala', 'Arg', 'Asn', 'Asp', 'Cys', 'Gln', 'Glu', 'Gly', 'His', 'Ile', 'Leu',
+               'Lys', 'Met', 'Phe', 'Pro', 'Ser', 'Thr', 'Trp', 'Tyr', 'Val']
+
+
+def onto_file(*paths):
+  for path in paths:
+    if os.path.isfile('%s/onto/%s' % (APP_HOME, path)):
+      return '%s/onto/%s' % (APP_HOME, path)
+  raise IOError('None of %s found in %s/onto' % (', '.join(paths), APP_HOME))
+
+
+class Dictionaries:
+  """The gene symbols, phenotype names (with their HPO terms) and keywords to draw from"""
+  def __init__(self):
+    genes = set()
+    path = onto_file('data/ensembl_genes.tsv', 'dicts/mart_export.txt')
+    with open(path) as f:
+      for line in f:
+        toks = line.rstrip('\n').split('\t')
+        if len(toks) >= 2 and re.match(r'^[A-Z][A-Z0-9-]{2,9}$', toks[1]):
+          genes.add(toks[1])
+    self.genes = sorted(genes)
+    phenos = {}
+    with open(onto_file('manual/pheno_terms.tsv')) as f:
+      for line in f:
+        toks = line.rstrip('\n').split('\t')
+        if len(toks) == 3 and toks[2] == 'EXACT' and 0 < len(toks[1].split()) <= 5:
+          phenos.setdefault(toks[1], []).append(toks[0])
+    self.phenos = sorted(phenos.iteritems())
+    with open(onto_file('manual/pheno_sentence_keywords.tsv')) as f:
+      self.keywords = sorted(set(line.strip() for line in f if line.strip()))
+    self.gene_set = set(self.genes)
+    self.pheno_map = dict(self.phenos)
+
+
+def random_tree(rnd, n):
+  """1-based dep_parents (0: root) of a random tree, attaching words mostly to near ones"""
+  parents = [0] * n
+  root = rnd.randrange(n)
+  attached = [root]
+  for i in sorted(xrange(n), key=lambda i: (abs(i - root), i)):
+    if i == root:
+      continue
+    near = [j for j in attached if abs(j - i) <= 3]
+    parents[i] = (rnd.choice(near) if near and rnd.random() < 0.8 else rnd.choice(attached)) + 1
+    attached.append(i)
+  return parents
+
+
+def synthetic_sentence(rnd, dicts, doc_id, section_id, sent_id):
+  length = min(max(int(rnd.lognormvariate(3.1, 0.45)), 5), 120)
+  tokens = []
+  planted = []
+  while len(tokens) < length:
+    x = rnd.random()
+    if x < 0.06:
+      planted.append(('gene', len(tokens), rnd.choice(dicts.genes)))
+      tokens.append((planted[-1][2], planted[-1][2], 'NN'))
+    elif x < 0.1:
+      name, hpo_ids = rnd.choice(dicts.phenos)
+      planted.append(('pheno', len(tokens), (name, hpo_ids)))
+      tokens.extend((w, w.lower(), 'JJ' if k + 1 < len(name.split()) else 'NN')
+                    for k, w in enumerate(name.split()))
+    elif x < 0.11:
+      v = rnd.choice(['c.%d%s>%s' % (rnd.randint(1, 4000), rnd.choice('ACGT'), rnd.choice('ACGT')),
+                      'p.%s%d%s' % (rnd.choice(AMINO_ACIDS), rnd.randint(1, 1500), rnd.choice(AMINO_ACIDS))])
+      planted.append(('variant', len(tokens), v))
+      tokens.append((v, v, 'NN'))
+    elif x < 0.115:
+      name, hpo_ids = rnd.choice(dicts.phenos)
+      words = name.split()
+      abbrev = ''.join(w[0] for w in words).upper()
+      if len(words) > 1:
+        planted.append(('acronym', len(tokens), (name, hpo_ids, abbrev)))
+        tokens.extend((w, w.lower(), 'NN') for w in words)
+        tokens.extend([('-LRB-', '-lrb-', '-LRB-'), (abbrev, abbrev.lower(), 'NN'),
+                       ('-RRB-', '-rrb-', '-RRB-')])
+    elif x < 0.15:
+      k = rnd.choice(dicts.keywords)
+      tokens.append((k, k, 'NN'))
+    else:
+      tokens.append(rnd.choice(FILLER))
+  tokens.append(('.', '.', '.'))
+
+  n = len(tokens)
+  parents = random_tree(rnd, n)
+  mentions = []
+  prefix = '%s_%s_%d' % (doc_id, section_id, sent_id)
+  for kind, i, value in planted:
+    mid = '%s_%s_%d' % (prefix, kind, i)
+    is_correct = rnd.choice([None, None, None, True, False])
+    if kind == 'gene':
+      mentions.append(Mention(kind, mid, [i], value, value, [value], 'EXACT', is_correct, None))
+    elif kind == 'pheno':
+      name, hpo_ids = value
+      wordidxs = range(i, i + len(name.split()))
+      mentions.append(Mention(kind, mid, wordidxs, name, hpo_ids[0], hpo_ids, 'EXACT', is_correct, None))
+    elif kind == 'variant':
+      mentions.append(Mention(kind, mid, [i], value, value, [value], 'VARIANT', is_correct, None))
+    else:
+      name, hpo_ids, abbrev = value
+      short = i + len(name.split()) + 1
+      mentions.append(Mention(kind, mid, [short], abbrev, hpo_ids[0], hpo_ids, 'ABBREV', is_correct,
+                              range(i, i + len(name.split()))))
+  return Sentence(doc_id, section_id, sent_id,
+                  [t[0] for t in tokens], [t[1] for t in tokens], [t[2] for t in tokens],
+                  ['NUMBER' if t[2] == 'CD' else 'O' for t in tokens],
+                  ['ROOT' if p == 0 else rnd.choice(DEP_LABELS) for p in parents], parents,
+                  mentions)
+
+
+def synthetic_corpus(dicts, n, seed):
+  rnd = random.Random(seed)
+  doc = 0
+  while n > 0:
+    doc_id = str(10000000 + doc)
+    for sent_id in xrange(min(rnd.randint(3, 15), n)):
+      section_id = 'Abstract' if sent_id < 8 else 'Body.0.%d' % (sent_id // 8)
+      yield synthetic_sentence(rnd, dicts, doc_id, section_id, sent_id)
+      n -= 1
+    doc += 1
+
+
+def recorded_corpus(dicts, path, max_ngram=5):
+  """The sentences of a sentences_input dump, with the dictionary words found in them"""
+  with open(path) as f:
+    for line in f:
+      row = sentence_parser.parse_tsv_row(line)
+      prefix = '%s_%s_%d' % (row.doc_id, row.section_id, row.sent_id)
+      mentions = []
+      for i, word in enumerate(row.words):
+        if word in dicts.gene_set:
+          mentions.append(Mention('gene', '%s_gene_%d' % (prefix, i), [i], word, word, [word],
+                                  'EXACT', None, None))
+        for k in xrange(min(max_ngram, len(row.words) - i), 0, -1):
+          hpo_ids = dicts.pheno_map.get(' '.join(row.lemmas[i:i + k]))
+          if hpo_ids:
+            mentions.append(Mention('pheno', '%s_pheno_%d' % (prefix, i), range(i, i + k),
+                                    ' '.join(row.words[i:i + k]), hpo_ids[0], hpo_ids,
+                                    'EXACT', None, None))
+            break
+      # dep_parents are decoded 0-based
+      yield Sentence(*([getattr(row, c) for c in SENTENCE_COLUMNS[:-1]] +
+                       [[p + 1 for p in row.dep_parents], mentions]))
+
+
+### UDF INPUT ###
+
+# The mentions each input row of a UDF is about (by default, one row per sentence)
+ROW_KINDS = {
+  'gene_extract_features' : 'gene',
+  'non_gene_acronyms_extract_candidates' : 'gene',
+  'pheno_extract_features' : 'pheno',
+  'pheno_acronyms_extract_candidates' : 'pheno',
+  'pheno_mentions_remove_super_dag_phenos' : 'pheno',
+  'variant_extract_features' : 'variant',
+  'non_gene_acronyms_extract_features' : 'acronym',
+  'pheno_acronyms_extract_features' : 'acronym',
+  'genepheno_extract_candidates' : 'gene-pheno',
+  'genepheno_extract_features' : 'gene-pheno',
+  'genepheno_extract_features2' : 'gene-pheno',
+  'genepheno_causation_supervision' : 'gene-pheno',
+  'genepheno_causation_supervision_no_charite' : 'gene-pheno',
+}
+
+# Column name prefixes, and the kind of mention they refer to
+PREFIXES = [('genevar_', 'variant'), ('gene_', 'gene'), ('pheno_', 'pheno'),
+            ('variant_', 'variant'), ('pa_', 'acronym')]
+
+PLURALS = {'mention_ids' : 'mention_id', 'names' : 'name', 'entities' : 'entity',
+           'is_corrects' : 'is_correct', 'supertypes' : 'supertype', 'subtypes' : 'subtype',
+           'abbrevs' : 'abbrev', 'section_ids' : 'section_id', 'sent_ids' : 'sent_id',
+           'wordidxs' : 'wordidxs'}
+
+
+def mention_value(attr, s, m):
+  if attr in ('mention_id', 'id'):
+    return m.id
+  if attr in ('wordidxs', 'wordidx_array', 'mention_wordidxs', 'short_wordidxs'):
+    return m.wordidxs
+  if attr in ('supertype', 'mention_type'):
+    return m.supertype
+  if attr == 'subtype':
+    return None
+  if attr in ('name', 'abbrev'):
+    return m.name
+  if attr in ('section_id', 'sent_id'):
+    return getattr(s, attr)
+  return getattr(m, attr)
+
+
+def column_value(name, ftype, s, current, list_kinds={}):
+  """
+  The value of column name for sentence s, where current maps the kinds of mentions to the
+  ones the row is about (None: the UDF's own kind), and list_kinds the kinds of mentions
+  listed by array columns to others
+  """
+  if name in SENTENCE_COLUMNS:
+    return getattr(s, name)
+  kind, attr = None, name
+  for prefix, k in PREFIXES:
+    if name.startswith(prefix):
+      kind, attr = k, name[len(prefix):]
+      break
+  if attr in SENTENCE_COLUMNS:
+    return getattr(s, attr)
+  if name == 'relation_id':
+    return '%s_%s' % (current['gene'].id, current['pheno'].id)
+  if name == 'relation_ids':
+    return ['%s_%s' % (g.id, p.id) for g, p in mention_pairs(s)]
+  plural = ftype == 'int[][]' or (attr in PLURALS and attr != 'wordidxs')
+  if not plural:
+    return mention_value(attr, s, current[kind])
+  attr = PLURALS[attr]
+  if kind is None:
+    # The HPO terms of the current phenotype span
+    m = current[None]
+    return [mention_value(attr, s, m._replace(id='%s_%d' % (m.id, k), entity=e))
+            for k, e in enumerate(m.entities)]
+  kind = list_kinds.get(kind, kind)
+  return [mention_value(attr, s, m) for m in s.mentions if m.kind == kind]
+
+
+def mention_pairs(s):
+  genes = [m for m in s.mentions if m.kind == 'gene']
+  return [(g, p) for g in genes for p in s.mentions if p.kind == 'pheno']
+
+
+def row_contexts(kind, s):
+  if kind is None:
+    yield {}
+  elif kind == 'gene-pheno':
+    for g, p in mention_pairs(s):
+      yield {'gene' : g, 'pheno' : p}
+  else:
+    for m in s.mentions:
+      if m.kind == kind:
+        yield {None : m, kind : m}
+
+
+def tsv_value(value):
+  if value is None:
+    return '\\N'
+  if value is True or value is False:
+    return 't' if value else 'f'
+  if isinstance(value, list):
+    if value and isinstance(value[0], list):
+      return '|~|'.join('|^|'.join(str(x) for x in v) for v in value)
+    return '|^|'.join('NULL' if x is None else tsv_value(x) for x in value)
+  return str(value)
+
+
+def udf_input(fields, kind, sentences):
+  """The TSV input lines of a UDF with RowParser fields"""
+  # The phenotypes of the acronyms, alongside them
+  list_kinds = {'pheno' : 'acronym'} if any(name.startswith('pa_') for name, _ in fields) else {}
+  for s in sentences:
+    for current in row_contexts(kind, s):
+      yield '\t'.join(tsv_value(column_value(name, ftype, s, current, list_kinds))
+                      for name, ftype in fields) + '\n'
+
+
+def parser_fields(path):
+  """The fields of the (first) RowParser of a UDF, or of a module it imports from code/"""
+  with open(path) as f:
+    tree = ast.parse(f.read())
+  imports = []
+  for node in tree.body:
+    if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call) and \
+        getattr(node.value.func, 'attr', None) == 'RowParser':
+      return ast.literal_eval(node.value.args[0])
+    if isinstance(node, ast.Import):
+      imports += [alias.name for alias in node.names]
+  for module in imports:
+    module_path = os.path.join(REPO_DIR, 'code', module + '.py')
+    if module.endswith('_util') and os.path.isfile(module_path):
+      return parser_fields(module_path)
+  return None
+
+
+def app_udfs():
+  """The (name, implementation path) of the UDFs of app.ddlog, in order"""
+  rv = OrderedDict()
+  with open(os.path.join(REPO_DIR, 'app.ddlog')) as f:
+    for m in re.finditer(r'^function\s+(\w+)[\s\S]*?implementation\s+"([^"]+)"', f.read(), re.M):
+      rv.setdefault(m.group(1), m.group(2))
+  return rv.items()
+
+
+### RUNNING ###
+
+def run_process(cmd, input_path, output_path):
+  """Run cmd on input_path, returning (wall seconds, peak RSS in KB, exit status, stderr)"""
+  with open(input_path) as stdin, open(output_path, 'w') as stdout, tempfile.TemporaryFile() as stderr:
+    start = time.time()
+    env = dict(os.environ, APP_HOME=os.environ.get('APP_HOME', REPO_DIR))
+    p = subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr, cwd=REPO_DIR, env=env)
+    _, status, rusage = os.wait4(p.pid, 0)
+    elapsed = time.time() - start
+    p.returncode = status
+    stderr.seek(0)
+    return elapsed, rusage.ru_maxrss, status, stderr.read()
+
+
+def instruments_summary(stderr):
+  for line in stderr.splitlines():
+    if line.startswith('INSTRUMENTS: '):
+      return json.loads(line[len('INSTRUMENTS: '):], object_pairs_hook=OrderedDict)
+  return None
+
+
+def udf_command(path, workers):
+  if path.endswith('.sh'):
+    return ['bash', path]
+  cmd = [sys.executable, path, '--instrument']
+  if workers:
+    cmd += ['--workers', str(workers)]
+  return cmd
+
+
+def bench_udf(name, path, sentences, args, tmp_dir):
+  if not os.path.isfile(os.path.join(REPO_DIR, path)):
+    return OrderedDict([('status', 'missing')])
+  if path.endswith('.sh'):
+    # canonicalize_gene_phenotype: (hpo_id, gene) pairs
+    lines = ('%s\t%s\n' % (p.entity, g.entity) for s in sentences for g, p in mention_pairs(s))
+  else:
+    fields = parser_fields(os.path.join(REPO_DIR, path))
+    if fields is None:
+      return OrderedDict([('status', 'no RowParser')])
+    kind = ROW_KINDS.get(os.path.splitext(os.path.basename(path))[0])
+    lines = udf_input(fields, kind, sentences)
+  input_path = os.path.join(tmp_dir, name + '.tsv')
+  empty_path = os.path.join(tmp_dir, 'empty.tsv')
+  output_path = os.path.join(tmp_dir, name + '.out')
+  with open(input_path, 'w') as f:
+    f.writelines(lines)
+  open(empty_path, 'w').close()
+
+  cmd = udf_command(path, args.workers)
+  rv = OrderedDict([('status', 'ok')])
+  startup, startup_rss, status, stderr = run_process(cmd, empty_path, output_path)
+  if status != 0:
+    rv['status'] = 'error'
+    rv['error'] = stderr.strip().splitlines()[-1:] if stderr.strip() else 'exit status %d' % status
+    return rv
+  best = None
+  for i in xrange(args.repeat):
+    elapsed, rss, status, stderr = run_process(cmd, input_path, output_path)
+    if status != 0:
+      rv['status'] = 'error'
+      rv['error'] = stderr.strip().splitlines()[-1:] if stderr.strip() else 'exit status %d' % status
+      return rv
+    if best is None or elapsed < best[0]:
+      best = (elapsed, rss, instruments_summary(stderr))
+  elapsed, rss, summary = best
+  with open(input_path) as f:
+    rows_in = sum(1 for line in f)
+  with open(output_path) as f:
+    rows_out = sum(1 for line in f)
+  # Without a summary (e.g. shell UDFs), processing time is the wall time past startup
+  seconds = summary['seconds'] if summary else max(elapsed - startup, 1e-9)
+  rv.update([('rows_in', rows_in), ('rows_out', rows_out),
+             ('rows_per_sec', round(rows_in / max(seconds, 1e-9), 1)),
+             ('startup_seconds', round(startup, 4)), ('wall_seconds', round(elapsed, 4)),
+             ('seconds', round(seconds, 4)), ('peak_rss_kb', rss),
+             ('startup_rss_kb', startup_rss)])
+  if summary:
+    rv['stages'] = summary['stages']
+    rv['rules'] = summary['rules']
+  return rv
+
+
+def git_label():
+  try:
+    return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+
+def results_path(label):
+  return label if label.endswith('.json') else os.path.join(RESULTS_DIR, label + '.json')
+
+
+def run(args):
+  dicts = Dictionaries()
+  if args.corpus:
+    sentences = list(recorded_corpus(dicts, args.corpus))
+  else:
+    sentences = list(synthetic_corpus(dicts, args.sentences, args.seed))
+  label = args.label or git_label()
+  results = OrderedDict([
+    ('label', label), ('date', datetime.datetime.now().isoformat()),
+    ('python', sys.version.split()[0]), ('corpus', args.corpus or 'synthetic'),
+    ('sentences', len(sentences)), ('seed', args.seed), ('workers', args.workers),
+    ('udfs', OrderedDict())])
+  tmp_dir = tempfile.mkdtemp(prefix='gdd_bench_')
+  for name, path in app_udfs():
+    if args.udfs and not re.search(args.udfs, name):
+      continue
+    rv = bench_udf(name, path, sentences, args, tmp_dir)
+    results['udfs'][name] = rv
+    if rv['status'] == 'ok':
+      print '%-45s %8d rows  %10.1f rows/s  startup %6.2fs  %8d KB' % (
+        name, rv['rows_in'], rv['rows_per_sec'], rv['startup_seconds'], rv['peak_rss_kb'])
+    else:
+      print '%-45s %s %s' % (name, rv['status'], rv.get('error', ''))
+    sys.stdout.flush()
+  if not os.path.isdir(RESULTS_DIR):
+    os.makedirs(RESULTS_DIR)
+  with open(results_path(label), 'w') as f:
+    json.dump(results, f, indent=2)
+  print 'results: %s' % results_path(label)
+
+
+def compare(args):
+  with open(results_path(args.base)) as f:
+    base = json.load(f, object_pairs_hook=OrderedDict)
+  with open(results_path(args.new)) as f:
+    new = json.load(f, object_pairs_hook=OrderedDict)
+  regressions = 0
+  print '%-45s %12s %12s %7s %9s %9s %7s' % ('udf', 'base rows/s', 'new rows/s', 'x', 'base KB', 'new KB', 'x')
+  for name, b in base['udfs'].iteritems():
+    n = new['udfs'].get(name)
+    if not n or b['status'] != 'ok' or n['status'] != 'ok':
+      print '%-45s %s -> %s' % (name, b['status'], n['status'] if n else 'absent')
+      continue
+    speed = n['rows_per_sec'] / max(b['rows_per_sec'], 1e-9)
+    size = n['peak_rss_kb'] / float(max(b['peak_rss_kb'], 1))
+    flag = ''
+    if speed < 1 - args.threshold or size > 1 + args.threshold:
+      flag = '  REGRESSION'
+      regressions += 1
+    print '%-45s %12.1f %12.1f %7.2f %9d %9d %7.2f%s' % (
+      name, b['rows_per_sec'], n['rows_per_sec'], speed, b['peak_rss_kb'], n['peak_rss_kb'], size, flag)
+  if base['sentences'] != new['sentences'] or base['corpus'] != new['corpus']:
+    print 'WARNING: the runs are on different inputs'
+  sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  commands = arg_parser.add_subparsers(dest='command')
+  generate_parser = commands.add_parser('generate', help='write a synthetic sentences_input TSV')
+  run_parser = commands.add_parser('run', help='benchmark the UDFs of app.ddlog')
+  for p in (generate_parser, run_parser):
+    p.add_argument('--sentences', type=int, default=2000)
+    p.add_argument('--seed', type=int, default=0)
+  run_parser.add_argument('--corpus', help='a recorded sentences_input TSV, instead of synthetic')
+  run_parser.add_argument('--udfs', help='only the UDFs matching this regex')
+  run_parser.add_argument('--workers', type=int, default=0)
+  run_parser.add_argument('--repeat', type=int, default=1)
+  run_parser.add_argument('--label', help='name of the results (default: git describe)')
+  compare_parser = commands.add_parser('compare', help='compare two results')
+  compare_parser.add_argument('base')
+  compare_parser.add_argument('new')
+  compare_parser.add_argument('--threshold', type=float, default=0.1)
+  args = arg_parser.parse_args()
+
+  if args.command == 'generate':
+    writer = util.TsvWriter(sys.stdout)
+    for s in synthetic_corpus(Dictionaries(), args.sentences, args.seed):
+      writer.write_line('\t'.join(tsv_value(getattr(s, c)) for c in SENTENCE_COLUMNS) + '\n')
+    writer.flush()
+  elif args.command == 'run':
+    run(args)
+  else:
+    compare(args)
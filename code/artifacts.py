@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Precompiled binary artifacts for the static dictionaries the UDFs load at startup.
+
+Every extractor process otherwise re-parses the same TSVs (HPO DAG, ENSEMBL gene map,
+PMID maps, stopwords...) on launch. Here each loader result is pickled once to
+onto/data/artifacts/<name>.pkl, stamped with ARTIFACT_VERSION, the hash of the source of
+the module defining its loader, and the size & mtime of the source files it was built
+from; the artifact is rebuilt automatically whenever the loader's module or one of these
+sources changes.
+
+Run as a script (see onto/make_all.sh) to (re)build all artifacts up front.
+"""
+import cPickle as pickle
+import os
+import sys
+
+import incremental
+
+APP_HOME = os.environ['GDD_HOME']
+
+# Bump this whenever the structure of a cached loader's return value changes
+ARTIFACT_VERSION = 3
+
+ARTIFACT_DIR = '%s/onto/data/artifacts' % APP_HOME
+
+# Set GDD_NO_ARTIFACTS=1 to always load from the source TSVs
+ENABLED = not os.environ.get('GDD_NO_ARTIFACTS')
+
+
+# The hash of the source of each module defining a loader, by path
+SOURCE_HASHES = {}
+
+
+def _source_hash(build_fn):
+  """The hash of the source of the module build_fn is defined in, or None if unknown"""
+  module = sys.modules.get(getattr(build_fn, '__module__', None))
+  path = getattr(module, '__file__', None)
+  if not path:
+    return None
+  if path.endswith(('.pyc', '.pyo')):
+    path = path[:-1]
+  if path not in SOURCE_HASHES:
+    with open(path, 'rb') as f:
+      SOURCE_HASHES[path] = incremental.content_hash(f.read())
+  return SOURCE_HASHES[path]
+
+
+def _fingerprint(sources, build_fn):
+  rv = []
+  for path in sources:
+    st = os.stat(path)
+    rv.append((os.path.abspath(path), st.st_size, st.st_mtime))
+  return (ARTIFACT_VERSION, _source_hash(build_fn), rv)
+
+
+def artifact_path(name):
+  return '%s/%s.pkl' % (ARTIFACT_DIR, name)
+
+
+def _read(name, fingerprint):
+  try:
+    with open(artifact_path(name), 'rb') as f:
+      if pickle.load(f) != fingerprint:
+        return False, None
+      return True, pickle.load(f)
+  except (IOError, EOFError, pickle.UnpicklingError):
+    return False, None
+
+
+def _write(name, fingerprint, value):
+  """Write atomically, as many extractor processes may start (and rebuild) at once"""
+  try:
+    if not os.path.isdir(ARTIFACT_DIR):
+      os.makedirs(ARTIFACT_DIR)
+    tmp_path = '%s.%d.tmp' % (artifact_path(name), os.getpid())
+    with open(tmp_path, 'wb') as f:
+      pickle.dump(fingerprint, f, pickle.HIGHEST_PROTOCOL)
+      pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, artifact_path(name))
+  except (IOError, OSError) as e:
+    sys.stderr.write('WARNING: could not write artifact %s: %s\n' % (name, e))
+
+
+def cached(name, sources, build_fn, *args):
+  """
+  Return build_fn(*args), loaded from the artifact `name` if it is up to date
+  w.r.t. the list of source file paths, else built and (re)written
+  """
+  incremental.depends_on(*sources)
+  if not ENABLED:
+    return build_fn(*args)
+  fingerprint = _fingerprint(sources, build_fn)
+  found, value = _read(name, fingerprint)
+  if found:
+    return value
+  value = build_fn(*args)
+  _write(name, fingerprint, value)
+  return value
+
+
+if __name__ == '__main__':
+  import data_util as dutil
+  import gene_extract_candidates
+  import pheno_extract_candidates
+
+  hpo_dag = dutil.read_hpo_dag()
+  dutil.get_hpo_phenos(hpo_dag)
+  dutil.read_hpo_synonyms()
+  dutil.read_hpo_synonyms(1)
+  dutil.load_pmid_to_hpo()
+  dutil.gene_symbol_to_ensembl_id_map()
+  gene_extract_candidates.read_pubmed_to_genes()
+  pheno_extract_candidates.load_static_data()
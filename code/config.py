@@ -342,6 +342,12 @@ GENE_PHENO = {
                               '{{G}}.*patients.*with.*{{P}}',
                               '{{P}}.*due to.*{{G}}'],
 
+    # How the Charite (hpo, gene) pairs are expanded up the HPO DAG (see dutil.GenePhenoIndex):
+    #   'parents': each term of a gene & its direct parents
+    #   'ancestors': each term & all of its ancestors, i.e. a pheno is Charite-linked to a gene
+    #                if it or any of its descendants is
+    'charite-expand' : 'parents',
+
     # Supervise GP pairs based on words (e.g. esp verbs) on the min dep path connecting them
     'dep-lemma-connectors' : {
       'pos' : [],
@@ -586,3 +592,70 @@ GENE_VARIANT_PHENO = {
   # # Features
   'F' : {}
 }
+
+# ## NEGATIVE SAMPLING (see sampling.py)
+SAMPLING = {
+  # Seed of all sampling decisions, which hash it with the mention / relation id
+  'seed' : 0,
+
+  # How candidate random negatives are balanced against positive examples:
+  #   'counters': with probabilities depending on the running pos - neg counts of each
+  #               process (reproducible, but dependent on input order & sharding)
+  #   'ratio': in two passes over all of the input. The counting pass (the UDF run with
+  #            --sampling-count, see the *_sampling_count extractors of application.conf)
+  #            records the numbers of positive, negative & candidate examples in <stats-dir>;
+  #            the sampling pass then keeps each candidate with the same fixed probability, to
+  #            hit 'neg-pos-ratio'. Without counts (e.g. app.ddlog runs each UDF once), each
+  #            process counts its own input before sampling it, see sampling.py
+  # 'ratio' is deterministic, independent of input order, and lets the gene & gene-pheno UDFs
+  # run with workers without balancing per chunk (see extractor_util.run_main_tsv)
+  'mode' : 'ratio',
+  'neg-pos-ratio' : 1.0,
+
+  # Relative to GDD_HOME; cleared before each counting pass (see util/sampling_count_before.sh)
+  'stats-dir' : 'sampling_stats'
+}
+
+# ## SUPERVISION RULE ORDER (see supervision_util.py)
+SUPERVISION = {
+  # The order in which the supervision rules of the gene, pheno & gene-pheno UDFs are tried:
+  #   'config': the order in which they are listed, as in the hand-written rule chains
+  #   'selective': each run of consecutive rules which give the same label is reordered,
+  #                cheapest & most selective first, from the calls, fires & times counted
+  #                (see --instrument). The labels are the same as in 'config' order, but the
+  #                supertype of a candidate which several rules of a run match may not be
+  'rule-order' : 'config',
+
+  # In 'selective' order, the number of candidates between reorderings
+  'reorder-every' : 1000
+}
+
+# ## FEATURE OUTPUT (all *_extract_features UDFs)
+FEATURES = {
+  # What the feature column of the feature tables holds:
+  #   'name': the feature name strings, e.g. GENE_L_WORD_[...]
+  #   'hash': stable, signed 64-bit hashes of the names (same id in every run & process)
+  #   'intern': integer ids 1, 2, ... in order of first appearance; these are only consistent
+  #             within one process, so use with parallelism: 1
+  'id-mode' : 'name',
+
+  # In 'hash' & 'intern' modes, each UDF process appends the id & name of each feature to its
+  # side table <names-dir>/<udf name>.<pid>.tsv (relative to GDD_HOME) when first seen
+  'names-dir' : 'feature_names'
+}
+
+# ## INCREMENTAL EXTRACTION (see incremental.py)
+INCREMENTAL = {
+  # Relative to GDD_HOME: the output of the rows processed by each UDF is kept in
+  # <cache-dir>/<udf name>/<fingerprint>/
+  'cache-dir' : 'incremental_cache',
+
+  # The number of fingerprint directories kept per UDF, the most recently used ones; those of
+  # older fingerprints, which are not reused, are removed when a UDF starts
+  'keep-fingerprints' : 2
+}
+
+# In the gene-pheno supervision rules & features, {{G}} and {{P}} stand for the gene and pheno
+# of the relation (see extractor_util.compile_rules). The rule groups are compiled by their
+# UDFs, see extractor_util.compile_rule_groups
+GP_TEMPLATE_PARAMS = ('G', 'P')
@@ -1,42 +1,235 @@
 """Miscellaneous shared tools for maniuplating data used in the UDFs"""
+from array import array
+import binascii
 from collections import defaultdict, namedtuple
+import artifacts
 import extractor_util as util
 import os
 import re
 import sys
+import zlib
 
 APP_HOME = os.environ['GDD_HOME']
 
 onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
 
+HPO_PHENOTYPES_TSV = '%s/onto/data/hpo_phenotypes.tsv' % APP_HOME
+
 class Dag:
-  """Class representing a directed acyclic graph."""
+  """
+  Class representing a directed acyclic graph.
+  Nodes are numbered in topological order (parents first), and the transitive closure is
+  precomputed once: the ancestors of each node (itself included) are a bitset over these ids,
+  so that has_child is a single bit test. Only the topological order is pickled along with
+  the DAG: recomputing the closure from it is a single cheap pass.
+  The closures stopping at a node (see ancestors) and the descendant bitsets are only built
+  when first asked for, and at most CLOSURE_CACHE_SIZE of the former are kept; the node sets
+  returned by ancestors & descendants are cached up to NODE_SET_CACHE_SIZE entries each.
+  """
+  CLOSURE_CACHE_SIZE = 2
+  NODE_SET_CACHE_SIZE = 4096
+
   def __init__(self, nodes, edges):
     self.nodes = nodes
-    self.node_set = set(nodes)
     self.edges = edges  # edges is dict mapping child to list of parents
-    self._has_child_memoizer = defaultdict(dict)
+    self.order = self._topological_order()
+    self.anc = self._closure()
+    self._init_caches()
+
+  def _init_caches(self):
+    self.node_set = set(self.nodes)
+    self.ids = dict((node, i) for i, node in enumerate(self.order))
+    self._closures = {}
+    self._desc = None
+    self._ancestors = {}
+    self._descendants = {}
+
+  def __getstate__(self):
+    return self.nodes, self.edges, self.order
+
+  def __setstate__(self, state):
+    self.nodes, self.edges, self.order = state
+    self.anc = self._closure()
+    self._init_caches()
+
+  def _topological_order(self):
+    """All nodes (and parents missing from nodes), each after all of its parents"""
+    order = []
+    seen = set()
+    for node in self.nodes:
+      if node in seen:
+        continue
+      seen.add(node)
+      stack = [(node, iter(self.edges.get(node, ())))]
+      while stack:
+        child, parents = stack[-1]
+        for parent in parents:
+          if parent not in seen:
+            seen.add(parent)
+            stack.append((parent, iter(self.edges.get(parent, ()))))
+            break
+        else:
+          stack.pop()
+          order.append(child)
+    return order
+
+  def _closure(self, stop=None):
+    """The ancestor bitset of each node id, not following the parents of node stop"""
+    ids = dict((node, i) for i, node in enumerate(self.order))
+    anc = []
+    for i, node in enumerate(self.order):
+      a = 1 << i
+      if node != stop:
+        for parent in self.edges.get(node, ()):
+          a |= anc[ids[parent]]
+      anc.append(a)
+    return anc
+
+  def _check(self, node):
+    if node not in self.node_set:
+      raise ValueError('"%s" not in the DAG.' % node)
+
+  def _nodes(self, bits):
+    return frozenset(self.order[i] for i, b in enumerate(reversed(bin(bits)[2:])) if b == '1')
 
   def has_child(self, parent, child):
     """Check if child is a child of parent."""
-    if child not in self.node_set:
-      raise ValueError('"%s" not in the DAG.' % child)
-    if parent not in self.node_set:
-      raise ValueError('"%s" not in the DAG.' % parent)
-    if child == parent:
-      return True
-    if child in self._has_child_memoizer[parent]:
-      return self._has_child_memoizer[parent][child]
-    for node in self.edges[child]:
-      if self.has_child(parent, node):
-        self._has_child_memoizer[parent][child] = True
-        return True
-    self._has_child_memoizer[parent][child] = False
-    return False
+    self._check(child)
+    self._check(parent)
+    return (self.anc[self.ids[child]] >> self.ids[parent]) & 1 == 1
 
+  def ancestors(self, node, stop=None):
+    """
+    The ancestors of node, including itself, as a frozenset; if stop is given, the ancestors
+    of stop (but not stop itself) are only included if they are reachable without passing
+    through stop
+    """
+    self._check(node)
+    key = (node, stop)
+    rv = self._ancestors.get(key)
+    if rv is None:
+      if len(self._ancestors) >= self.NODE_SET_CACHE_SIZE:
+        self._ancestors.clear()
+      rv = self._ancestors[key] = self._nodes(self.closure(stop)[self.ids[node]])
+    return rv
 
-def read_hpo_dag():
-  with open('%s/onto/data/hpo_phenotypes.tsv' % APP_HOME) as f:
+  def closure(self, stop=None):
+    """The ancestor bitset of each node id, not following the parents of node stop"""
+    if stop is None:
+      return self.anc
+    anc = self._closures.get(stop)
+    if anc is None:
+      if len(self._closures) >= self.CLOSURE_CACHE_SIZE:
+        self._closures.clear()
+      anc = self._closures[stop] = self._closure(stop)
+    return anc
+
+  def descendants(self, node):
+    """The descendants of node, including itself, as a frozenset"""
+    self._check(node)
+    rv = self._descendants.get(node)
+    if rv is None:
+      if self._desc is None:
+        desc = [1 << i for i in xrange(len(self.order))]
+        for i in xrange(len(self.order) - 1, -1, -1):
+          for parent in self.edges.get(self.order[i], ()):
+            desc[self.ids[parent]] |= desc[i]
+        self._desc = desc
+      if len(self._descendants) >= self.NODE_SET_CACHE_SIZE:
+        self._descendants.clear()
+      rv = self._descendants[node] = self._nodes(self._desc[self.ids[node]])
+    return rv
+
+  def most_specific(self, nodes, stop=None):
+    """
+    The nodes which have no (proper) descendant among nodes, as a set: one pass over the
+    ancestor bitsets, instead of a has_child check for each pair. If stop is given, descendants
+    are those of ancestors(node, stop). Nodes not in the DAG are kept
+    """
+    nodes = set(nodes)
+    anc = self.closure(stop)
+    proper_ancestors = 0
+    for node in nodes:
+      i = self.ids.get(node)
+      if i is not None:
+        proper_ancestors |= anc[i] ^ (1 << i)
+    return set(node for node in nodes
+               if node not in self.ids or not (proper_ancestors >> self.ids[node]) & 1)
+
+
+def get_parents(bottom_id, dag, root_id='HP:0000118'):
+  """The ancestors of an HPO term (itself included), not going up further than root_id"""
+  if bottom_id not in dag.node_set:
+    return set([bottom_id])
+  return set(dag.ancestors(bottom_id, stop=root_id))
+
+
+GENE_PHENO_EXPANSIONS = ('parents', 'ancestors')
+
+class GenePhenoIndex(object):
+  """
+  A set of (hpo id, gene) pairs, e.g. the Charite supervision pairs, expanded up a Dag: with
+  expand 'parents', each term of a gene is expanded with its direct parents, and with
+  'ancestors', with all of its ancestors, i.e. (hpo id, gene) holds if hpo id or any of its
+  descendants is linked to gene. Rather than a set of all of the expanded tuples, each gene
+  (interned) maps to a bitset over the ids of the Dag's nodes (see Dag), stored as a string of
+  little-endian bytes, so that a pair test is two dict lookups and a bit test. Terms missing
+  from the Dag get ids of their own
+  """
+  __slots__ = ('ids', 'genes', 'bits')
+
+  def __init__(self, pairs, dag, expand='parents'):
+    if expand not in GENE_PHENO_EXPANSIONS:
+      raise ValueError('Unknown gene-pheno expansion: %s' % expand)
+    self.ids = dag.ids
+    self.genes = {}
+    terms = []
+    for hpo_id, gene in pairs:
+      g = self.genes.setdefault(intern(gene), len(self.genes))
+      if g == len(terms):
+        terms.append(set())
+      terms[g].add(hpo_id)
+    extra_ids = {}
+    self.bits = []
+    for gene_terms in terms:
+      bits = 0
+      for hpo_id in gene_terms:
+        i = self.ids.get(hpo_id)
+        if i is None:
+          bits |= 1 << extra_ids.setdefault(hpo_id, len(self.ids) + len(extra_ids))
+        elif expand == 'ancestors':
+          bits |= dag.anc[i]
+        else:
+          bits |= 1 << i
+          for parent in dag.edges.get(hpo_id, ()):
+            bits |= 1 << self.ids[parent]
+      self.bits.append(_int_bytes(bits))
+    if extra_ids:
+      self.ids = dict(self.ids)
+      self.ids.update(extra_ids)
+
+  def __contains__(self, pair):
+    hpo_id, gene = pair
+    g = self.genes.get(gene)
+    i = self.ids.get(hpo_id)
+    if g is None or i is None:
+      return False
+    bits = self.bits[g]
+    j = i >> 3
+    return j < len(bits) and (ord(bits[j]) >> (i & 7)) & 1 == 1
+
+  def __len__(self):
+    """The number of (expanded) pairs"""
+    return sum(bin(long(binascii.hexlify(bits[::-1]), 16)).count('1') for bits in self.bits)
+
+def _int_bytes(n):
+  """The little-endian bytes of a positive int"""
+  h = '%x' % n
+  return binascii.unhexlify('0' * (len(h) & 1) + h)[::-1]
+
+
+def _read_hpo_dag_tsv():
+  with open(HPO_PHENOTYPES_TSV) as f:
     nodes = []
     edges = {}
     for line in f:
@@ -48,19 +241,33 @@ def read_hpo_dag():
         edges[child] = parents_str.split('|')
       else:
         edges[child] = []
-    return Dag(nodes, edges)
+    return nodes, edges
 
 
-def get_hpo_phenos(hpo_dag, parent='HP:0000118', exclude_parents=['HP:0002664', 'HP:0002527', 'HP:0012125']):
-  """Get only the children of 'Phenotypic Abnormality' (HP:0000118), excluding all children of neoplasm (0002664) and falls (0002527) and prostate cancer(HP:0012125). Now also excluding coronary artery disease, alzheimer's and pulmonary artery hypertension, and schizophrenia"""
+def _read_hpo_dag():
+  nodes, edges = _read_hpo_dag_tsv()
+  return Dag(nodes, edges)
+
+
+def read_hpo_dag():
+  return artifacts.cached('hpo_dag', [HPO_PHENOTYPES_TSV], _read_hpo_dag)
+
+
+def _get_hpo_phenos(hpo_dag, parent, exclude_parents):
   return [hpo_term for hpo_term in hpo_dag.nodes
           if (hpo_dag.has_child(parent, hpo_term) 
           and all([not hpo_dag.has_child(p, hpo_term) for p in exclude_parents]))]
 
 
-def read_hpo_synonyms(idx=2):
+def get_hpo_phenos(hpo_dag, parent='HP:0000118', exclude_parents=['HP:0002664', 'HP:0002527', 'HP:0012125']):
+  """Get only the children of 'Phenotypic Abnormality' (HP:0000118), excluding all children of neoplasm (0002664) and falls (0002527) and prostate cancer(HP:0012125). Now also excluding coronary artery disease, alzheimer's and pulmonary artery hypertension, and schizophrenia"""
+  name = 'hpo_phenos_' + '_'.join([parent] + list(exclude_parents)).replace(':', '')
+  return artifacts.cached(name, [HPO_PHENOTYPES_TSV], _get_hpo_phenos, hpo_dag, parent, exclude_parents)
+
+
+def _read_hpo_synonyms_tsv(idx):
   syn_dict = dict()
-  with open('%s/onto/data/hpo_phenotypes.tsv' % APP_HOME) as f:
+  with open(HPO_PHENOTYPES_TSV) as f:
     for line in f:
       toks = line.strip(' \r\n').split('\t')
       node = toks[0]
@@ -68,6 +275,9 @@ def read_hpo_synonyms(idx=2):
       syn_dict[node] = syn_str.split('|')
   return syn_dict
 
+def read_hpo_synonyms(idx=2):
+  return artifacts.cached('hpo_synonyms_%d' % idx, [HPO_PHENOTYPES_TSV], _read_hpo_synonyms_tsv, idx)
+
 def load_hgvs_to_hpo():
   hgvs_to_hpo = defaultdict(set)
   with open(onto_path('data/hgvs_to_hpo.tsv'), 'rb') as f:
@@ -76,8 +286,7 @@ def load_hgvs_to_hpo():
       hgvs_to_hpo[hgvs_id].update(hpo_id)
   return hgvs_to_hpo
 
-def load_pmid_to_hpo():
-  """Load map from Pubmed ID to HPO term (via MeSH)"""
+def _load_pmid_to_hpo_tsv():
   pmid_to_hpo = defaultdict(set)
   # XXX HACK Johannes. TODO. Get rid of this file, load the full table into the database
   with open(onto_path('data/hpo_to_pmid_via_mesh_with_doi.tsv')) as f:
@@ -86,6 +295,10 @@ def load_pmid_to_hpo():
       pmid_to_hpo[pmid].add(hpo_id)
   return pmid_to_hpo
 
+def load_pmid_to_hpo():
+  """Load map from Pubmed ID to HPO term (via MeSH)"""
+  return artifacts.cached('pmid_to_hpo', [onto_path('data/hpo_to_pmid_via_mesh_with_doi.tsv')], _load_pmid_to_hpo_tsv)
+
 
 def get_pubmed_id_for_doc(doc_id):
   """Because our doc_id is currently just the PMID, and we intend to KEEP it this way, return the doc_id here"""
@@ -102,26 +315,192 @@ def read_doi_to_pmid():
   return doi_to_pmid
 
 
-def gene_symbol_to_ensembl_id_map():
-  """Maps a gene symbol from CHARITE -> ensembl ID"""
-  with open('%s/onto/data/ensembl_genes.tsv' % util.APP_HOME) as f:
-    eid_map = defaultdict(set)
+class StringTable(object):
+  """An immutable list of strings, stored as one string and an array of their offsets"""
+  __slots__ = ('blob', 'offsets')
+
+  def __init__(self, strings):
+    self.offsets = array('I', [0])
+    blob = []
+    for string in strings:
+      blob.append(string)
+      self.offsets.append(self.offsets[-1] + len(string))
+    self.blob = ''.join(blob)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+  def __iter__(self):
+    for i in xrange(len(self)):
+      yield self[i]
+
+
+def _key_hash(key):
+  return zlib.crc32(key) & 0xffffffff
+
+
+class CompactSetMap(object):
+  """
+  A read-only map of string keys to sets of values, for the large dictionaries which every
+  UDF process keeps resident. Rather than a dict of sets of Python objects, the keys are stored
+  in one StringTable and found through an open addressing hash table (an array of key indexes,
+  with the (crc32) hashes of the keys alongside), and the values of all keys are small int
+  codes in one array, which subclasses decode (e.g. into entries of interned string tables,
+  see decode).
+  Lookups build the frozenset of the values of a key on demand: this reads like the
+  defaultdict(set) it replaces, except that looking up a missing key does not insert it
+  """
+  __slots__ = ('hashes', 'keys', 'offsets', 'codes', 'table')
+
+  def __init__(self, pairs):
+    """From (key, code) pairs, in any order; duplicates are dropped"""
+    self.hashes = array('I')
+    self.offsets = array('I')
+    self.codes = array('I')
+    keys = []
+    last = None
+    for entry in sorted(pairs):
+      if entry == last:
+        continue
+      if last is None or entry[0] != last[0]:
+        self.hashes.append(_key_hash(entry[0]))
+        self.offsets.append(len(self.codes))
+        keys.append(entry[0])
+      self.codes.append(entry[1])
+      last = entry
+    self.offsets.append(len(self.codes))
+    self.keys = StringTable(keys)
+
+    # At most half full, each slot holding 1 + the index of a key, or 0
+    size = 1
+    while size < 2 * len(keys):
+      size <<= 1
+    self.table = array('I', [0]) * size
+    for i, h in enumerate(self.hashes):
+      j = h & (size - 1)
+      while self.table[j]:
+        j = (j + 1) & (size - 1)
+      self.table[j] = i + 1
+
+  def index(self, key):
+    """The index of key (0 to len - 1, in key order), or -1"""
+    h = zlib.crc32(key) & 0xffffffff
+    table = self.table
+    mask = len(table) - 1
+    j = h & mask
+    i = table[j]
+    while i:
+      if self.hashes[i - 1] == h and self.keys[i - 1] == key:
+        return i - 1
+      j = (j + 1) & mask
+      i = table[j]
+    return -1
+
+  def decode(self, code):
+    return code
+
+  def key_codes(self, key):
+    """The (undecoded) codes of the values of key"""
+    i = self.index(key)
+    if i < 0:
+      return ()
+    return self.index_codes(i)
+
+  def index_codes(self, i):
+    """The (undecoded) codes of the values of the key of index i"""
+    return self.codes[self.offsets[i]:self.offsets[i + 1]]
+
+  def __contains__(self, key):
+    return self.index(key) >= 0
+
+  def __getitem__(self, key):
+    return frozenset(self.decode(code) for code in self.key_codes(key))
+
+  def get(self, key, default=None):
+    i = self.index(key)
+    if i < 0:
+      return default
+    return frozenset(self.decode(code) for code in self.index_codes(i))
+
+  def __len__(self):
+    return len(self.keys)
+
+  def __iter__(self):
+    return iter(self.keys)
+
+  def iterkeys(self):
+    return iter(self.keys)
+
+
+class StringSetMap(CompactSetMap):
+  """A CompactSetMap of strings to sets of strings, each distinct value being stored once"""
+  __slots__ = ('values',)
+
+  def __init__(self, pairs):
+    """From (key, value) pairs, in any order"""
+    ids = {}
+    CompactSetMap.__init__(self, ((key, ids.setdefault(value, len(ids))) for key, value in pairs))
+    self.values = StringTable(sorted(ids, key=ids.get))
+
+  def decode(self, code):
+    return self.values[code]
+
+
+class GeneNameMap(CompactSetMap):
+  """
+  The CompactSetMap of gene names to sets of (ensembl id, canonical name, mapping type) of
+  gene_symbol_to_ensembl_id_map. Each gene (ensembl id & canonical name) is stored once, and
+  the code of a value is its gene index followed by MAPPING_TYPE_BITS bits of mapping type
+  index (see mapping_types)
+  """
+  __slots__ = ('eids', 'canonical_names', 'mapping_types')
+  MAPPING_TYPE_BITS = 4
+
+  def __init__(self, entries):
+    """From (eid, canonical_name, gene_name, mapping_type) entries"""
+    genes = {}
+    types = {}
+    def codes():
+      for eid, canonical_name, gene_name, mapping_type in entries:
+        gene = genes.setdefault((eid, canonical_name), len(genes))
+        mapping = types.setdefault(mapping_type, len(types))
+        yield gene_name, (gene << self.MAPPING_TYPE_BITS) | mapping
+    CompactSetMap.__init__(self, codes())
+    if len(types) > 1 << self.MAPPING_TYPE_BITS:
+      raise ValueError('Too many gene mapping types: %s' % ', '.join(sorted(types)))
+    genes = sorted(genes, key=genes.get)
+    self.eids = StringTable(eid for eid, _ in genes)
+    self.canonical_names = StringTable(name for _, name in genes)
+    self.mapping_types = tuple(sorted(types, key=types.get))
+
+  def decode(self, code):
+    gene = code >> self.MAPPING_TYPE_BITS
+    return (self.eids[gene], self.canonical_names[gene],
+            self.mapping_types[code & ((1 << self.MAPPING_TYPE_BITS) - 1)])
+
+  def index_mapping_types(self, i):
+    """The set of mapping types of the name of index i"""
+    mask = (1 << self.MAPPING_TYPE_BITS) - 1
+    return set(self.mapping_types[code & mask] for code in self.index_codes(i))
+
+
+def _gene_symbol_to_ensembl_id_map_tsv():
+  def entries(f):
     for line in f:
       eid_canonical, gene_name, mapping_type = line.rstrip('\n').split('\t')
       eid = eid_canonical.split(':')[0]
       canonical_name = eid_canonical.split(':')[1]
-      eid_map[gene_name].add((eid, canonical_name, mapping_type))
+      yield eid, canonical_name, gene_name, mapping_type
       # XXX HACK Johannes: Maybe we shouldn't decide on case sensitivity in this helper method (?)
       # if mapping_type == 'CANONICAL_SYMBOL':
-      #   eid_map[gene_name.lower()].add((eid, canonical_name, mapping_type))
-  return eid_map
+      #   yield eid, canonical_name, gene_name.lower(), mapping_type
+  with open('%s/onto/data/ensembl_genes.tsv' % util.APP_HOME) as f:
+    return GeneNameMap(entries(f))
 
-def get_parents(bottom_id, dag, root_id='HP:0000118'):
-    if bottom_id == root_id:
-      return set([bottom_id])
-    rv = set()
-    if bottom_id in dag.edges:
-      for parent in dag.edges[bottom_id]:
-        rv |= get_parents(parent, dag)
-    rv.add(bottom_id)
-    return rv
+def gene_symbol_to_ensembl_id_map():
+  """Maps a gene symbol from CHARITE -> ensembl ID (a GeneNameMap)"""
+  return artifacts.cached('gene_symbol_to_ensembl_id_map', ['%s/onto/data/ensembl_genes.tsv' % util.APP_HOME],
+                          _gene_symbol_to_ensembl_id_map_tsv)
@@ -44,6 +44,74 @@ def load_dictionary_map(synonyms):
     syn = synonyms[key]
     dictionaries[key] = frozenset(syn)
 
+
+class DictionaryIndex(object):
+    """Inverted index from phrase to the ids of the dictionaries containing it
+    (in the iteration order of dictionaries), built from the current dictionaries.
+    """
+    def __init__(self):
+        self.dicts = list(dictionaries.items())
+        self.phrase_dicts = dict()
+        # Max. number of spaces in a phrase, bounding the n-grams which can match
+        self.max_spaces = 0
+        for dict_id, dictionary in self.dicts:
+            for phrase in dictionary:
+                self.phrase_dicts.setdefault(phrase, []).append(dict_id)
+                if isinstance(phrase, basestring):
+                    self.max_spaces = max(self.max_spaces, phrase.count(" "))
+                else:
+                    self.max_spaces = MAX_KW_LENGTH
+        self.first_dict = dict(
+            (phrase, ids[0]) for phrase, ids in self.phrase_dicts.iteritems())
+
+    def is_current(self):
+        return len(self.dicts) == len(dictionaries) and all(
+            dictionaries.get(dict_id) is d for dict_id, d in self.dicts)
+
+
+class SentenceIndex(object):
+    """Per-sentence precomputation shared by the mention and relation feature
+    generators: the dictionary hits of all the lemma n-grams (as scanned by
+    get_substring_indices), and memoized dependency paths between words.
+    """
+    def __init__(self, sentence, dict_index):
+        self.sentence = sentence
+        self.dict_index = dict_index
+        self.lemmas = [str(w.lemma) for w in sentence]
+        # (begin, end, id of the first dictionary containing the n-gram)
+        self.kw_hits = []
+        for (i, j) in get_substring_indices(len(sentence), MAX_KW_LENGTH):
+            if j - i - 1 > dict_index.max_spaces:
+                continue
+            dict_id = dict_index.first_dict.get(" ".join(self.lemmas[i:j]))
+            if dict_id is not None:
+                self.kw_hits.append((i, j, dict_id))
+        self.dep_paths = dict()
+
+    def dep_path(self, i, j):
+        path = self.dep_paths.get((i, j))
+        if path is None:
+            path = self.dep_paths[(i, j)] = dep_path_between_words(
+                self.sentence, i, j)
+        return path
+
+
+_index = {"dictionaries": None, "sentence": None}
+
+
+def get_sentence_index(sentence):
+    """Return the SentenceIndex of the sentence, reusing the last one built if
+    it is for the same sentence object (and the dictionaries are unchanged)"""
+    dict_index = _index["dictionaries"]
+    if dict_index is None or not dict_index.is_current():
+        dict_index = _index["dictionaries"] = DictionaryIndex()
+        _index["sentence"] = None
+    sentence_index = _index["sentence"]
+    if sentence_index is None or sentence_index.sentence is not sentence:
+        sentence_index = _index["sentence"] = SentenceIndex(
+            sentence, dict_index)
+    return sentence_index
+
 def get_generic_features_mention(sentence, span, length_bin_size=5):
     """Yield 'generic' features for a mention in a sentence.
 
@@ -65,23 +133,16 @@ def get_generic_features_mention(sentence, span, length_bin_size=5):
         yield dict_indicator_feat
     # Dependency path(s) from mention to keyword(s). Various transformations of
     # the dependency path are done.
-    for (i, j) in get_substring_indices(len(sentence), MAX_KW_LENGTH):
+    for (i, j, dict_id) in get_sentence_index(sentence).kw_hits:
         if i >= span.begin_word_id and i < span.begin_word_id + span.length:
             continue
         if j > span.begin_word_id and j < span.begin_word_id + span.length:
             continue
-        is_in_dictionary = False
-        for dict_id in dictionaries:
-            if " ".join(map(lambda x: str(x.lemma), sentence[i:j])) in \
-                    dictionaries[dict_id]:
-                is_in_dictionary = True
-                yield "KW_IND_[" + dict_id + "]"
-                break
-        if is_in_dictionary:
-            kw_span = Span(begin_word_id=i, length=j-i)
-            for dep_path_feature in get_min_dep_path_features(
-                    sentence, span, kw_span, "KW"):
-                yield dep_path_feature
+        yield "KW_IND_[" + dict_id + "]"
+        kw_span = Span(begin_word_id=i, length=j-i)
+        for dep_path_feature in get_min_dep_path_features(
+                sentence, span, kw_span, "KW"):
+            yield dep_path_feature
     # The mention starts with a capital
     if sentence[span.begin_word_id].word[0].isupper():
         yield "STARTS_WITH_CAPITAL"
@@ -91,7 +152,64 @@ def get_generic_features_mention(sentence, span, length_bin_size=5):
     length_feat = "LENGTH_" + str(bin_id)
     yield length_feat
 
-def get_generic_features_relation(sentence, span1, span2, length_bin_size=5):
+# The feature families of get_generic_features_relation which can be skipped,
+# with the prefix of all their feature names (after "INV_" for inverted spans)
+RELATION_FEATURE_FAMILIES = {
+    "IS_INVERTED": "IS_INVERTED",
+    "WORD_SEQ": "WORD_SEQ_[",
+    "LEMMA_SEQ": "LEMMA_SEQ_[",
+    "NER_SEQ": "NER_SEQ_[",
+    "POS_SEQ": "POS_SEQ_[",
+    "NGRAM": "NGRAM_",
+    "IN_DICT": "IN_DICT_[",
+    "BETW": "BETW_",
+    "KW_IND": "KW_IND_[",
+    "KW": "KW_",
+    "STARTS_WITH_CAPITAL": "STARTS_WITH_CAPITAL_[",
+    "LENGTHS": "LENGTHS_[",
+}
+
+
+def _literal_prefix(pattern):
+    """Return the string which pattern matches exactly (or as a prefix, for a
+    pattern ending with '.*'), or None if it is not such a literal pattern"""
+    if pattern.endswith(".*") and not pattern.endswith("\\.*"):
+        pattern = pattern[:-2]
+    literal = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                return None
+            literal.append(pattern[i + 1])
+            i += 2
+            continue
+        if c in ".^$*+?{}[]|()":
+            return None
+        literal.append(c)
+        i += 1
+    return "".join(literal)
+
+
+def filtered_families(patterns, families=RELATION_FEATURE_FAMILIES,
+                      prefixes=("", "INV_")):
+    """Return the names of the feature families all of whose features would be
+    matched (with re.match) by one of the regex patterns, for all prefixes.
+    These families can be skipped when the patterns are used to filter out
+    features, see get_generic_features_relation.
+    """
+    literals = [l for l in map(_literal_prefix, patterns) if l is not None]
+    rv = set()
+    for name, family_prefix in families.iteritems():
+        if all(any((prefix + family_prefix).startswith(l) for l in literals)
+               for prefix in prefixes):
+            rv.add(name)
+    return rv
+
+
+def get_generic_features_relation(sentence, span1, span2, length_bin_size=5,
+                                  skip=()):
     """Yield 'generic' features for a relation in a sentence.
 
     Args:
@@ -99,6 +217,8 @@ def get_generic_features_relation(sentence, span1, span2, length_bin_size=5):
         span1: the first Span of the relation
         span2: the second Span of the relation
         length_bin_size: the size of the bins for the length feature
+        skip: (optional) names of feature families (see
+            RELATION_FEATURE_FAMILIES) not to generate
     """
     # Check whether the order of the spans is inverted. We use this information
     # to add a prefix to *all* the features.
@@ -111,102 +231,106 @@ def get_generic_features_relation(sentence, span1, span2, length_bin_size=5):
     end = order[3]
     if begin == span2.begin_word_id:
         inverted = "INV_"
-        yield "IS_INVERTED"
+        if "IS_INVERTED" not in skip:
+            yield "IS_INVERTED"
     else:
         inverted = ""
     betw_span = Span(begin_word_id=betw_begin, length=betw_end - betw_begin)
     covering_span = Span(begin_word_id=begin, length=end - begin)
     # Words, Lemmas, Ners, and Poses sequence between the mentions
-    for seq_feat in get_seq_features(sentence, betw_span):
+    for seq_feat in get_seq_features(sentence, betw_span, skip=skip):
         yield inverted + seq_feat
     # Window feature (left and right, up to size 3, combined)
     for window_feat in get_window_features(
             sentence, covering_span, isolated=False):
         yield inverted + window_feat
     # Ngrams of up to size 3 between the mentions
-    for ngram_feat in get_ngram_features(sentence, betw_span):
-        yield inverted + ngram_feat
+    if "NGRAM" not in skip:
+        for ngram_feat in get_ngram_features(sentence, betw_span):
+            yield inverted + ngram_feat
     # Indicator features of whether the mentions are in dictionaries
-    found1 = False
-    for feat1 in get_dictionary_indicator_features(
-            sentence, span1, prefix=inverted + "IN_DICT"):
-        found1 = True
-        found2 = False
-        for feat2 in get_dictionary_indicator_features(
-                sentence, span2, prefix=""):
-            found2 = True
-            yield feat1 + feat2
-        if not found2:
-            yield feat1 + "_[_NONE]"
+    found1 = "IN_DICT" in skip
+    if not found1:
+        for feat1 in get_dictionary_indicator_features(
+                sentence, span1, prefix=inverted + "IN_DICT"):
+            found1 = True
+            found2 = False
+            for feat2 in get_dictionary_indicator_features(
+                    sentence, span2, prefix=""):
+                found2 = True
+                yield feat1 + feat2
+            if not found2:
+                yield feat1 + "_[_NONE]"
     if not found1:
         for feat2 in get_dictionary_indicator_features(
                 sentence, span2, prefix=""):
             found2 = True
             yield inverted + "IN_DICT_[_NONE]" + feat2
     # Dependency path (and transformations) between the mention
-    for betw_dep_path_feature in get_min_dep_path_features(
-            sentence, span1, span2, inverted + "BETW"):
-        yield betw_dep_path_feature
+    if "BETW" not in skip:
+        for betw_dep_path_feature in get_min_dep_path_features(
+                sentence, span1, span2, inverted + "BETW"):
+            yield betw_dep_path_feature
     # Dependency paths (and transformations) between the mentions and keywords
-    for (i, j) in get_substring_indices(len(sentence), MAX_KW_LENGTH):
+    first_dict = get_sentence_index(sentence).dict_index.first_dict
+    kw_hits = get_sentence_index(sentence).kw_hits
+    if "KW_IND" in skip and "KW" in skip:
+        kw_hits = []
+    for (i, j, dict_id) in kw_hits:
         if (i >= begin and i < betw_begin) or (i >= betw_end and i < end):
             continue
         if (j > begin and j <= betw_begin) or (j > betw_end and j <= end):
             continue
-        is_in_dictionary = False
-        for dict_id in dictionaries:
-            if " ".join(map(lambda x: str(x.lemma), sentence[i:j])) in \
-                    dictionaries[dict_id]:
-                is_in_dictionary = True
-                yield inverted + "KW_IND_[" + dict_id + "]"
-                break
-        if is_in_dictionary:
-            kw_span = Span(begin_word_id=i, length=j-i)
-            path1 = get_min_dep_path(sentence, span1, kw_span)
-            lemmas1 = []
-            labels1 = []
-            for edge in path1:
-                lemmas1.append(str(edge.word2.lemma))
-                labels1.append(edge.label)
-            both1 = []
-            for j in range(len(labels1)):
-                both1.append(labels1[j])
-                both1.append(lemmas1[j])
-            both1 = both1[:-1]
-            path2 = get_min_dep_path(sentence, span2, kw_span)
-            lemmas2 = []
-            labels2 = []
-            for edge in path2:
-                lemmas2.append(str(edge.word2.lemma))
-                labels2.append(edge.label)
-            both2 = []
-            for j in range(len(labels2)):
-                both2.append(labels2[j])
-                both2.append(lemmas2[j])
-            both2 = both2[:-1]
-            yield inverted + "KW_[" + " ".join(both1) + "]_[" + \
-                " ".join(both2) + "]"
-            yield inverted + "KW_L_[" + " ".join(labels1) + "]_[" + \
-                " ".join(labels2) + "]"
-            for j in range(1, len(both1), 2):
-                for dict_id in dictionaries:
-                    if both1[j] in dictionaries[dict_id]:
-                        both1[j] = "DICT_" + str(dict_id)
-                        break  # Picking up the first dictionary we find
-            for j in range(1, len(both2), 2):
-                for dict_id in dictionaries:
-                    if both2[j] in dictionaries[dict_id]:
-                        both2[j] = "DICT_" + str(dict_id)
-                        break  # Picking up the first dictionary we find
-            yield inverted + "KW_D_[" + " ".join(both1) + "]_[" + \
-                " ".join(both2) + "]"
+        if "KW_IND" not in skip:
+            yield inverted + "KW_IND_[" + dict_id + "]"
+        if "KW" in skip:
+            continue
+        kw_span = Span(begin_word_id=i, length=j-i)
+        path1 = get_min_dep_path(sentence, span1, kw_span)
+        lemmas1 = []
+        labels1 = []
+        for edge in path1:
+            lemmas1.append(str(edge.word2.lemma))
+            labels1.append(edge.label)
+        both1 = []
+        for j in range(len(labels1)):
+            both1.append(labels1[j])
+            both1.append(lemmas1[j])
+        both1 = both1[:-1]
+        path2 = get_min_dep_path(sentence, span2, kw_span)
+        lemmas2 = []
+        labels2 = []
+        for edge in path2:
+            lemmas2.append(str(edge.word2.lemma))
+            labels2.append(edge.label)
+        both2 = []
+        for j in range(len(labels2)):
+            both2.append(labels2[j])
+            both2.append(lemmas2[j])
+        both2 = both2[:-1]
+        yield inverted + "KW_[" + " ".join(both1) + "]_[" + \
+            " ".join(both2) + "]"
+        yield inverted + "KW_L_[" + " ".join(labels1) + "]_[" + \
+            " ".join(labels2) + "]"
+        # Picking up the first dictionary we find
+        for j in range(1, len(both1), 2):
+            if both1[j] in first_dict:
+                both1[j] = "DICT_" + str(first_dict[both1[j]])
+        for j in range(1, len(both2), 2):
+            if both2[j] in first_dict:
+                both2[j] = "DICT_" + str(first_dict[both2[j]])
+        yield inverted + "KW_D_[" + " ".join(both1) + "]_[" + \
+            " ".join(both2) + "]"
     # The mentions start with a capital letter
-    first_capital = sentence[span1.begin_word_id].word[0].isupper()
-    second_capital = sentence[span2.begin_word_id].word[0].isupper()
-    capital_feat = inverted + "STARTS_WITH_CAPITAL_[" + str(first_capital) + \
-        "_" + str(second_capital) + "]"
-    yield capital_feat
+    if "STARTS_WITH_CAPITAL" not in skip:
+        first_capital = sentence[span1.begin_word_id].word[0].isupper()
+        second_capital = sentence[span2.begin_word_id].word[0].isupper()
+        capital_feat = inverted + "STARTS_WITH_CAPITAL_[" + \
+            str(first_capital) + "_" + str(second_capital) + "]"
+        yield capital_feat
     # The lengths of the mentions
+    if "LENGTHS" in skip:
+        return
     first_length = len(" ".join(materialize_span(
         sentence, span1, lambda x: str(x.word))))
     second_length = len(" ".join(materialize_span(
@@ -256,12 +380,13 @@ def get_min_dep_path(sentence, span1, span2):
         span2: the second Span
     Returns: a list of DepEdge objects
     """
+    index = get_sentence_index(sentence)
     min_path = None
     min_path_length = 200  # ridiculously high number?
     for i in range(span1.begin_word_id, span1.begin_word_id + span1.length):
         for j in range(
                 span2.begin_word_id, span2.begin_word_id + span2.length):
-            p = dep_path_between_words(sentence, i, j)
+            p = index.dep_path(i, j)
             if len(p) < min_path_length:
                 min_path = p
     return min_path
@@ -295,15 +420,15 @@ def get_min_dep_path_features(sentence, span1, span2, prefix="BETW_"):
         both = both[:-1]
         yield prefix + "_[" + " ".join(both) + "]"
         yield prefix + "_L_[" + " ".join(min_path_labels) + "]"
+        # Picking up the first dictionary we find
+        first_dict = get_sentence_index(sentence).dict_index.first_dict
         for j in range(1, len(both), 2):
-            for dict_id in dictionaries:
-                if both[j] in dictionaries[dict_id]:
-                    both[j] = "DICT_" + str(dict_id)
-                    break  # Picking up the first dictionary we find
+            if both[j] in first_dict:
+                both[j] = "DICT_" + str(first_dict[both[j]])
         yield prefix + "_D_[" + " ".join(both) + "]"
 
 
-def get_seq_features(sentence, span):
+def get_seq_features(sentence, span, skip=()):
     """Yield the sequence features in a Span
 
     These include:
@@ -315,19 +440,25 @@ def get_seq_features(sentence, span):
     Args:
         sentence: a list of Word objects
         span: the Span
+        skip: (optional) names of the sequence features not to generate, e.g.
+            "NER_SEQ"
     """
-    word_seq_feat = "WORD_SEQ_[" + " ".join(materialize_span(
-        sentence, span, lambda x: x.word)) + "]"
-    yield word_seq_feat
-    lemma_seq_feat = "LEMMA_SEQ_[" + " ".join(materialize_span(
-        sentence, span, lambda x: str(x.lemma))) + "]"
-    yield lemma_seq_feat
-    ner_seq_feat = "NER_SEQ_[" + " ".join(materialize_span(
-        sentence, span, lambda x: str(x.ner))) + "]"
-    yield ner_seq_feat
-    pos_seq_feat = "POS_SEQ_[" + " ".join(materialize_span(
-        sentence, span, lambda x: str(x.pos))) + "]"
-    yield pos_seq_feat
+    if "WORD_SEQ" not in skip:
+        word_seq_feat = "WORD_SEQ_[" + " ".join(materialize_span(
+            sentence, span, lambda x: x.word)) + "]"
+        yield word_seq_feat
+    if "LEMMA_SEQ" not in skip:
+        lemma_seq_feat = "LEMMA_SEQ_[" + " ".join(materialize_span(
+            sentence, span, lambda x: str(x.lemma))) + "]"
+        yield lemma_seq_feat
+    if "NER_SEQ" not in skip:
+        ner_seq_feat = "NER_SEQ_[" + " ".join(materialize_span(
+            sentence, span, lambda x: str(x.ner))) + "]"
+        yield ner_seq_feat
+    if "POS_SEQ" not in skip:
+        pos_seq_feat = "POS_SEQ_[" + " ".join(materialize_span(
+            sentence, span, lambda x: str(x.pos))) + "]"
+        yield pos_seq_feat
 
 
 def get_window_features(
@@ -430,13 +561,13 @@ the dictionaries
         window: the maximum size of a substring
         prefix: a string to prepend to all yielded features
     """
+    index = get_sentence_index(sentence)
     in_dictionaries = set()
     for i in range(window + 1):
         for j in range(span.length - i):
-            phrase = " ".join(map(lambda x: str(x.lemma), sentence[j:j+i+1]))
-            for dict_id in dictionaries:
-                if phrase in dictionaries[dict_id]:
-                    in_dictionaries.add(dict_id)
+            phrase = " ".join(index.lemmas[j:j+i+1])
+            for dict_id in index.dict_index.phrase_dicts.get(phrase, ()):
+                in_dictionaries.add(dict_id)
     for dict_id in in_dictionaries:
         yield prefix + "_[" + str(dict_id) + "]"
     # yield prefix + "_JOIN_[" + " ".join(
@@ -1,9 +1,88 @@
 #! /usr/bin/env python
 
-import numpy as np
 from alignment_util import AlignmentMixin, MatchCell
+import numpy as np
 import sys
-import copy
+
+# The id of the words, lemmas & POS tags of a tree which are not in the vocab of the tree it is
+# aligned to (see MatchTreeIndex), and so match none of its own
+UNKNOWN_ID = -2
+
+# The instruction stored for direct matches; their full match type is built on demand (see
+# MultiDepAlignment._match_type)
+MATCH = '_match'
+
+class MatchTreeIndex:
+  """
+  The per-node data of one side of alignments, precomputed once so that it can be shared by
+  all alignments against the same tree (e.g. the example tree, aligned with every candidate):
+  each cell's words with their lemma, POS tag, candidate & dictionary signatures, the
+  children of each node and the cost of skipping each node.
+  The words of all cells are also encoded as flat arrays of ids (one entry per word slot,
+  the slots of node n starting at offsets[n - 1]), to score all pairs of cells at once: ids
+  interned in a vocab of this tree's own, or looked up in the vocab of the index of the tree
+  this one is aligned to, if given, so that aligning many trees to one does not grow it
+  """
+  def __init__(self, mt_root, match_tree, num_cands, dicts, vocab=None):
+    for d in dicts:
+      assert isinstance(d, set)
+    self.mt_root = mt_root
+    self.match_tree = match_tree
+    self.num_cands = num_cands
+    self.dicts = dicts
+    self.empty_cell = MatchCell(match_tree[0].size)
+    # Node 0 is the empty cell
+    self.cells = [self.empty_cell] + list(match_tree)
+    self.words = [self._cell_words(cell) for cell in self.cells]
+    self.child_sets = [set(cell.children) for cell in self.cells]
+    self.skip_scores = []
+    self.skip_types = []
+    for cell in self.cells:
+      self.skip_scores.append(MultiDepAlignment.skip_score * len([w for w in cell.words if w is not None]))
+      self.skip_types.append(''.join(('[skip%d]' if word is not None else '[zero%d]') % i \
+                                     for i, word in enumerate(cell.words)))
+    self.interning = vocab is None
+    self.vocab = {} if vocab is None else vocab
+    self._encode()
+
+  def _dict_ids(self, word):
+    return frozenset(k for k, d in enumerate(self.dicts) if word in d)
+
+  def _encode(self):
+    slots = [w for ws in self.words[1:] for w in ws]
+    self.offsets = np.cumsum([0] + [len(ws) for ws in self.words[1:-1]])
+    self.gaps = np.array([w is None for w in slots], dtype=bool)
+    if self.interning:
+      id_of = lambda value: self.vocab.setdefault(value, len(self.vocab))
+    else:
+      id_of = lambda value: self.vocab.get(value, UNKNOWN_ID)
+    def ids(k, default):
+      return np.array([default if w is None else id_of(w[k]) for w in slots], dtype=np.int64)
+    self.word_ids = ids(0, -1)
+    self.lemma_ids = ids(1, -1)
+    self.pos_ids = ids(2, -1)
+    self.cand_ids = np.array([-1 if w is None or w[3] is None else w[3] for w in slots],
+                             dtype=np.int64)
+    self.shorts = np.array([w is not None and w[4] for w in slots], dtype=bool)
+    # Dictionary signatures as bitmasks (of python longs, if there are too many dictionaries)
+    dtype = np.int64 if len(self.dicts) < 63 else object
+    def masks(k):
+      return np.array([0 if w is None else sum(1 << d for d in w[k]) for w in slots], dtype=dtype)
+    self.word_dicts = masks(5)
+    self.lemma_dicts = masks(6)
+
+  def _cell_words(self, cell):
+    """(word, lemma, POS tag, candidate, is short word, word dicts, lemma dicts) per word"""
+    rv = []
+    for i, word in enumerate(cell.words):
+      if word is None:
+        rv.append(None)
+        continue
+      cand = cell.cands[i] if cell.cands[i] in xrange(self.num_cands) else None
+      lemma = cell.lemmas[i]
+      rv.append((word, lemma, cell.pos_tags[i], cand, lemma in MultiDepAlignment.short_words,
+                 self._dict_ids(word), self._dict_ids(lemma)))
+    return rv
 
 class MultiDepAlignment(AlignmentMixin):
 
@@ -18,93 +97,117 @@ class MultiDepAlignment(AlignmentMixin):
   short_words = set([',', '.', '-lrb-', '-rrb-', 'is', 'the', 'of', 'for', \
                      'with', 'on', 'to', 'from', 'in', 'a', 'an', 'at', 'and', 'by', 'be', 'we'])
 
-  def __init__(self, mt_root1, match_tree1, mt_root2, match_tree2, num_cands, dicts):
+  def __init__(self, mt_root1, match_tree1, mt_root2, match_tree2, num_cands, dicts, index1=None):
+    """
+    Align match tree 2 to match tree 1; index1 is the MatchTreeIndex of tree 1, if it has been
+    precomputed
+    """
     self.match_tree1 = match_tree1
     self.match_tree2 = match_tree2
     self.dicts = dicts
     self.num_cands = num_cands
 
-    self.empty_cell1 = MatchCell(match_tree1[0].size)
-    self.empty_cell2 = MatchCell(match_tree2[0].size)
+    if index1 is None:
+      index1 = MatchTreeIndex(mt_root1, match_tree1, num_cands, dicts)
+    assert index1.match_tree is match_tree1 and index1.num_cands == num_cands
+    self.index1 = index1
+    self.index2 = MatchTreeIndex(mt_root2, match_tree2, num_cands, dicts, vocab=index1.vocab)
+    self.empty_cell1 = index1.empty_cell
+    self.empty_cell2 = self.index2.empty_cell
 
-    self.score_matrix = np.empty((len(match_tree1) + 1, len(match_tree2) + 1))
-    self.score_matrix[:] = np.inf
-    self.path_matrix = [[('_', 0) for _ in xrange(len(match_tree2) + 1)] for _ in xrange(len(match_tree1) + 1)]
-    for d in dicts:
-      assert isinstance(d, set)
+    # Scores & (match type, successors) of each pair of nodes, flattened row-major
+    self.n2 = len(match_tree2) + 1
+    self.scores = [None] * ((len(match_tree1) + 1) * self.n2)
+    self.paths = [('_', 0)] * len(self.scores)
 
     self.mt_root1 = mt_root1
     self.mt_root2 = mt_root2
 
-    self._h(self.mt_root1, self.mt_root2, forbidden1=set(), forbidden2=set())
+    self.direct_scores = self._direct_scores()
+    self._h(self.mt_root1, self.mt_root2)
 
   def get_match_cell1(self, mt_node1):
-    if mt_node1 == 0:
-      return self.empty_cell1
-    else:
-      return self.match_tree1[mt_node1 - 1]
+    return self.index1.cells[mt_node1]
 
   def get_match_cell2(self, mt_node2):
-    if mt_node2 == 0:
-      return self.empty_cell2
-    else:
-      return self.match_tree2[mt_node2 - 1]
+    return self.index2.cells[mt_node2]
+
+  def _path(self, mt_node1, mt_node2, match_type=True):
+    """The (instruction, successors) of a pair of nodes; unless match_type is set, the
+    instruction of a direct match is just MATCH"""
+    instr, succ = self.paths[mt_node1 * self.n2 + mt_node2]
+    if match_type and instr == MATCH:
+      instr = self._match_type(mt_node1, mt_node2)
+    return instr, succ
+
+  def _direct_scores(self):
+    """
+    The direct match scores of all pairs of nodes (see _match_type for the score of each pair
+    of words), as a list of rows indexed by node1 then node2 (node 0 scoring 0)
+    """
+    a, b = self.index1, self.index2
+    gaps1, gaps2 = a.gaps[:, None], b.gaps[None, :]
+    same_pos = a.pos_ids[:, None] == b.pos_ids[None, :]
+    # The first of these conditions which holds for a pair of words sets its score
+    conditions = [gaps1 & gaps2,
+                  gaps1 | gaps2,
+                  (a.cand_ids[:, None] >= 0) & (a.cand_ids[:, None] == b.cand_ids[None, :]),
+                  same_pos & a.shorts[:, None] & b.shorts[None, :],
+                  same_pos & (a.word_ids[:, None] == b.word_ids[None, :]),
+                  same_pos & (a.lemma_ids[:, None] == b.lemma_ids[None, :]),
+                  (a.word_dicts[:, None] & b.word_dicts[None, :]) != 0,
+                  (a.lemma_dicts[:, None] & b.lemma_dicts[None, :]) != 0,
+                  same_pos]
+    choices = [0, self.skip_score, self.cand_match_score, 0, self.word_match_score,
+               self.lemma_match_score, self.dict_match_score, self.dict_match_score,
+               self.pos_tag_match_score]
+    word_scores = np.select(conditions, choices, self.mismatch_score)
+    cell_scores = np.add.reduceat(np.add.reduceat(word_scores, a.offsets, axis=0), b.offsets, axis=1)
+    rv = np.zeros((cell_scores.shape[0] + 1, cell_scores.shape[1] + 1), dtype=np.int64)
+    rv[1:, 1:] = cell_scores
+    return rv.tolist()
 
   def _match_score(self, mt_node1, mt_node2):
-    mc1 = self.get_match_cell1(mt_node1)
-    mc2 = self.get_match_cell2(mt_node2)
-
-    sum_score = 0
-    match_type = ''
-    for i in xrange(len(mc1.words)):
-      for j in xrange(len(mc2.words)):
-        if mc1.words[i] is None and mc2.words[j] is None:
-          match_type += '[gaps%d,%d]' % (i, j)
+    return self.direct_scores[mt_node1][mt_node2]
+
+  def _match_type(self, mt_node1, mt_node2):
+    """The description of the direct match of two nodes, pair of words by pair of words"""
+    match_type = []
+    for i, w1 in enumerate(self.index1.words[mt_node1]):
+      for j, w2 in enumerate(self.index2.words[mt_node2]):
+        if w1 is None and w2 is None:
+          match_type.append('[gaps%d,%d]' % (i, j))
           continue
-        if mc1.words[i] is None and mc2.words[j] is not None:
-          sum_score += self.skip_score
-          match_type += '[gap1%d,%d]' % (i, j)
+        if w1 is None and w2 is not None:
+          match_type.append('[gap1%d,%d]' % (i, j))
           continue
-        if mc1.words[i] is not None and mc2.words[j] is None:
-          sum_score += self.skip_score
-          match_type += '[gap2%d,%d]' % (i, j)
+        if w1 is not None and w2 is None:
+          match_type.append('[gap2%d,%d]' % (i, j))
           continue
-        broken = False
-        for k in xrange(self.num_cands):
-          if mc1.cands[i] == k and mc2.cands[j] == k:
-            sum_score += self.cand_match_score
-            match_type += '[cand%d,%d_%d]' % (i, j, k)
-            broken = True
-            break
-        if broken:
+        if w1[3] is not None and w1[3] == w2[3]:
+          match_type.append('[cand%d,%d_%d]' % (i, j, w1[3]))
           continue
-        if mc1.pos_tags[i] == mc2.pos_tags[j] \
-            and mc1.lemmas[i] in self.short_words and mc2.lemmas[j] in self.short_words:
-          match_type += '[short_word%d,%d]' % (i, j)
+        same_pos = w1[2] == w2[2]
+        if same_pos and w1[4] and w2[4]:
+          match_type.append('[short_word%d,%d]' % (i, j))
           continue
-        if mc1.pos_tags[i] == mc2.pos_tags[j] and mc1.words[i] == mc2.words[j]:
-          match_type += '[word%d,%d]' % (i, j)
-          sum_score += self.word_match_score
+        if same_pos and w1[0] == w2[0]:
+          match_type.append('[word%d,%d]' % (i, j))
           continue
-        if mc1.pos_tags[i] == mc2.pos_tags[j] and mc1.lemmas[i] == mc2.lemmas[j]:
-          match_type += '[lemma%d,%d]' % (i, j)
-          sum_score += self.lemma_match_score
+        if same_pos and w1[1] == w2[1]:
+          match_type.append('[lemma%d,%d]' % (i, j))
           continue
-        if self.in_dicts(mc1.words[i], mc2.words[j], self.dicts):
-          match_type += '[word_dict%d,%d]' % (i, j)
-          sum_score += self.dict_match_score
+        if w1[5] & w2[5]:
+          match_type.append('[word_dict%d,%d]' % (i, j))
           continue
-        if self.in_dicts(mc1.lemmas[i], mc2.lemmas[j], self.dicts):
-          match_type += '[lemma_dict%d,%d]' % (i, j)
-          sum_score += self.dict_match_score
+        if w1[6] & w2[6]:
+          match_type.append('[lemma_dict%d,%d]' % (i, j))
           continue
-        if mc1.pos_tags[i] == mc2.pos_tags[j]:
-          match_type += '[pos_tags%d,%d]' % (i, j)
-          sum_score += self.pos_tag_match_score
+        if same_pos:
+          match_type.append('[pos_tags%d,%d]' % (i, j))
           continue
-        match_type += '[mis%d,%d]' % (i, j)
-        sum_score += self.mismatch_score
-    return sum_score, match_type + '_match'
+        match_type.append('[mis%d,%d]' % (i, j))
+    return ''.join(match_type) + MATCH
 
   def _balance_lists(self, lists1, lists2):
     fake_guy_number = 0
@@ -127,41 +230,33 @@ class MultiDepAlignment(AlignmentMixin):
     assert len(women_pref_lists) == len(men_pref_lists)
     self._sort_lists(men_pref_lists)
     self._sort_lists(women_pref_lists)
-    proposal_order = copy.deepcopy(men_pref_lists)
+    # The next proposal of each man, and the rank of each man for each woman
+    next_proposal = dict((guy, 0) for guy in men_pref_lists)
+    women_ranks = {}
+    for girl, prefs in women_pref_lists.iteritems():
+      women_ranks[girl] = dict((m, rank) for rank, (_, m) in enumerate(prefs))
     unmatched_guys = set([guy for guy in men_pref_lists])
     matching = {}
     while unmatched_guys:
       guy = iter(unmatched_guys).next()
-      girl = proposal_order[guy][0][1]
-      proposal_order[guy] = proposal_order[guy][1:]
+      girl = men_pref_lists[guy][next_proposal[guy]][1]
+      next_proposal[guy] += 1
       if girl not in matching:
         unmatched_guys -= set([guy])
         matching[girl] = guy
       else:
         current_guy = matching[girl]
-        prefer_new_guy = None
-        for (_, m) in women_pref_lists[girl]:
-          if m == current_guy:
-            prefer_new_guy = False
-            break
-          if m == guy:
-            prefer_new_guy = True
-            break
-        assert prefer_new_guy is not None, (current_guy, guy, women_pref_lists[girl])
-        if prefer_new_guy:
+        ranks = women_ranks[girl]
+        assert current_guy in ranks and guy in ranks, (current_guy, guy, women_pref_lists[girl])
+        if ranks[guy] < ranks[current_guy]:
           unmatched_guys.add(current_guy)
           unmatched_guys -= set([guy])
           matching[girl] = guy
-        else:
-          pass
 
     rv = []
     assert len(matching) == len(women_pref_lists)
-    matched_guys = set()
     for girl in matching:
       guy = matching[girl]
-      assert guy not in matched_guys, (guy, matched_guys)
-      matched_guys.add(guy)
       if isinstance(guy, int) and isinstance(girl, int):
         rv.append((guy, girl))
       elif isinstance(guy, int) and not isinstance(girl, int):
@@ -173,7 +268,7 @@ class MultiDepAlignment(AlignmentMixin):
 
     return rv
 
-  def _match(self, mt_node1, mt_node2, forbidden1, forbidden2):
+  def _match(self, mt_node1, mt_node2):
     if mt_node1 == 0 and mt_node2 == 0:
       return 0, 'end', []
     if mt_node1 == 0 and mt_node2 != 0:
@@ -181,12 +276,8 @@ class MultiDepAlignment(AlignmentMixin):
     if mt_node1 != 0 and mt_node2 == 0:
       return -1000, 'assert_false', []
 
-    mc1 = self.get_match_cell1(mt_node1)
-    c1 = set(mc1.children)
-    assert mt_node1 not in c1, (mt_node1, c1)
-    mc2 = self.get_match_cell2(mt_node2)
-    c2 = set(mc2.children)
-    assert mt_node2 not in c2, (mt_node2, c2)
+    c1 = self.index1.child_sets[mt_node1]
+    c2 = self.index2.child_sets[mt_node2]
 
     men_pref_lists = {}
     women_pref_lists = {}
@@ -196,17 +287,14 @@ class MultiDepAlignment(AlignmentMixin):
       women_pref_lists[j] = []
     for i in c1:
       for j in c2:
-        self._h(i, j, forbidden1, forbidden2)
-        men_pref_lists[i].append((self.score_matrix[i, j], j))
-        women_pref_lists[j].append((self.score_matrix[i, j], i))
+        score = self._h(i, j)
+        men_pref_lists[i].append((score, j))
+        women_pref_lists[j].append((score, i))
     outgoing = self._stable_marriage(men_pref_lists, women_pref_lists)
     sum_score = 0
     for (i, j) in outgoing:
-      assert i is None or i in mc1.children, i
-      assert j is None or j in mc2.children, j
-      # assert False, 'TODO test this! should we use the skip score for unassigned branches?'
       if i is not None and j is not None:
-        sum_score += self.score_matrix[i, j]
+        sum_score += self.scores[i * self.n2 + j]
       elif i is not None or j is not None:
         sum_score += self.skip_score
         # HACK Johannes. Do we want to leave out unmatched branches this way?
@@ -216,105 +304,59 @@ class MultiDepAlignment(AlignmentMixin):
       else:
         assert False, (i, j)
 
-    direct_match_score, match_type = self._match_score(mt_node1, mt_node2)
+    direct_match_score = self._match_score(mt_node1, mt_node2)
     # HACK Johannes: Because unmatched branches can be pruned in a multi-way match, this doesn't hold anymore:
     # assert len([a[0] for a in outgoing if a[0] is not None]) == len(set([a[0] for a in outgoing if a[0] is not None]))
     # assert len([a[1] for a in outgoing if a[1] is not None]) == len(set([a[1] for a in outgoing if a[1] is not None]))
-    assert len(outgoing) >= min(len(mc1.children), len(mc2.children))
-    for o1, o2 in outgoing:
-      # assert o1 is not None
-      # assert o2 is not None
-      if o1 is not None:
-        assert mt_node1 != o1, (mt_node1, o1, match_type, mc1.children)
-      if o2 is not None:
-        assert mt_node2 != o2, (mt_node2, o2, match_type, mc2.children)
-
-    return direct_match_score + sum_score, match_type, outgoing
-
-  def _skip1(self, mt_node1, mt_node2, forbidden1, forbidden2):
+    assert len(outgoing) >= min(len(c1), len(c2))
+    return direct_match_score + sum_score, MATCH, outgoing
+
+  def _skip1(self, mt_node1, mt_node2):
     if mt_node1 == 0:
       return -1000, 'assert_false', []
-    score_list = []
-    mc1 = self.get_match_cell1(mt_node1)
-
-    for i in mc1.children:
-      assert i != mt_node1
-      self._h(i, mt_node2, forbidden1, forbidden2)
-      score_list.append((self.score_matrix[i, mt_node2], i))
-    score_list = sorted(score_list)[::-1]
-
-    mc2 = self.get_match_cell2(mt_node2)
-    sum_score = 0
-    skip_type = ''
-    for j, word in enumerate(mc2.words):
-      if word is not None:
-        skip_type += '[skip%d]' % j
-        sum_score += self.skip_score
-      else:
-        skip_type += '[zero%d]' % j
-
-    assert score_list[0][1] != mt_node1, str((score_list[0][1], mt_node1))
-    return sum_score + score_list[0][0], skip_type + '_skip1', [(score_list[0][1], mt_node2)]
-
-  def _skip2(self, mt_node1, mt_node2, forbidden1, forbidden2):
+    # The best child, ties going to the highest node
+    best = None
+    for i in self.index1.child_sets[mt_node1]:
+      score = self._h(i, mt_node2)
+      if best is None or (score, i) > best:
+        best = (score, i)
+    assert best[1] != mt_node1, str((best[1], mt_node1))
+    return self.index2.skip_scores[mt_node2] + best[0], self.index2.skip_types[mt_node2] + '_skip1', \
+           [(best[1], mt_node2)]
+
+  def _skip2(self, mt_node1, mt_node2):
     if mt_node2 == 0:
       return -1000, 'assert_false', []
-    score_list = []
-    mc2 = self.get_match_cell2(mt_node2)
-
-    for j in mc2.children:
-      assert j != mt_node2
-      self._h(mt_node1, j, forbidden1, forbidden2)
-      score_list.append((self.score_matrix[mt_node1, j], j))
-    score_list = sorted(score_list)[::-1]
-
-    mc1 = self.get_match_cell1(mt_node1)
-    sum_score = 0
-    skip_type = ''
-    for i, word in enumerate(mc1.words):
-      if word is not None:
-        skip_type += '[skip%d]' % i
-        sum_score += self.skip_score
-      else:
-        skip_type += '[zero%d]' % i
-
-    assert score_list[0][1] != mt_node2, str((mt_node2, score_list[0][1]))
-    return sum_score + score_list[0][0], skip_type + '_skip2', [(mt_node1, score_list[0][1])]
-
-  def _h(self, mt_node1, mt_node2, forbidden1, forbidden2):
-    forbidden1 = forbidden1.copy()
-    forbidden1.add(mt_node1)
-    forbidden2 = forbidden2.copy()
-    forbidden2.add(mt_node2)
-    if self.score_matrix[mt_node1, mt_node2] != np.inf:
-      return self.score_matrix[mt_node1, mt_node2]
-
-    m, match_type, cont_match = self._match(mt_node1, mt_node2, forbidden1, forbidden2)
-    assert mt_node1 not in [c[0] for c in cont_match]
-    assert mt_node2 not in [c[1] for c in cont_match]
-    l1, skip_type1, cont_skip1 = self._skip1(mt_node1, mt_node2, forbidden1, forbidden2)
-    assert (mt_node1, mt_node2) not in cont_skip1, (mt_node1, mt_node2, cont_skip1)
-    l2, skip_type2, cont_skip2 = self._skip2(mt_node1, mt_node2, forbidden1, forbidden2)
-    assert (mt_node1, mt_node2) not in cont_skip2, (mt_node1, mt_node2, cont_skip2)
+    best = None
+    for j in self.index2.child_sets[mt_node2]:
+      score = self._h(mt_node1, j)
+      if best is None or (score, j) > best:
+        best = (score, j)
+    assert best[1] != mt_node2, str((mt_node2, best[1]))
+    return self.index1.skip_scores[mt_node1] + best[0], self.index1.skip_types[mt_node1] + '_skip2', \
+           [(mt_node1, best[1])]
+
+  def _h(self, mt_node1, mt_node2):
+    """The best alignment score of the subtrees of the two nodes, memoized"""
+    k = mt_node1 * self.n2 + mt_node2
+    score = self.scores[k]
+    if score is not None:
+      return score
+
+    m, match_type, cont_match = self._match(mt_node1, mt_node2)
+    l1, skip_type1, cont_skip1 = self._skip1(mt_node1, mt_node2)
+    l2, skip_type2, cont_skip2 = self._skip2(mt_node1, mt_node2)
 
     score = max([m, l1, l2])
 
-    self.score_matrix[mt_node1, mt_node2] = score
+    self.scores[k] = score
     if score == m:
-      self.path_matrix[mt_node1][mt_node2] = match_type, cont_match
-      for o1, o2 in cont_match:
-        assert o1 is None or o1 not in forbidden1
-        assert o2 is None or o2 not in forbidden2
+      self.paths[k] = match_type, cont_match
     elif score == l1:
-      self.path_matrix[mt_node1][mt_node2] = skip_type1, cont_skip1
-      for o1, _ in cont_skip1:
-        assert o1 not in forbidden1
-    elif score == l2:
-      self.path_matrix[mt_node1][mt_node2] = skip_type2, cont_skip2
-      for _, o2 in cont_skip2:
-        assert o2 not in forbidden2
+      self.paths[k] = skip_type1, cont_skip1
     else:
-      assert False
+      self.paths[k] = skip_type2, cont_skip2
+    return score
 
   def _print_match_tree_recursive(self, stream, match_tree, index, indent):
     assert 0 < index
@@ -370,7 +412,7 @@ class MultiDepAlignment(AlignmentMixin):
       mc.lemmas[size1:size1 + size2] = mc2.lemmas
       mc.children = []
   
-      instr, succ = self.path_matrix[node1][node2]
+      instr, succ = self._path(node1, node2)
       mc.match_type = instr
       match_tree.append(mc)
       index = len(match_tree)
@@ -473,15 +515,16 @@ class MultiDepAlignment(AlignmentMixin):
 
     mc1 = self.get_match_cell1(node1)
     mc2 = self.get_match_cell2(node2)
-    instr, succ = self.path_matrix[node1][node2]
-    if instr.endswith('_match'):
+    instr, succ = self._path(node1, node2, match_type=False)
+    if instr == MATCH:
       print >> stream, "%s\t%s" % ('\t'.join(mc1.lemmas), '\t'.join(mc2.lemmas))
 
     for (o1, o2) in succ:
       self.print_matched_lemmas(stream, o1, o2, folded)
 
   def overall_score(self):
-    return self.score_matrix[self.mt_root1, self.mt_root2]
+    """The alignment score, as a float"""
+    return float(self.scores[self.mt_root1 * self.n2 + self.mt_root2])
 
   def rescore(self, unscore_list, folded=-1, node1=-1, node2=-1):
     if node1 == -1:
@@ -499,9 +542,9 @@ class MultiDepAlignment(AlignmentMixin):
     mc2 = self.get_match_cell2(node2)
     lemmas1 = mc1.lemmas
     lemmas2 = mc2.lemmas
-    instr, succ = self.path_matrix[node1][node2]
+    instr, succ = self._path(node1, node2, match_type=False)
     rv = 0
-    if instr.endswith('_match'):
+    if instr == MATCH:
       for s1, s2, penalty in unscore_list:
         for l1 in s1:
           for l2 in s2:
@@ -1,5 +1,3 @@
-from collections import defaultdict
-
 # TODO: handle negations (neg, advmod + neg word) specially!
 
 # See: http://nlp.stanford.edu/software/dependencies_manual.pdf
@@ -7,80 +5,242 @@ from collections import defaultdict
 MAX_PATH_LEN = 100
 
 class DepPathDAG:
+  """
+  The dependency parse of a sentence, i.e. a tree (or forest) given by the dep_parents array.
+  Parent, depth & children arrays are computed once, so that the (unique) path between two
+  words is found by walking up to their lowest common ancestor, in O(path length)
+  """
   def __init__(self, dep_parents, dep_paths, words, max_path_len=None, no_count_tags=('conj',), no_count_words=('_','*',)):
     self.max_path_len = max_path_len
     self.no_count_tags = tuple(no_count_tags)
     self.no_count_words = no_count_words
     self.words = words
-    self.edges = defaultdict(list)
-    self.edge_labels = {}
-    for i,dp in enumerate(dep_parents):
-      if dp >= 0:
-        self.edges[i].append(dp)
-        self.edges[dp].append(i)
-        self.edge_labels[(i,dp)] = dep_paths[i]
-        self.edge_labels[(dp,i)] = dep_paths[i]
+    n = max([len(dep_parents)] + [dp + 1 for dp in dep_parents])
+    self.n = n
+    self.parent = [-1] * n
+    self.children = [[] for i in xrange(n)]
+    # The dep path label of the edge between each node and its parent, and whether it counts
+    # towards the path length
+    self.labels = [None] * n
+    self.counts = [False] * n
+    for i, dp in enumerate(dep_parents):
+      if dp >= 0 and dp != i:
+        self.parent[i] = dp
+        self.labels[i] = dep_paths[i]
+        self.counts[i] = not dep_paths[i].startswith(self.no_count_tags)
+    self._compute_depths()
+    for i in xrange(n):
+      if self.parent[i] >= 0:
+        self.children[self.parent[i]].append(i)
+
+    # Positions along a path (see _path_len) at which edges are not counted
+    self.no_count_positions = [k for k, w in enumerate(words) if w in self.no_count_words]
+
+  def _compute_depths(self):
+    """Compute depth & root of each node; any cycle in the parents array is cut"""
+    n = self.n
+    self.depth = [None] * n
+    self.root = [None] * n
+    for i in xrange(n):
+      chain = []
+      on_chain = set()
+      node = i
+      while node >= 0 and self.depth[node] is None:
+        if node in on_chain:
+          # Malformed parse- make this node a root
+          p = chain.index(node)
+          self.parent[chain[p]] = -1
+          self.labels[chain[p]] = None
+          self.counts[chain[p]] = False
+          chain = chain[:p + 1]
+          node = -1
+          break
+        chain.append(node)
+        on_chain.add(node)
+        node = self.parent[node]
+      if node >= 0:
+        d, r = self.depth[node], self.root[node]
+      else:
+        d, r = -1, chain[-1]
+      for c in reversed(chain):
+        d += 1
+        self.depth[c] = d
+        self.root[c] = r
+
+  def _valid(self, i):
+    return 0 <= i < self.n
+
+  def _lca(self, i, j):
+    """Lowest common ancestor of i and j, or None if they are in different trees"""
+    if self.root[i] != self.root[j]:
+      return None
+    while self.depth[i] > self.depth[j]:
+      i = self.parent[i]
+    while self.depth[j] > self.depth[i]:
+      j = self.parent[j]
+    while i != j:
+      i = self.parent[i]
+      j = self.parent[j]
+    return i
+
+  def _n_edges(self, i, j, a):
+    return self.depth[i] + self.depth[j] - 2 * self.depth[a]
+
+  def _within_max_len(self, n_edges):
+    return not self.max_path_len or n_edges <= self.max_path_len + 1
+
+  def _path(self, i, j, a):
+    """The nodes on the path from i (excluded) to j (included) via their LCA a"""
+    up = []
+    node = i
+    while node != a:
+      node = self.parent[node]
+      up.append(node)
+    down = []
+    node = j
+    while node != a:
+      down.append(node)
+      node = self.parent[node]
+    return up + down[::-1]
+
+  def _edge_counts(self, u, v):
+    return self.counts[u] if self.parent[u] == v else self.counts[v]
 
   def _path_len(self, path):
     """Get the length of a list of nodes, skipping counting of certain dep path types"""
     l = 1
     for i in range(len(path)-1):
-      if self.edge_labels[(path[i], path[i+1])].startswith(self.no_count_tags):
+      if not self._edge_counts(path[i], path[i+1]):
         continue
+      # NOTE: words are checked by position along the path, not by node
       if self.words[i] in self.no_count_words:
         continue
       l += 1
     return l
 
-  def min_path(self, i, j, path=None):
-    if path is None:
-      path = []
-    if self.max_path_len and len(path) > self.max_path_len:
+  def _counted_edges_up(self, i, a):
+    c = 0
+    while i != a:
+      c += self.counts[i]
+      i = self.parent[i]
+    return c
+
+  def _pair_len(self, i, j):
+    """Path length between i and j (as _path_len(min_path(i, j))), or None if no path"""
+    if i == j or not self._valid(i) or not self._valid(j):
+      return None
+    a = self._lca(i, j)
+    if a is None:
       return None
-    min_path_len = MAX_PATH_LEN
-    min_path = None
-    for node in self.edges[i]:
-      if node in path:
+    e = self._n_edges(i, j, a)
+    if not self._within_max_len(e):
+      return None
+    if self.no_count_positions and self.no_count_positions[0] < e - 1:
+      return self._path_len(self._path(i, j, a))
+    # The first edge of the path (out of i) is not counted
+    if i != a:
+      first_counts = self.counts[i]
+    else:
+      first_counts = self._edge_counts(i, self._path(i, j, a)[0])
+    return 1 + self._counted_edges_up(i, a) + self._counted_edges_up(j, a) - first_counts
+
+  def min_path(self, i, j):
+    """The nodes on the path from i (excluded) to j (included), or None if there is none
+    (within max_path_len)"""
+    if i == j or not self._valid(i) or not self._valid(j):
+      return None
+    a = self._lca(i, j)
+    if a is None or not self._within_max_len(self._n_edges(i, j, a)):
+      return None
+    return self._path(i, j, a)
+
+  def _walk_up(self, i):
+    """
+    The (a, child, counted, edges) of i and of each of its ancestors a within max_path_len:
+    the node below a on the way from i (None for i itself), and the counted edges & edges
+    between i and a
+    """
+    parent, counts = self.parent, self.counts
+    max_edges = self.max_path_len + 1 if self.max_path_len else self.n
+    rv = [(i, None, 0, 0)]
+    counted = edges = 0
+    while parent[i] >= 0 and edges < max_edges:
+      counted += counts[i]
+      edges += 1
+      child, i = i, parent[i]
+      rv.append((i, child, counted, edges))
+    return rv
+
+  def _closest_pair(self, idx, jdx):
+    """
+    Return the (i, j) from idx x jdx with the minimum path length (first such in order).
+    All pairs are measured in one pass: the walks up from all of idx are recorded at each
+    ancestor, by the child they come from; the walk up from each j then meets each i at
+    their LCA (i.e. the first ancestor where they come from different children), where the
+    length of the pair (as _pair_len) adds up the counted edges of both walks, less the
+    uncounted first edge out of i. Only pairs whose path is long enough for no_count_words to
+    apply (they are checked by position along the path) are measured on their path, as is a
+    single pair
+    """
+    if len(idx) == 1 and len(jdx) == 1:
+      l = self._pair_len(idx[0], jdx[0])
+      return ((idx[0], jdx[0]), l) if l else (None, None)
+    sources = {}
+    for p, i in enumerate(idx):
+      if self._valid(i):
+        for a, child, counted, edges in self._walk_up(i):
+          walk = (p, i, child, counted, edges)
+          if a in sources:
+            sources[a].append(walk)
+          else:
+            sources[a] = [walk]
+    counts = self.counts
+    max_edges = self.max_path_len + 1 if self.max_path_len else self.n
+    no_count_edges = self.no_count_positions[0] + 1 if self.no_count_positions else self.n
+    best = None
+    for q, j in enumerate(jdx):
+      if not self._valid(j):
         continue
-      elif node == j:
-        return [j]
-      else:
-        p = self.min_path(node, j, path+[i])
-        if p and self._path_len(p) < min_path_len:
-          min_path = [node] + p
-          min_path_len = self._path_len(min_path)
-    return min_path
+      for a, j_child, j_counted, j_edges in self._walk_up(j):
+        if a not in sources:
+          continue
+        for p, i, child, counted, edges in sources[a]:
+          e = edges + j_edges
+          # child == j_child: a is not their LCA (or i == j)
+          if child == j_child or e > max_edges:
+            continue
+          if e > no_count_edges:
+            l = self._path_len(self._path(i, j, a))
+          else:
+            l = 1 + counted + j_counted - (counts[i] if i != a else counts[j_child])
+          if best is None or (l, p, q) < best[0]:
+            best = ((l, p, q), (i, j))
+    if best is None:
+      return None, None
+    return best[1], best[0][0]
 
   def min_path_sets(self, idx, jdx):
     """Return the minimum path between the closest members of two sets of indexes"""
-    min_path_len = None
-    min_path = None
     if len(idx) == 0 or len(jdx) == 0:
-      return min_path
-    for i in idx:
-      for j in jdx:
-        p = self.min_path(i,j)
-        l = self._path_len(p) if p else None
-        if l and (min_path_len is None or l < min_path_len):
-          min_path_len = l
-          min_path = p
-    return min_path
+      return None
+    best, _ = self._closest_pair(idx, jdx)
+    return self.min_path(*best) if best else None
 
   def path_len(self, i, j):
     """Get the 'path length' i.e. the length of the min path between i and j"""
-    min_path = self.min_path(i, j)
-    return self._path_len(min_path) if min_path else None
-    
+    return self._pair_len(i, j)
+
   def path_len_sets(self, idx, jdx):
     """Return the path length (length of minimum path) between the closest
     members of two sets of indexes"""
-    min_path = self.min_path_sets(idx,jdx)
-    return self._path_len(min_path) if min_path else None
+    _, l = self._closest_pair(idx, jdx)
+    return l
 
   def neighbors(self, idx):
     """Return the indices or neighboring words (0-indexed return value)"""
-    rv = []
-    for i in xrange(0, len(self.edges)):
-      if idx in self.edges[i]:
-        rv.append(i)
-    return rv
+    if not self._valid(idx):
+      return []
+    rv = list(self.children[idx])
+    if self.parent[idx] >= 0:
+      rv.append(self.parent[idx])
+    return sorted(rv)
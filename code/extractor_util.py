@@ -1,8 +1,16 @@
 """Miscellaneous shared tools for extractors."""
+import collections
+import hashlib
 import os
+import random
 import re
 import sys
 import ddlib
+import dep_util as deps
+import itertools
+import marshal
+import struct
+import time
 import traceback
 
 FIX_DEP_PARENTS = True
@@ -18,24 +26,225 @@ def rgx_comp(strings=[], rgxs=[]):
 # XXX HACK Johannes: Catching regex exceptions and then continuing is not the nicest way
 # but ever since I had a single regex error in the middle of a 5-hour run and the whole extractor failed
 # I'd rather have the thing continue with a wrong value at the single position ...
+def _compile_or_warn(regex, flags):
+  try:
+    return re.compile(regex, flags)
+  except Exception:
+    traceback.print_exc()
+    sys.stderr.write('%s\n' % regex)
+    return None
+
+# Python 2's re module supports at most 100 groups per pattern
+MAX_RGX_GROUPS = 99
+
+# A numbered backreference (\1 - \99), i.e. a backslash & digit not itself escaped
+RGX_BACKREF = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+class RuleSet:
+  """
+  A compiled group of supervision rules, i.e. exact strings and regexes as taken by
+  rgx_mult_search. All patterns are joined into alternations of named groups, so that
+  a phrase is scanned once; only on a hit are the patterns listed before the matching
+  one re-checked, so that search() still returns the first listed pattern which matches
+  (as its original string / regex).
+  """
+  def __init__(self, regexes, origs, flags=re.I, positions=None):
+    self.patterns = []
+    for i, regex in enumerate(regexes):
+      rgx = _compile_or_warn(regex, flags)
+      if rgx is not None:
+        self.patterns.append((rgx, origs[i], positions[i] if positions else i))
+
+    # Chunks of (alternation regex, index of its first pattern, index past its last): patterns
+    # with numbered backreferences, which would refer to the wrong group once wrapped in the
+    # alternation, and the patterns of chunks which fail to compile are searched one by one
+    self.alternations = []
+    start, groups = 0, 0
+    for i in xrange(len(self.patterns) + 1):
+      solo = i < len(self.patterns) and RGX_BACKREF.search(self.patterns[i][0].pattern) is not None
+      n = self.patterns[i][0].groups + 1 if i < len(self.patterns) else None
+      if i > start and (n is None or solo or groups + n > MAX_RGX_GROUPS):
+        self._add_chunk(start, i, flags)
+        start, groups = i, 0
+      if solo:
+        self.alternations.append((None, i, i + 1))
+        start, groups = i + 1, 0
+      else:
+        groups += n or 0
+
+  def _add_chunk(self, start, end, flags):
+    alt = '|'.join('(?P<r%d>%s)' % (j, self.patterns[j][0].pattern) for j in xrange(start, end))
+    rgx = _compile_or_warn(alt, flags) if end - start > 1 else None
+    if rgx is not None:
+      self.alternations.append((rgx, start, end))
+    else:
+      self.alternations.extend((None, j, j + 1) for j in xrange(start, end))
+
+  def __len__(self):
+    return len(self.patterns)
+
+  def first_match(self, phrase):
+    """Return the (index, original pattern) of the first listed pattern matching phrase, or None"""
+    if not self.patterns:
+      return None
+    for alt, start, end in self.alternations:
+      if alt is None:
+        if self.patterns[start][0].search(phrase):
+          return self.patterns[start][2], self.patterns[start][1]
+        continue
+      m = alt.search(phrase)
+      if m is not None:
+        k = int(m.lastgroup[1:])
+        for j in xrange(start, k):
+          if self.patterns[j][0].search(phrase):
+            k = j
+            break
+        return self.patterns[k][2], self.patterns[k][1]
+    return None
+
+  def search(self, phrase, bindings=None):
+    match = self.first_match(phrase)
+    return match[1] if match else None
+
+TEMPLATE_PARAM = re.compile(r'\{\{(\w+)\}\}')
+
+def _required_params(template, literal):
+  """Names of the {{X}} placeholders which any match of template must contain literally"""
+  if literal:
+    return set(TEMPLATE_PARAM.findall(template))
+  required = set()
+  depth, i, in_class = 0, 0, False
+  while i < len(template):
+    c = template[i]
+    if c == '\\':
+      i += 2
+      continue
+    if in_class:
+      in_class = c != ']'
+    elif c == '[':
+      in_class = True
+    elif c == '(':
+      depth += 1
+    elif c == ')':
+      depth -= 1
+    elif c == '|' and depth == 0:
+      return set()
+    elif depth == 0:
+      m = TEMPLATE_PARAM.match(template, i)
+      if m:
+        i = m.end()
+        if template[i:i+1] not in ('?', '*', '{'):
+          required.add(m.group(1))
+        continue
+    i += 1
+  return required
+
+class TemplateRuleSet:
+  """
+  A RuleSet some of whose patterns contain {{X}} placeholders for the given params
+  (e.g. {{G}}, {{P}} for the gene & pheno of a relation), substituted by the (escaped)
+  values bound at search time. The templates are parsed once; the rules compiled for
+  each binding are cached, and not run at all on phrases which can't contain them
+  """
+  BINDING_CACHE_SIZE = 1024
+
+  def __init__(self, entries, params, flags=re.I):
+    self.params = params
+    self.flags = flags
+    static = [(i, e) for i, e in enumerate(entries) if not TEMPLATE_PARAM.search(e[0])]
+    self.static = RuleSet([e[0] for i, e in static], [e[2] for i, e in static], flags,
+                          positions=[i for i, e in static])
+    self.templates = [(i, e, _required_params(e[0], e[1])) for i, e in enumerate(entries) \
+                      if TEMPLATE_PARAM.search(e[0])]
+    self.cache = {}
+
+  def __len__(self):
+    return len(self.static) + len(self.templates)
+
+  def bind(self, values):
+    """Return the RuleSet of the templates with the params bound to values"""
+    rules = self.cache.get(values)
+    if rules is None:
+      regexes = []
+      for i, (template, literal, orig), _ in self.templates:
+        for param, value in zip(self.params, values):
+          template = template.replace('{{%s}}' % param, value if literal else re.escape(value))
+        regexes.append(re.escape(template) if literal else template)
+      if len(self.cache) >= self.BINDING_CACHE_SIZE:
+        self.cache.clear()
+      rules = self.cache[values] = RuleSet(regexes, [e[2] for i, e, _ in self.templates], self.flags,
+                                           positions=[i for i, e, _ in self.templates])
+    return rules
+
+  def first_match(self, phrase, bindings):
+    match = self.static.first_match(phrase)
+    values = tuple(bindings[p] for p in self.params)
+    lphrase = phrase.lower() if self.flags & re.I else phrase
+    lvalues = dict((p, v.lower() if self.flags & re.I else v) for p, v in bindings.iteritems())
+    for i, e, required in self.templates:
+      if match is not None and i > match[0]:
+        break
+      if all(lvalues[p] in lphrase for p in required):
+        tmatch = self.bind(values).first_match(phrase)
+        if tmatch is not None and (match is None or tmatch[0] < match[0]):
+          match = tmatch
+        break
+    return match
+
+  def search(self, phrase, bindings):
+    match = self.first_match(phrase, bindings)
+    return match[1] if match else None
+
+def compile_rules(strings=[], rgxs=[], orig_strings=None, orig_rgxs=None, flags=re.I, params=()):
+  """
+  Compile a group of exact strings & regexes (see rgx_mult_search) into a RuleSet, or
+  a TemplateRuleSet if any pattern contains a {{X}} placeholder for X in params
+  """
+  entries = [(s, True, o) for s, o in zip(strings, orig_strings or strings)] + \
+            [(r, False, o) for r, o in zip(rgxs, orig_rgxs or rgxs)]
+  if any(p in params for e in entries for p in TEMPLATE_PARAM.findall(e[0])):
+    return TemplateRuleSet(entries, params, flags)
+  return RuleSet([re.escape(s) if literal else s for s, literal, _ in entries],
+                 [o for _, _, o in entries], flags)
+
+# The (config dict, RuleSet) compiled for each rule group, by (id of the dict, name, params);
+# the dict is kept so that its id is not reused
+_RULE_GROUPS = {}
+
+def rule_group(opts, name, params=()):
+  """
+  Return the compiled rules for the rule group opts[name] + opts['<name>-rgx'], compiled on
+  first use (or by compile_rule_groups) and cached here, so that config dicts stay plain data
+  """
+  key = (id(opts), name, tuple(params))
+  entry = _RULE_GROUPS.get(key)
+  if entry is None:
+    entry = _RULE_GROUPS[key] = (opts, compile_rules(opts[name], opts['%s-rgx' % name], params=params))
+  return entry[1]
+
+def compile_rule_groups(config_map, params=()):
+  """Compile all rule groups (<name> & <name>-rgx lists) in a nested config dict, see config.py"""
+  for key, value in config_map.items():
+    if isinstance(value, dict):
+      compile_rule_groups(value, params)
+    elif isinstance(key, basestring) and isinstance(value, list) \
+        and isinstance(config_map.get('%s-rgx' % key), list):
+      rule_group(config_map, key, params)
+
+_RULE_SETS = {}
+
 def rgx_mult_search(phrase, strings, rgxs, orig_strings, orig_rgxs, flags=re.I):
-  for i, s in enumerate(strings):
-    try:
-      regex = re.escape(s)
-      if re.search(regex, phrase, flags):
-        return orig_strings[i]
-    except Exception:
-      traceback.print_exc()
-      print regex
-  for i, s in enumerate(rgxs):
-    try:
-      regex = s
-      if re.search(regex, phrase, flags):
-        return orig_rgxs[i]
-    except Exception:
-      traceback.print_exc()
-      print regex
-  return None
+  """
+  Return the original string / regex of the first of strings (matched exactly) and rgxs
+  found in phrase, or None. Prefer rule_group / compile_rules for fixed rule groups
+  """
+  key = (tuple(strings), tuple(rgxs), tuple(orig_strings), tuple(orig_rgxs), flags)
+  rules = _RULE_SETS.get(key)
+  if rules is None:
+    if len(_RULE_SETS) >= 1024:
+      _RULE_SETS.clear()
+    rules = _RULE_SETS[key] = compile_rules(strings, rgxs, orig_strings, orig_rgxs, flags)
+  return rules.search(phrase)
 
 # HACK[Alex]: this is probably justified but a bit hackey still...
 def skip_row(row):
@@ -95,9 +304,15 @@ def tsv_string_to_listoflists(s, func=lambda x : x, sep1='|^|', sep2='|~|'):
   """Convert a TSV string from sentences_input table to a list of lists"""
   return tsv_string_to_list(s, func=lambda x : tsv_string_to_list(x, func=func, sep=sep1), sep=sep2)
 
-class Row:
+class Row(object):
+  """Base class of the Row types built by RowParser- see RowParser.row_class"""
+  __slots__ = ()
+  _fields = ()
+
   def __str__(self):
-    return '<Row(' + ', '.join("%s=%s" % x for x in self.__dict__.iteritems()) + ')>'
+    vals = [(name, getattr(self, name, None)) for name in self._fields]
+    vals += getattr(self, '__dict__', {}).items()
+    return '<Row(' + ', '.join("%s=%s" % x for x in vals) + ')>'
   def __repr__(self):
     return str(self)
 
@@ -123,28 +338,125 @@ RP_PARSERS = {
   'boolean[]' : lambda x : tsv_string_to_list(x, func=bool_parser)
 }
 
+PG_ARRAY_BRACES = re.compile(r'^\{\s*|\s*\}$')
+PG_ARRAY_SEP = re.compile(r'\s*,\s*')
+
+class ArrayDecoder:
+  """
+  Decoder for one array column. The array format (psql '{a,b}' array, or array_to_string
+  output joined by sep) is detected on each value, as tsv_string_to_list does, but by string
+  tests rather than a regex
+  """
+  def __init__(self, func=None, sep='|^|', offset=0):
+    self.func = func
+    self.sep = sep
+    self.offset = offset
+
+  def __call__(self, s):
+    if s.strip() == "":
+      return []
+    if s.startswith('{') or s.endswith('}'):
+      split = PG_ARRAY_SEP.split(PG_ARRAY_BRACES.sub('', s))
+    else:
+      split = s.split(self.sep)
+    if self.func is not None:
+      split = [self.func(x) for x in split]
+    if self.offset:
+      split = [x + self.offset for x in split]
+    return split
+
+def _int_elem(x):
+  return int(x)
+
+def compile_decoder(field_name, field_type):
+  """Return a function decoding one TSV column of the given type (see RP_PARSERS)"""
+  if field_type == 'text':
+    return str
+  elif field_type == 'text[]':
+    return ArrayDecoder()
+  elif field_type == 'int':
+    return int
+  elif field_type == 'int[]':
+    if FIX_DEP_PARENTS and field_name == 'dep_parents':
+      return ArrayDecoder(func=_int_elem, offset=-1)
+    return ArrayDecoder(func=_int_elem)
+  elif field_type == 'boolean[]':
+    return ArrayDecoder(func=bool_parser)
+  elif field_type in RP_PARSERS:
+    return RP_PARSERS[field_type]
+  else:
+    raise Exception("Unsupported type %s for RowParser class- please add." % field_type)
+
+def _lazy_column(name, decoder):
+  """Property decoding the raw column value stored in _raw_<name> on first access"""
+  raw_attr = '_raw_' + name
+  val_attr = '_val_' + name
+  def get(self):
+    try:
+      return getattr(self, val_attr)
+    except AttributeError:
+      val = decoder(getattr(self, raw_attr))
+      setattr(self, val_attr, val)
+      return val
+  def set(self, val):
+    setattr(self, val_attr, val)
+  return property(get, set)
+
+_PARSE_TEMPLATE = '''def parse_tsv_row(line):
+  cols = line.rstrip('\\n').split('\\t')
+  if len(cols) != %(n_fields)d:
+    return parse_partial_row(cols)
+  row = new_row(Row)
+%(assignments)s
+  return row
+'''
+
 class RowParser:
   """
   Initialized with a list of duples (field_name, field_type)- see RP_PARSERS dict
   Is a factory for simple Row class parsed from e.g. tsv input lines
+  The field list is compiled once into a specialized parse_tsv_row function and a
+  __slots__ Row type (row_class). With lazy=True, array columns are only decoded
+  when (and if) the extractor first accesses them
   """
-  def __init__(self, fields):
+  def __init__(self, fields, lazy=False):
     self.fields = fields
+    self.lazy = lazy
+    self.decoders = [compile_decoder(name, ftype) for name, ftype in fields]
+    self.lazy_fields = set(name for name, ftype in fields if lazy and ftype.endswith('[]'))
 
-  def parse_tsv_row(self, line):
-    row = Row()
-    cols = line.split('\t')
-    for i, col in enumerate(cols):
-      field_name, field_type = self.fields[i]
-      if RP_PARSERS.has_key(field_type):
-        val = RP_PARSERS[field_type](col)
-        if FIX_DEP_PARENTS:
-          if field_name == 'dep_parents' and field_type == 'int[]':
-            for i in xrange(0, len(val)):
-              val[i] -= 1
+    # Build the Row type, with a __dict__ so that extractors can still set other attributes
+    attrs = {'__slots__' : ['__dict__'], '_fields' : tuple(name for name, _ in fields)}
+    for (name, _), decoder in zip(fields, self.decoders):
+      if name in self.lazy_fields:
+        attrs['__slots__'] += ['_raw_' + name, '_val_' + name]
+        attrs[name] = _lazy_column(name, decoder)
       else:
-        raise Exception("Unsupported type %s for RowParser class- please add.")
-      setattr(row, field_name, val)
+        attrs['__slots__'].append(name)
+    self.row_class = type('Row', (Row,), attrs)
+
+    # Compile the specialized parse function
+    assignments = []
+    namespace = {'Row' : self.row_class, 'new_row' : object.__new__,
+                 'parse_partial_row' : self._parse_partial_row}
+    for i, (name, _) in enumerate(fields):
+      if name in self.lazy_fields:
+        assignments.append('  row._raw_%s = cols[%d]' % (name, i))
+      else:
+        namespace['d%d' % i] = self.decoders[i]
+        assignments.append('  row.%s = d%d(cols[%d])' % (name, i, i))
+    code = _PARSE_TEMPLATE % {'n_fields' : len(fields), 'assignments' : '\n'.join(assignments)}
+    exec code in namespace
+    self.parse_tsv_row = namespace['parse_tsv_row']
+
+  def _parse_partial_row(self, cols):
+    """Fallback for lines with fewer columns than fields: only the leading fields are set"""
+    if len(cols) > len(self.fields):
+      raise ValueError("Expected %d columns, but found %d in input row:\n%s" % (
+        len(self.fields), len(cols), '\t'.join(cols)))
+    row = object.__new__(self.row_class)
+    for i, col in enumerate(cols):
+      setattr(row, self.fields[i][0], self.decoders[i](col))
     return row
 
 def create_ddlib_sentence(row):
@@ -162,6 +474,108 @@ def create_ddlib_sentence(row):
         dep_label=row.dep_paths[i]))
   return sentence
 
+SENTENCE_FIELDS = ('words', 'lemmas', 'poses', 'ners', 'dep_paths', 'dep_parents')
+
+class ParsedSentence(object):
+  """
+  The sentence arrays of a row, and the structures derived from them (dependency DAG,
+  ddlib sentence, joined phrases)- built once and shared by all the mention pairs in
+  the sentence
+  """
+  def __init__(self, row, fields=SENTENCE_FIELDS):
+    self.fields = [f for f in fields if hasattr(row, f)]
+    for f in self.fields:
+      setattr(self, f, getattr(row, f))
+    self.dep_dags = {}
+    self._ddlib_sentence = None
+    self._phrase = None
+    self._lemma_phrase = None
+
+  @property
+  def phrase(self):
+    if self._phrase is None:
+      self._phrase = ' '.join(self.words)
+    return self._phrase
+
+  @property
+  def lemma_phrase(self):
+    if self._lemma_phrase is None:
+      self._lemma_phrase = ' '.join(self.lemmas)
+    return self._lemma_phrase
+
+  def dep_dag(self, max_path_len=None):
+    dag = self.dep_dags.get(max_path_len)
+    if dag is None:
+      dag = self.dep_dags[max_path_len] = deps.DepPathDAG(self.dep_parents, self.dep_paths,
+                                                          self.words, max_path_len=max_path_len)
+    return dag
+
+  def ddlib_sentence(self):
+    if self._ddlib_sentence is None:
+      self._ddlib_sentence = create_ddlib_sentence(self)
+    return self._ddlib_sentence
+
+SENTENCE_CACHE_SIZE = 64
+
+class SentenceCache:
+  """
+  LRU cache of ParsedSentence objects keyed by (doc_id, section_id, sent_id), for extractors
+  whose input has one row per mention pair (so the same sentence arrives many times, and
+  usually in consecutive rows)
+  """
+  def __init__(self, fields=SENTENCE_FIELDS, max_size=SENTENCE_CACHE_SIZE):
+    self.fields = fields
+    self.max_size = max_size
+    self.sentences = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, row):
+    """
+    Return the ParsedSentence of the row's sentence. On a hit, the cached sentence arrays
+    are also set on the row, so that (lazily parsed) rows don't decode them again
+    """
+    key = (row.doc_id, row.section_id, row.sent_id)
+    sentence = self.sentences.pop(key, None)
+    if sentence is None:
+      self.misses += 1
+      sentence = ParsedSentence(row, self.fields)
+      if len(self.sentences) >= self.max_size:
+        self.sentences.popitem(last=False)
+    else:
+      self.hits += 1
+      for f in sentence.fields:
+        setattr(row, f, getattr(sentence, f))
+    self.sentences[key] = sentence
+    return sentence
+
+def expand_sentence_row(row, row_class, sentence_fields, pair_groups):
+  """
+  Split a row holding a sentence plus arrays of mention attributes into one row (of
+  row_class, e.g. RowParser(...).row_class) per mention pair, as if read one per line.
+  Each of pair_groups is a list of (per-pair field, array field of row holding its values);
+  the values within a group are zipped, and the pairs are the cross product of the groups
+  """
+  groups = []
+  for group in pair_groups:
+    arrays = [(f, getattr(row, a)) for f, a in group]
+    groups.append([[(f, vals[k]) for f, vals in arrays] for k in xrange(len(arrays[0][1]))])
+  for combination in itertools.product(*groups):
+    pair_row = object.__new__(row_class)
+    for f in sentence_fields:
+      setattr(pair_row, f, getattr(row, f))
+    for values in combination:
+      for f, val in values:
+        setattr(pair_row, f, val)
+    yield pair_row
+
+def per_sentence_input():
+  """
+  Per-sentence input mode (one row per sentence, with arrays of mention pairs) is turned
+  on by a --per-sentence argument, for extractors which support it
+  """
+  return '--per-sentence' in sys.argv
+
 def pg_array_escape(tok):
   """
   Escape a string that's meant to be in a Postgres array.
@@ -173,8 +587,8 @@ def list_to_pg_array(l):
   """Convert a list to a string that PostgreSQL's COPY FROM understands."""
   return '{%s}' % ','.join(pg_array_escape(x) for x in l)
 
-def print_tsv_output(out_record):
-  """Print a tuple as output of TSV extractor."""
+def tsv_output_string(out_record):
+  """Format a tuple as a line (without newline) of output of TSV extractor."""
   values = []
   for x in out_record:
     if isinstance(x, list) or isinstance(x, tuple):
@@ -184,14 +598,669 @@ def print_tsv_output(out_record):
     else:
       cur_val = x
     values.append(cur_val)
-  print '\t'.join(str(x) for x in values)
+  return '\t'.join(str(x) for x in values)
 
-def run_main_tsv(row_parser, row_fn):
+def print_tsv_output(out_record):
+  """Print a tuple as output of TSV extractor."""
+  print tsv_output_string(out_record)
+
+# Sizes of the blocks read from stdin, and of the output buffered before writing to stdout
+IN_BLOCK_SIZE = 1 << 20
+OUT_BUFFER_SIZE = 1 << 20
+
+def read_tsv_lines(stream, block_size=IN_BLOCK_SIZE):
+  """Yield the lines of stream, reading it in blocks of ~block_size bytes"""
+  while True:
+    lines = stream.readlines(block_size)
+    if not lines:
+      break
+    for line in lines:
+      yield line
+
+class TsvWriter:
+  """Writes TSV extractor output records to stream, buffering them into large writes"""
+  def __init__(self, stream, buffer_size=OUT_BUFFER_SIZE):
+    self.stream = stream
+    self.buffer_size = buffer_size
+    self.buf = []
+    self.buf_len = 0
+    self.rows = 0
+    self.bytes = 0
+
+  def write(self, out_record):
+    self.write_line(tsv_output_string(out_record) + '\n')
+
+  def write_line(self, line):
+    """Write an already formatted output line (with newline)"""
+    self.buf.append(line)
+    self.buf_len += len(line)
+    self.rows += 1
+    if self.buf_len >= self.buffer_size:
+      self.flush()
+
+  def write_lines(self, text, rows):
+    """Write a block of already formatted output lines"""
+    self.buf.append(text)
+    self.buf_len += len(text)
+    self.rows += rows
+    if self.buf_len >= self.buffer_size:
+      self.flush()
+
+  def flush(self):
+    if self.buf:
+      self.stream.write(''.join(self.buf))
+      self.bytes += self.buf_len
+      self.buf = []
+      self.buf_len = 0
+    self.stream.flush()
+
+FEATURE_ID_MODES = ('name', 'hash', 'intern')
+
+def feature_hash(name):
+  """A stable, signed 64-bit hash of a feature name (fits a postgres bigint)"""
+  return struct.unpack('>q', hashlib.md5(name).digest()[:8])[0]
+
+class FeatureIds:
+  """
+  Replaces the feature names (the last column) of feature output records by integer ids,
+  either stable hashes or interned ids (dense, in order of first appearance). If given a
+  path, the (id, name) row of each new feature is appended to that side table as it is seen;
+  in hash mode only the ids seen are kept in memory
+  """
+  def __init__(self, mode='hash', path=None):
+    if mode not in ('hash', 'intern'):
+      raise ValueError('Unknown feature id mode: %s' % mode)
+    self.mode = mode
+    self.path = path
+    self.names = None
+    self.seen = set()
+    self.ids = {}
+
+  def id(self, name):
+    if self.mode == 'hash':
+      rv = feature_hash(name)
+      if rv not in self.seen:
+        self.seen.add(rv)
+        self.write_name(rv, name)
+      return rv
+    rv = self.ids.get(name)
+    if rv is None:
+      rv = self.ids[name] = len(self.ids) + 1
+      self.write_name(rv, name)
+    return rv
+
+  def encode(self, out_record):
+    return tuple(out_record[:-1]) + (self.id(out_record[-1]),)
+
+  def write_name(self, i, name):
+    if self.path is None:
+      return
+    if self.names is None:
+      d = os.path.dirname(self.path)
+      if d and not os.path.isdir(d):
+        os.makedirs(d)
+      self.names = open(self.path, 'w')
+    self.names.write('%d\t%s\n' % (i, name))
+
+  def close(self):
+    if self.names is not None:
+      self.names.close()
+      self.names = None
+
+def feature_ids(opts, path=None):
+  """
+  Return the FeatureIds for the given feature output options (see config.FEATURES), writing
+  its side table to path if given, or None if features are output by name
+  """
+  mode = opts.get('id-mode', 'name')
+  if mode not in FEATURE_ID_MODES:
+    raise ValueError('Unknown feature id mode: %s' % mode)
+  return FeatureIds(mode, path) if mode != 'name' else None
+
+def feature_names_path(opts, name=None):
+  """Path of this process' id -> name side table"""
+  name = name or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+  return '%s/%s/%s.%d.tsv' % (APP_HOME, opts.get('names-dir', 'feature_names'), name, os.getpid())
+
+def run_features_tsv(row_parser, row_fn, opts, **kwargs):
+  """
+  run_main_tsv for the feature extractors, whose output records end with the feature name:
+  depending on opts (see config.FEATURES), names are output as is or replaced by ids, in
+  which case the side table of names is written as new names are seen
+  """
+  ids = feature_ids(opts, feature_names_path(opts))
+  if ids is None:
+    return run_main_tsv(row_parser, row_fn, **kwargs)
+  if ids.mode == 'intern' and incremental_enabled():
+    raise ValueError("Interned feature ids differ between runs: use 'hash' ids in incremental mode")
+  try:
+    run_main_tsv(row_parser, row_fn, encode=ids.encode, **kwargs)
+  finally:
+    ids.close()
+
+def profiling_enabled():
+  """Profile mode is turned on by a --profile argument, or GDD_PROFILE=1 from within DeepDive"""
+  return '--profile' in sys.argv or bool(os.environ.get('GDD_PROFILE'))
+
+def print_profile(name, rows_in, bytes_in, rows_out, bytes_out, elapsed):
+  elapsed = max(elapsed, 1e-9)
+  sys.stderr.write("PROFILE[%s]: %d rows in (%.1f rows/sec, %.1f bytes/sec), "
+                   "%d rows out (%.1f rows/sec, %.1f bytes/sec), %.3f sec\n" % (name,
+                   rows_in, rows_in / elapsed, bytes_in / elapsed,
+                   rows_out, rows_out / elapsed, bytes_out / elapsed, elapsed))
+
+def incremental_enabled():
+  """Incremental mode (see incremental.py) is turned on by --incremental, or GDD_INCREMENTAL=1"""
+  import incremental
+  return incremental.enabled()
+
+def _row_cache():
+  import incremental
+  return incremental.RowCache()
+
+def _int_option(flag, env, default=0):
+  """The value of an integer option, given as a `flag N` argument, or as env from within DeepDive"""
+  for i, arg in enumerate(sys.argv):
+    if arg == flag and i + 1 < len(sys.argv):
+      return int(sys.argv[i + 1])
+    if arg.startswith(flag + '='):
+      return int(arg.split('=', 1)[1])
+  return int(os.environ.get(env) or default)
+
+def worker_count():
+  """
+  The number of worker processes to fan input out to, set by a --workers N argument, or
+  GDD_WORKERS=N from within DeepDive; 0 means rows are processed in this process
+  """
+  return _int_option('--workers', 'GDD_WORKERS')
+
+def instrumentation_enabled():
+  """
+  Instrumentation (see Instruments) is turned on by an --instrument argument, or
+  GDD_INSTRUMENT=1 from within DeepDive
+  """
+  return '--instrument' in sys.argv or bool(os.environ.get('GDD_INSTRUMENT'))
+
+class Stage(object):
+  """
+  A section of a UDF, timed by Instruments: use as a context manager around the code, and
+  call fired() when a (supervision rule) stage decides the outcome. Calls & fires are always
+  counted; time only on the rows sampled by Instruments
+  """
+  __slots__ = ('instruments', 'calls', 'fires', 'seconds', 'start')
+
+  def __init__(self, instruments):
+    self.instruments = instruments
+    self.calls = 0
+    self.fires = 0
+    self.seconds = 0.0
+    self.start = None
+
+  def __enter__(self):
+    self.calls += 1
+    if self.instruments.timing:
+      self.start = time.time()
+    return self
+
+  def __exit__(self, *exc_info):
+    if self.start is not None:
+      # Time on every sample_every-th row stands for that of sample_every rows
+      self.seconds += (time.time() - self.start) * self.instruments.sample_every
+      self.start = None
+    return False
+
+  def fired(self, rv=None):
+    """Count a fire of this rule, returning rv"""
+    self.fires += 1
+    return rv
+
+  def values(self):
+    return self.calls, self.fires, self.seconds
+
+  def add(self, values):
+    calls, fires, seconds = values
+    self.calls += calls
+    self.fires += fires
+    self.seconds += seconds
+
+class Instruments(object):
+  """
+  Per-stage counts & timings of a UDF: run_main_tsv times parsing the input rows ('parse'),
+  row_fn (e.g. 'candidates' or 'features', see udf_stage) and formatting/writing the output
+  ('output'); extractors wrap finer stages in stage(name), and each supervision rule in
+  rule(name). Stages nest, so the time of a stage includes that of the stages & rules within
+  it; lazily decoded columns (see RowParser) are decoded in the stage which first uses them.
+  Timing is off unless enabled (see instrumentation_enabled); with sample_every N
+  (--instrument-sample N, or GDD_INSTRUMENT_SAMPLE=N), only every N-th row is timed
+  """
+  def __init__(self):
+    self.enabled = False
+    self.sample_every = 1
+    self.timing = False
+    self.row = 0
+    self.stages = collections.OrderedDict()
+    self.rules = collections.OrderedDict()
+
+  def configure(self, enabled=None, sample_every=None):
+    self.enabled = instrumentation_enabled() if enabled is None else enabled
+    if sample_every is None:
+      sample_every = _int_option('--instrument-sample', 'GDD_INSTRUMENT_SAMPLE', 1)
+    self.sample_every = max(sample_every, 1)
+
+  def stage(self, name):
+    rv = self.stages.get(name)
+    if rv is None:
+      rv = self.stages[name] = Stage(self)
+    return rv
+
+  def rule(self, name):
+    rv = self.rules.get(name)
+    if rv is None:
+      rv = self.rules[name] = Stage(self)
+    return rv
+
+  def next_row(self):
+    """Start timing the next input row, if it is sampled"""
+    self.row += 1
+    self.timing = self.enabled and self.row % self.sample_every == 0
+
+  def reset(self):
+    self.row = 0
+    self.timing = False
+    # In place, as extractors may hold on to their stages
+    for stages in (self.stages, self.rules):
+      for s in stages.itervalues():
+        s.calls, s.fires, s.seconds, s.start = 0, 0, 0.0, None
+
+  def snapshot(self):
+    return ([(name, s.values()) for name, s in self.stages.iteritems()],
+            [(name, s.values()) for name, s in self.rules.iteritems()])
+
+  def add(self, snapshot):
+    stages, rules = snapshot
+    for name, values in stages:
+      self.stage(name).add(values)
+    for name, values in rules:
+      self.rule(name).add(values)
+
+  def summary(self):
+    return collections.OrderedDict([
+      ('sample_every', self.sample_every),
+      ('stages', collections.OrderedDict(
+        (name, collections.OrderedDict([('calls', s.calls), ('seconds', round(s.seconds, 6))]))
+        for name, s in self.stages.iteritems())),
+      ('rules', collections.OrderedDict(
+        (name, collections.OrderedDict([('calls', s.calls), ('fired', s.fires),
+                                        ('hit_rate', round(s.fires / float(s.calls), 6) if s.calls else 0.0),
+                                        ('seconds', round(s.seconds, 6)),
+                                        ('us_per_call', round(1e6 * s.seconds / s.calls, 3) if s.calls else 0.0)]))
+        for name, s in self.rules.iteritems()))])
+
+# The instruments of this process, see Instruments
+INSTRUMENTS = Instruments()
+
+def udf_stage(name=None):
+  """The stage name of the row_fn of UDF name (by default, the running script)"""
+  name = name or os.path.basename(sys.argv[0])
+  for stage in ('candidates', 'features', 'supervision'):
+    if stage in name:
+      return stage
+  return 'row_fn'
+
+def print_instruments(name, workers, rows_in, bytes_in, rows_out, bytes_out, elapsed):
+  import json
+  summary = collections.OrderedDict([
+    ('udf', name), ('workers', workers), ('rows_in', rows_in), ('bytes_in', bytes_in),
+    ('rows_out', rows_out), ('bytes_out', bytes_out), ('seconds', round(elapsed, 6))])
+  summary.update(INSTRUMENTS.summary())
+  sys.stderr.write('INSTRUMENTS: %s\n' % json.dumps(summary))
+
+def print_progress(name, rows_in, rows_out, elapsed):
+  elapsed = max(elapsed, 1e-9)
+  sys.stderr.write('PROGRESS[%s]: %d rows in (%.1f rows/sec), %d rows out, %.1f sec\n' %
+                   (name, rows_in, rows_in / elapsed, rows_out, elapsed))
+  sys.stderr.flush()
+
+# The number of input rows in each chunk handed to a worker process
+CHUNK_ROWS = 500
+
+class ModuleCounters:
+  """
+  Global counters of a UDF module (or counter attributes of any object), e.g. the pos_count
+  & neg_count used to keep supervision balanced. With workers (see run_main_tsv), each input
+  chunk is processed starting from zeroed counters, and the per-chunk counts are added up
+  into the parent process' counters, which hold the totals at the end of the run. Counters
+  which the output depends on (balancing, e.g. pos/neg counts compared to sample negatives)
+  are thus only balanced within each chunk of CHUNK_ROWS rows, so that the output differs
+  from that of a serial run: see run_main_tsv's chunk_balancing. Counters which are only
+  totaled (e.g. NegativeSampler.counters) are the same in both
+  """
+  def __init__(self, module, names, balancing=True):
+    self.module = module
+    self.names = tuple(names)
+    self.balancing = balancing
+
+  def reset(self):
+    for name in self.names:
+      setattr(self.module, name, 0)
+
+  def values(self):
+    return tuple(getattr(self.module, name) for name in self.names)
+
+  def add(self, counts):
+    for name, c in zip(self.names, counts):
+      setattr(self.module, name, getattr(self.module, name) + c)
+
+class SideOutput:
+  """
+  A file which row_fn writes text to besides its output rows (e.g. a log of matches). With
+  workers, the text written while processing a chunk is sent back with the chunk's output,
+  and written by the parent process, in the order of the output
+  """
+  def __init__(self, f):
+    self.f = f
+    self.buffer = None
+
+  def write(self, s):
+    if self.buffer is not None:
+      self.buffer.append(s)
+    else:
+      self.f.write(s)
+
+  def flush(self):
+    if self.buffer is None:
+      self.f.flush()
+
+  def start_chunk(self):
+    self.buffer = []
+
+  def end_chunk(self):
+    rv = ''.join(self.buffer)
+    self.buffer = None
+    return rv
+
+# What the pool workers run; set before forking, so inherited (rather than pickled)
+_WORKER = {}
+
+def _run_chunk(chunk):
+  """Process a chunk (chunk number, input lines) in a worker, returning its output and counts"""
+  try:
+    i, lines = chunk
+    row_parser, row_fn, counters, sides, raw, cached = _WORKER['row_parser'], _WORKER['row_fn'], \
+        _WORKER['counters'], _WORKER['sides'], _WORKER['raw'], _WORKER['cached']
+    # Each chunk is sampled from its own, deterministic random sequence
+    random.seed(i)
+    for c in counters:
+      c.reset()
+    INSTRUMENTS.reset()
+    parse, process, output = \
+        INSTRUMENTS.stage('parse'), INSTRUMENTS.stage(_WORKER['stage']), INSTRUMENTS.stage('output')
+    out = []
+    sizes = []
+    # The side output of each row, and its counter increments if the output is cached
+    row_sides = []
+    row_counts = []
+    for line in lines:
+      INSTRUMENTS.next_row()
+      before = [c.values() for c in counters] if cached else None
+      for side in sides:
+        side.start_chunk()
+      with parse:
+        row = row_parser(line)
+      with process:
+        rows_out = list(row_fn(row))
+      with output:
+        out.extend(rows_out if raw else [tsv_output_string(r) + '\n' for r in rows_out])
+      sizes.append(len(rows_out))
+      row_sides.append([side.end_chunk() for side in sides])
+      if cached:
+        row_counts.append(_increments(counters, before))
+    return out, [c.values() for c in counters], row_sides, sizes, row_counts, INSTRUMENTS.snapshot()
+  except Exception:
+    # Pass the worker's traceback up to the parent, which re-raises this
+    raise RuntimeError('Error in worker process:\n' + traceback.format_exc())
+
+def _increments(counters, before):
+  return [tuple(a - b for a, b in zip(c.values(), values)) for c, values in zip(counters, before)]
+
+def _cache_extra(counts, records, side_out, encode):
+  """
+  What is replayed along with the cached output of a row when it is reused: the increments of
+  the counters, the names which encode replaced in the last column of its output records, and
+  the text it wrote to each SideOutput
+  """
+  names = []
+  if encode is not None:
+    seen = set()
+    for r in records:
+      if r[-1] not in seen:
+        seen.add(r[-1])
+        names.append(r[-1])
+  return marshal.dumps((counts, names, side_out))
+
+def _replay_extra(extra, counters, sides, encode):
+  """Replay the _cache_extra of a reused row"""
+  counts, names, side_out = marshal.loads(extra)
+  for c, increments in zip(counters, counts):
+    c.add(increments)
+  for side, s in zip(sides, side_out):
+    side.write(s)
+  if encode is not None:
+    for name in names:
+      encode((name,))
+
+def _chunks(lines, chunk_rows):
+  while True:
+    chunk = list(itertools.islice(lines, chunk_rows))
+    if not chunk:
+      break
+    yield chunk
+
+def _run_pool(row_parser, row_fn, lines, writer, encode, workers, ordered, counters, sides=(),
+              cache=None, stage='row_fn'):
+  """
+  Fan chunks of lines out to a pool of forked workers, writing their output (and side
+  outputs) as it comes. Given a RowCache, only the lines of a chunk which are not cached are
+  sent to a worker; the output of the others is reused when the chunk's result is written,
+  in input order, and that of the new lines cached
+  """
+  import multiprocessing
+  _WORKER.update(row_parser=row_parser, row_fn=row_fn, counters=counters, sides=sides,
+                 raw=encode is not None, cached=cache is not None, stage=stage)
+  # Anything buffered now would be written by every worker as well
+  sys.stdout.flush()
+  sys.stderr.flush()
+  pool = multiprocessing.Pool(workers)
+  pending = collections.deque()
+
+  def write_result((chunk, hits, result)):
+    records, row_sides, sizes, row_counts = [], [], [], []
+    if result is not None:
+      records, counts, row_sides, sizes, row_counts, instruments = result.get()
+      for c, chunk_counts in zip(counters, counts):
+        c.add(chunk_counts)
+      INSTRUMENTS.add(instruments)
+    out = records
+    if encode:
+      out = [tsv_output_string(encode(line_out)) + '\n' for line_out in records]
+    n = 0
+    rows = iter(xrange(len(sizes)))
+    for line, hit in zip(chunk, hits):
+      if hit is not None:
+        text, rows_out, extra = hit
+        writer.write_lines(text, rows_out)
+        _replay_extra(extra, counters, sides, encode)
+        continue
+      r = next(rows)
+      for side, s in zip(sides, row_sides[r]):
+        side.write(s)
+      for line_out in out[n:n + sizes[r]]:
+        writer.write_line(line_out)
+      if cache is not None:
+        cache.put(line, out[n:n + sizes[r]],
+                  _cache_extra(row_counts[r], records[n:n + sizes[r]], row_sides[r], encode))
+      n += sizes[r]
+
+  def next_result():
+    if not ordered:
+      for item in pending:
+        if item[2] is None or item[2].ready():
+          pending.remove(item)
+          return item
+    return pending.popleft()
+
+  try:
+    for c in counters:
+      c.reset()
+    for i, chunk in enumerate(_chunks(lines, CHUNK_ROWS)):
+      hits = [cache.get(line) for line in chunk] if cache is not None else [None] * len(chunk)
+      todo = [line for line, hit in zip(chunk, hits) if hit is None]
+      pending.append((chunk, hits, pool.apply_async(_run_chunk, ((i, todo),)) if todo else None))
+      # Bound the number of chunks in flight, so that input is not read ahead unboundedly
+      while len(pending) >= 2 * workers:
+        write_result(next_result())
+    while pending:
+      write_result(next_result())
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+def _run_serial(row_parser, row_fn, lines, writer, encode, counters=(), sides=(), cache=None,
+                stage='row_fn'):
+  """
+  Process lines in this process, timing each stage; given a RowCache, the output of cached
+  lines is reused, and that of the others cached
+  """
+  parse, process, output = \
+      INSTRUMENTS.stage('parse'), INSTRUMENTS.stage(stage), INSTRUMENTS.stage('output')
+  for line in lines:
+    if cache is not None:
+      hit = cache.get(line)
+      if hit is not None:
+        text, rows, extra = hit
+        writer.write_lines(text, rows)
+        _replay_extra(extra, counters, sides, encode)
+        continue
+    INSTRUMENTS.next_row()
+    if cache is not None:
+      before = [c.values() for c in counters]
+      for side in sides:
+        side.start_chunk()
+    with parse:
+      row = row_parser(line)
+    with process:
+      rows_out = list(row_fn(row))
+    with output:
+      out = [tsv_output_string(encode(r) if encode else r) + '\n' for r in rows_out]
+      for line_out in out:
+        writer.write_line(line_out)
+    if cache is not None:
+      side_out = [side.end_chunk() for side in sides]
+      for side, s in zip(sides, side_out):
+        side.write(s)
+      cache.put(line, out, _cache_extra(_increments(counters, before), rows_out, side_out, encode))
+
+def run_main_tsv(row_parser, row_fn, instream=None, outstream=None, profile=None, encode=None,
+                 workers=None, ordered=True, counters=None, chunk_balancing=False, sides=None,
+                 incremental=None, instrument=None, stage=None):
   """
   Runs through lines in sys.stdin, applying row_fn(row_parser(line))
   Assumes that this outputs a list of rows, which get printed out in tsv format
+  (after applying encode to each, if given)
   Has standard error handling for malformed rows- optimally row_fn returns object with pretty print
+  Input is read and output written in large blocks; in profile mode (see profiling_enabled),
+  rows/sec and bytes/sec are reported to stderr at the end
+
+  With workers (default: see worker_count), chunks of input rows are processed by that many
+  worker processes, forked here- i.e. after the static data have been loaded, which they
+  share copy-on-write. Output is in input order unless ordered=False. Module global counters
+  which row_fn updates must be passed as (a list of) ModuleCounters, see there: as each chunk
+  starts from zeroed counters, a UDF with balancing counters is run with workers only if it
+  accepts balancing per chunk, with chunk_balancing=True, and else in this process. With
+  chunk_balancing, each chunk is balanced on its own counts, and draws from the random module
+  seeded with its chunk number: the output is reproducible for a given CHUNK_ROWS, but differs
+  from that of a serial run (whose counters span all of the input), and in incremental mode
+  from that of a run without cache (reused rows are not part of their chunk's counts). Files
+  which row_fn writes to must be passed as (a list of) SideOutputs.
+
+  In incremental mode (default: see incremental_enabled), the output of rows already processed
+  by a previous run with the same fingerprint is reused instead (see incremental.py), along with
+  their counter increments, side output and the names encode replaced in their output (replayed
+  through encode, as 1-tuples), in input order.
+
+  With instrument (default: see instrumentation_enabled), time spent in each stage & rule of
+  the UDF is recorded (see Instruments; row_fn is timed as stage, by default see udf_stage),
+  and summed up as JSON to stderr at the end; with a --progress S argument (or
+  GDD_PROGRESS=S), progress is also reported every S seconds.
+  Returns the number of input rows
   """
-  for line in sys.stdin:
-    for line_out in row_fn(row_parser(line)):
-      print_tsv_output(line_out)
+  instream = instream or sys.stdin
+  writer = TsvWriter(outstream or sys.stdout)
+  if profile is None:
+    profile = profiling_enabled()
+  if workers is None:
+    workers = worker_count()
+  if counters is None:
+    counters = []
+  elif isinstance(counters, ModuleCounters):
+    counters = [counters]
+  if sides is None:
+    sides = []
+  elif isinstance(sides, SideOutput):
+    sides = [sides]
+  if workers > 0 and not chunk_balancing and any(c.balancing for c in counters):
+    sys.stderr.write('WARNING[UDF]: %s balances its output on running counters, which workers '
+                     'would only balance per chunk: running in one process\n' % os.path.basename(sys.argv[0]))
+    workers = 0
+  if incremental is None:
+    incremental = incremental_enabled()
+  cache = _row_cache() if incremental else None
+  INSTRUMENTS.configure(instrument)
+  stage = stage or udf_stage()
+  progress = _int_option('--progress', 'GDD_PROGRESS')
+  name = os.path.basename(sys.argv[0])
+  counts = {'rows' : 0, 'bytes' : 0}
+
+  def counted(lines):
+    for line in lines:
+      counts['rows'] += 1
+      counts['bytes'] += len(line)
+      yield line
+
+  def reported(lines):
+    next_report = start_time + progress
+    for line in lines:
+      yield line
+      now = time.time()
+      if now >= next_report:
+        print_progress(name, counts['rows'], writer.rows, now - start_time)
+        next_report = now + progress
+
+  start_time = time.time()
+  try:
+    lines = counted(read_tsv_lines(instream))
+    if progress > 0:
+      lines = reported(lines)
+    if workers > 0:
+      _run_pool(row_parser, row_fn, lines, writer, encode, workers, ordered, counters, sides,
+                cache, stage)
+    elif cache is not None or INSTRUMENTS.enabled:
+      _run_serial(row_parser, row_fn, lines, writer, encode, counters, sides, cache, stage)
+    else:
+      for line in lines:
+        for line_out in row_fn(row_parser(line)):
+          writer.write(encode(line_out) if encode else line_out)
+  finally:
+    writer.flush()
+    if cache is not None:
+      cache.close()
+  if profile:
+    print_profile(name, counts['rows'], counts['bytes'], writer.rows, writer.bytes,
+                  time.time() - start_time)
+  if INSTRUMENTS.enabled:
+    print_instruments(name, workers, counts['rows'], counts['bytes'], writer.rows, writer.bytes,
+                      time.time() - start_time)
+  return counts['rows']
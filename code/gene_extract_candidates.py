@@ -1,14 +1,15 @@
 #!/usr/bin/env python
+import artifacts
 import collections
 import extractor_util as util
 import data_util as dutil
-import random
+import sampling
 import re
 import os
 import sys
 import string
 import config
-import dep_util as deps
+import supervision_util as supervision
 
 CACHE = dict()  # Cache results of disk I/O
 
@@ -45,20 +46,20 @@ Mention = collections.namedtuple('Mention', [
 HF = config.GENE['HF']
 SR = config.GENE['SR']
 
+def _read_pubmed_to_genes_tsv():
+  with open('%s/onto/data/pmid_to_ensembl.tsv' % util.APP_HOME) as f:
+    return dutil.StringSetMap(line.rstrip('\n').split('\t') for line in f)
+
 def read_pubmed_to_genes():
   """NCBI provides a list of articles (PMIDs) that discuss a particular gene (Entrez IDs).
   These provide a nice positive distant supervision set, as mentions of a gene name in
   an article about that gene are likely to be true mentions.
   
-  This returns a dictionary that maps from Pubmed ID to a set of ENSEMBL genes mentioned
-  in that article.
+  This returns a dictionary (a StringSetMap) that maps from Pubmed ID to a set of ENSEMBL
+  genes mentioned in that article.
   """
-  pubmed_to_genes = collections.defaultdict(set)
-  with open('%s/onto/data/pmid_to_ensembl.tsv' % util.APP_HOME) as f:
-    for line in f:
-      pubmed,gene = line.rstrip('\n').split('\t')
-      pubmed_to_genes[pubmed].add(gene)
-  return pubmed_to_genes
+  return artifacts.cached('pubmed_to_genes', ['%s/onto/data/pmid_to_ensembl.tsv' % util.APP_HOME],
+                          _read_pubmed_to_genes_tsv)
 
 def select_mapping_type(mapping_types):
   mapping_order = HF['ensembl-mapping-types']
@@ -67,23 +68,40 @@ def select_mapping_type(mapping_types):
       return m
   assert False, ','.join(mapping_types)
 
+def candidate_mapping_types(gene_name_to_genes):
+  """
+  The mapping type of the mentions of each name of a GeneNameMap (see select_mapping_type), by
+  name index, or None for the names which are not extracted (shorter than the min-word-len of
+  their mapping type, or without a letter if require-one-letter)- computed once at load time
+  rather than for every matching token
+  """
+  rv = []
+  for i, name in enumerate(gene_name_to_genes.keys):
+    mapping_type = select_mapping_type(gene_name_to_genes.index_mapping_types(i))
+    if len(name) < HF['min-word-len'][mapping_type]:
+      mapping_type = None
+    elif HF['require-one-letter'] and not re.match(r'.*[a-zA-Z].*', name):
+      mapping_type = None
+    rv.append(mapping_type)
+  return rv
+
 def extract_candidate_mentions(row):
-  gene_name_to_genes = CACHE['gene_name_to_genes']
-  mentions = []
+  index = CACHE['gene_name_to_genes'].index
+  mapping_types = CACHE['mapping_types']
+  hits = []
   for i, word in enumerate(row.words):
-    if HF['require-one-letter']:
-      if not re.match(r'.*[a-zA-Z].*', word):
-        continue
-    if (word in gene_name_to_genes):
-      matches = gene_name_to_genes[word]
-      mapping_types = set()
-      for (eid, canonical_name, mapping_type) in matches:
-        mapping_types.add(mapping_type)
-      mapping_type = select_mapping_type(mapping_types)
-      if len(word) >= HF['min-word-len'][mapping_type]:
-        m = create_supervised_mention(row, i, gene_name=word, mapping_type=mapping_type)
-        if m:
-          mentions.append(m)
+    k = index(word)
+    if k >= 0 and mapping_types[k] is not None:
+      hits.append((i, word, mapping_types[k]))
+  if not hits:
+    return []
+  # The phrases & dependency DAG are shared by the mentions of the sentence, and built lazily
+  sentence = util.ParsedSentence(row)
+  mentions = []
+  for i, word, mapping_type in hits:
+    m = create_supervised_mention(row, i, gene_name=word, mapping_type=mapping_type, sentence=sentence)
+    if m:
+      mentions.append(m)
   return mentions
 
 def contains_sublist(lst, sublst):
@@ -111,158 +129,189 @@ def detect_manual(gene_name, words):
 
 ### DISTANT SUPERVISION ###
 VALS = config.GENE['vals']
-def create_supervised_mention(row, i, gene_name=None, mapping_type=None, mention_supertype=None, mention_subtype=None):
-  """Given a Row object consisting of a sentence, create & supervise a Mention output object"""
+
+# Derived values, computed on first use by a rule (see supervision_util.Candidate)
+DERIVATIONS = {
+  'sent_phrases' : lambda c: c.sentence.phrase + ' ' + c.sentence.lemma_phrase}
+
+def _post_neighbor_match(c, opts, name, val):
+  if c.i < len(c.row.words) - 1:
+    post_neighbor = c.row.words[c.i+1]
+    match = util.rule_group(opts, name).search(post_neighbor)
+    if match:
+      return c.m._replace(is_correct=val, mention_supertype='POST_MATCH_%s_%s' % (name, val), mention_subtype=match)
+
+def _bad_genes(c, opts, bad_gene_rgxs):
+  i, words = c.i, c.row.words
+  prev_word = words[i-1] if i > 0 else ''
+  next_word = words[i+1] if i < len(words) - 1 else ''
+  if next_word != 'gene' and prev_word != 'gene':
+    for bad_gene in bad_gene_rgxs:
+      if bad_gene.search(c.gene_name):
+        return c.m._replace(is_correct=False, mention_supertype='BAD_GENE')
+
+def _manual_bad(c, opts):
+  detected = detect_manual(c.gene_name, c.row.words)
+  if detected is not None:
+    return c.m._replace(is_correct=False, mention_supertype='MANUAL_BAD', mention_subtype=detected)
+
+def _pre_neighbor_match(c, opts, name, val):
+  if c.i > 0:
+    pre_neighbor = c.row.words[c.i-1]
+    match = util.rule_group(opts, name).search(pre_neighbor)
+    if match:
+      return c.m._replace(is_correct=val, mention_supertype='PRE_NEIGHBOR_MATCH_%s_%s' % (name, val), mention_subtype=match)
+
+def _phrases_in_sent(c, opts, name, val):
+  match = util.rule_group(opts, name).search(c.sent_phrases)
+  if match:
+    # backslashes cause postgres errors in postgres 9
+    return c.m._replace(is_correct=val, mention_supertype='PHRASE_%s' % name, mention_subtype=match.replace('\\', '/'))
+
+## DS RULE: matches from papers that NCBI annotates as being about the mentioned gene are likely true.
+def _pubmed_paper_genes_true(c, opts):
+  pubmed_to_genes = CACHE['pubmed_to_genes']
+  pmid = dutil.get_pubmed_id_for_doc(c.row.doc_id)
+  if pmid and c.gene_name:
+    for (mention_ensembl_id, canonical_name, mapping_type) in CACHE['gene_name_to_genes'][c.gene_name]:
+      if mention_ensembl_id in pubmed_to_genes.get(pmid, {}):
+        return c.m._replace(is_correct=True, mention_supertype='%s_NCBI_ANNOTATION_TRUE' % c.m.mention_supertype, mention_subtype=mention_ensembl_id)
+
+## DS RULE: Genes on the gene list with complicated names are probably good for exact matches.
+def _complicated_gene_names_true(c, opts):
+  if c.m.mapping_type in HF['ensembl-mapping-types']:
+    if re.match(r'[a-zA-Z]{3}[a-zA-Z]*\d+\w*', c.word):
+      return c.m._replace(is_correct=True, mention_supertype='COMPLICATED_GENE_NAME')
+
+def _all_canonical_true(c, opts):
+  if c.m.mapping_type == 'CANONICAL_SYMBOL':
+    return c.m._replace(is_correct=True, mention_supertype='%s_ALL_TRUE' % c.m.mention_supertype)
+
+def _all_symbols_true(c, opts):
+  if c.m.mapping_type in HF['ensembl-mapping-types']:
+    return c.m._replace(is_correct=True, mention_supertype='%s_ALL_TRUE' % c.m.mention_supertype)
+
+def _neighbor_match(c, opts, name, val):
+  for neighbor_idx in c.sentence.dep_dag().neighbors(c.i):
+    neighbor = c.row.words[neighbor_idx]
+    match = util.rule_group(opts, name).search(neighbor)
+    if match:
+      return c.m._replace(is_correct=val, mention_supertype='NEIGHBOR_MATCH_%s_%s' % (name, val), mention_subtype='Neighbor: ' + neighbor + ', match: ' + match)
+
+def mention_rules(SR):
+  """The gene mention supervision rules, in order"""
+  return (supervision.val_rules('post-neighbor-match', 'post-neighbor-match', _post_neighbor_match, VALS,
+                                enabled=supervision.has_rule_group) +
+          [supervision.Rule('bad-genes', 'bad-genes', _bad_genes,
+                            args=([re.compile(r) for r in SR.get('bad-genes') or []],), label=False, cost=4.0),
+           supervision.Rule('manual-bad', 'manual-bad', _manual_bad, label=False, cost=8.0)] +
+          supervision.val_rules('pre-neighbor-match', 'pre-neighbor-match', _pre_neighbor_match, VALS,
+                                enabled=supervision.has_rule_group) +
+          supervision.val_rules('phrases-in-sent', 'phrases-in-sent', _phrases_in_sent, VALS,
+                                cost=4.0, enabled=supervision.has_rule_group) +
+          [supervision.Rule('pubmed-paper-genes-true', 'pubmed-paper-genes-true', _pubmed_paper_genes_true,
+                            label=True, cost=8.0),
+           supervision.Rule('complicated-gene-names-true', 'complicated-gene-names-true',
+                            _complicated_gene_names_true, label=True),
+           supervision.Rule('all-canonical-true', 'all-canonical-true', _all_canonical_true, label=True),
+           supervision.Rule('all-symbols-true', 'all-symbols-true', _all_symbols_true, label=True)] +
+          supervision.val_rules('neighbor-match', 'neighbor-match', _neighbor_match, VALS,
+                                cost=8.0, enabled=supervision.has_rule_group))
+
+util.compile_rule_groups(SR)
+RULES = supervision.RuleSet(mention_rules(SR), SR)
+
+def create_supervised_mention(row, i, gene_name=None, mapping_type=None, mention_supertype=None, mention_subtype=None, sentence=None):
+  """
+  Given a Row object consisting of a sentence, create & supervise a Mention output object;
+  sentence is the util.ParsedSentence of the row, if shared with its other mentions
+  """
   word = row.words[i]
   mid = '%s_%s_%s_%s' % (row.doc_id, row.section_id, row.sent_id, i)
   m = Mention(None, row.doc_id, row.section_id, row.sent_id, [i], mid, mapping_type, mention_supertype, mention_subtype, gene_name, [word], None)
-  dep_dag = deps.DepPathDAG(row.dep_parents, row.dep_paths, row.words)
-
-  phrase = ' '.join(row.words)
-  lemma_phrase = ' '.join(row.lemmas)
-  if SR.get('post-neighbor-match') and i < len(row.words) - 1:
-    opts = SR['post-neighbor-match']
-    post_neighbor = row.words[i+1]
-    for name,val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(post_neighbor, opts[name], opts['%s-rgx' % name], opts[name], opts['%s-rgx' % name], flags=re.I)
-        if match:
-          return m._replace(is_correct=val, mention_supertype='POST_MATCH_%s_%s' % (name, val), mention_subtype=match)
-  
-  if SR.get('bad-genes'):
-    if i > 0:
-      prev_word = row.words[i-1]
-    else:
-      prev_word = ''
-    if i < len(row.words) - 1:
-      next_word = row.words[i+1]
-    else:
-      next_word = ''
-    if next_word != 'gene' and prev_word != 'gene':
-      for bad_gene in SR['bad-genes']:
-        if re.search(bad_gene, gene_name):
-          return m._replace(is_correct=False, mention_supertype='BAD_GENE')
-
-  if SR.get('manual-bad'):
-    detected = detect_manual(gene_name, row.words)
-    if detected is not None:
-      return m._replace(is_correct=False, mention_supertype='MANUAL_BAD', mention_subtype=detected)
-
-  if SR.get('pre-neighbor-match') and i > 0:
-    opts = SR['pre-neighbor-match']
-    pre_neighbor = row.words[i-1]
-    for name,val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(pre_neighbor, opts[name], opts['%s-rgx' % name], 
-                                     opts[name], opts['%s-rgx' % name], flags=re.I)
-        if match:
-          return m._replace(is_correct=val, mention_supertype='PRE_NEIGHBOR_MATCH_%s_%s' % (name, val), mention_subtype=match)
-
-  if SR.get('phrases-in-sent'):
-    opts = SR['phrases-in-sent']
-    for name,val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(phrase + ' ' + lemma_phrase, opts[name], opts['%s-rgx' % name], 
-                                     opts[name], opts['%s-rgx' % name], flags=re.I)
-        if match:
-          # backslashes cause postgres errors in postgres 9
-          return m._replace(is_correct=val, mention_supertype='PHRASE_%s' % name, mention_subtype=match.replace('\\', '/'))
- 
-  ## DS RULE: matches from papers that NCBI annotates as being about the mentioned gene are likely true.
-  if SR['pubmed-paper-genes-true']:
-    pubmed_to_genes = CACHE['pubmed_to_genes']
-    pmid = dutil.get_pubmed_id_for_doc(row.doc_id)
-    if pmid and gene_name:
-      for (mention_ensembl_id, canonical_name, mapping_type) in CACHE['gene_name_to_genes'][gene_name]:
-        if mention_ensembl_id in pubmed_to_genes.get(pmid, {}):
-          return m._replace(is_correct=True, mention_supertype='%s_NCBI_ANNOTATION_TRUE' % mention_supertype, mention_subtype=mention_ensembl_id)
-          break
-
-  ## DS RULE: Genes on the gene list with complicated names are probably good for exact matches.
-  if SR['complicated-gene-names-true']:
-    if m.mapping_type in HF['ensembl-mapping-types']:
-      if re.match(r'[a-zA-Z]{3}[a-zA-Z]*\d+\w*', word):
-        return m._replace(is_correct=True, mention_supertype='COMPLICATED_GENE_NAME')
-
-  if SR['all-canonical-true']:
-    if m.mapping_type == 'CANONICAL_SYMBOL':
-      return m._replace(is_correct=True, mention_supertype='%s_ALL_TRUE' % m.mention_supertype)
-
-  if SR['all-symbols-true']:
-    if m.mapping_type in HF['ensembl-mapping-types']:
-      return m._replace(is_correct=True, mention_supertype='%s_ALL_TRUE' % m.mention_supertype)
-
-  if SR.get('neighbor-match'):
-    opts = SR['neighbor-match']
-    for name,val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        for neighbor_idx in dep_dag.neighbors(i):
-          neighbor = row.words[neighbor_idx]
-          match = util.rgx_mult_search(neighbor, opts[name],  opts['%s-rgx' % name], opts[name],  opts['%s-rgx' % name], flags=re.I)
-          if match:
-            return m._replace(is_correct=val, mention_supertype='NEIGHBOR_MATCH_%s_%s' % (name, val), mention_subtype='Neighbor: ' + neighbor + ', match: ' + match)
-
-  return m
+  if sentence is None:
+    sentence = util.ParsedSentence(row)
+  c = supervision.Candidate(DERIVATIONS, row=row, i=i, word=word, gene_name=gene_name, m=m, sentence=sentence)
+  rv = RULES.evaluate(c)
+  return m if rv is None else rv
 
 def get_negative_mentions(row, mentions, d, per_row_max=2):
-  """Generate random / pseudo-random negative examples, trying to keep set approx. balanced"""
+  """
+  Generate random / pseudo-random negative examples, trying to keep set approx. balanced;
+  d is the current pos - neg imbalance, or None in 'ratio' sampling mode (see sampling.py)
+  """
   negs = []
-  if d < 0:
+  if d is not None and d < 0:
     return negs
   existing_mention_idxs = [m.wordidxs[0] for m in mentions]
-  for i, word in enumerate(row.words):
-    if len(negs) > d or len(negs) > per_row_max:
+  # skip if an existing mention
+  candidates = [(i, word) for i, word in enumerate(row.words) if i not in existing_mention_idxs]
+  if d is None and len(candidates) > per_row_max + 1:
+    # In 'ratio' mode, the per-row max bounds the candidates rather than the negatives kept, so
+    # that the counting pass counts only candidates which may be kept: a random subset of them
+    sent_key = '%s_%s_%s' % (row.doc_id, row.section_id, row.sent_id)
+    candidates = sorted(sampling.rng(sent_key, 'RAND_NEGS').sample(candidates, per_row_max + 1))
+  for i, word in candidates:
+    if d is not None and (len(negs) > d or len(negs) > per_row_max):
       return negs
 
-    # skip if an existing mention
-    if i in existing_mention_idxs:
-      continue
-    
     # Make a template mention object- will have mention_id opt with gene_name appended
     mid = '%s_%s_%d_%s' % (row.doc_id, row.section_id, row.sent_id, i)
     m = Mention(dd_id=None, doc_id=row.doc_id, section_id=row.section_id, sent_id=row.sent_id, wordidxs=[i], mention_id=mid, mapping_type=None, mention_supertype="RANDOM_NEGATIVE",mention_subtype=None, gene_name=None, words=[word], is_correct=None)
 
     # Non-match all uppercase negative supervision
     if word==word.upper() and len(word)>2 and word.isalnum() and not unicode(word).isnumeric():
-      if random.random() < 0.01*d:
+      if SAMPLER.keep(mid, p=0.01*d if d is not None else None, weight=2.0, salt='ALL_UPPER'):
         negs.append(m._replace(mention_supertype='ALL_UPPER_NOT_GENE_SYMBOL', is_correct=False))
 
     # Random negative supervision
-    elif random.random() < 0.005*d:
+    elif SAMPLER.keep(mid, p=0.005*d if d is not None else None, salt='RAND_WORD'):
       negs.append(m._replace(mention_supertype='RAND_WORD_NOT_GENE_SYMBOL', is_correct=False))
   return negs
 
+# generate the mentions, while trying to keep the supervision approx. balanced
+pos_count = 0
+neg_count = 0
+SAMPLER = sampling.NegativeSampler('gene_extract_candidates')
+
+def get_mentions(row):
+  global pos_count
+  global neg_count
+
+  # Skip row if sentence doesn't contain a verb, contains URL, etc.
+  if util.skip_row(row):
+    return []
+
+  # Find candidate mentions & supervise
+  mentions = extract_candidate_mentions(row)
+
+  pos_count += len([m for m in mentions if m.is_correct])
+  neg_count += len([m for m in mentions if m.is_correct is False])
+  for m in mentions:
+    SAMPLER.count(m.is_correct)
+
+  # add negative supervision
+  if SR['rand-negs'] and SAMPLER.mode == 'ratio':
+    mentions += get_negative_mentions(row, mentions, None)
+  elif pos_count > neg_count and SR['rand-negs']:
+    negs = get_negative_mentions(row, mentions, pos_count - neg_count)
+    neg_count += len(negs)
+    mentions += negs
+  return mentions
+
 
 if __name__ == '__main__':
   # load static data
   CACHE['gene_name_to_genes'] = dutil.gene_symbol_to_ensembl_id_map()
+  CACHE['mapping_types'] = candidate_mapping_types(CACHE['gene_name_to_genes'])
   CACHE['pubmed_to_genes'] = read_pubmed_to_genes()
   # unnecessary currently b/c our doc id is the pmid, thankfully
   # CACHE['doi_to_pmid'] = dutil.read_doi_to_pmid()
   
-  # generate the mentions, while trying to keep the supervision approx. balanced
-  # print out right away so we don't bloat memory...
-  pos_count = 0
-  neg_count = 0
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-
-    # Skip row if sentence doesn't contain a verb, contains URL, etc.
-    if util.skip_row(row):
-      continue
-
-    # Find candidate mentions & supervise
-    mentions = extract_candidate_mentions(row)
-
-    pos_count += len([m for m in mentions if m.is_correct])
-    neg_count += len([m for m in mentions if m.is_correct is False])
-
-    # add negative supervision
-    if pos_count > neg_count and SR['rand-negs']:
-      negs = get_negative_mentions(row, mentions, pos_count - neg_count)
-      neg_count += len(negs)
-      mentions += negs
-
-    # print output
-    for mention in mentions:
-      util.print_tsv_output(mention)
+  # output is streamed out in blocks so we don't bloat memory...
+  # with workers, supervision is balanced per chunk (see util.run_main_tsv)
+  SAMPLER.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_mentions,
+                       counters=[util.ModuleCounters(sys.modules[__name__], ['pos_count', 'neg_count'],
+                                                     balancing=SAMPLER.balancing()),
+                                 SAMPLER.counters()],
+                       chunk_balancing=True)
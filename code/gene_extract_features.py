@@ -2,6 +2,7 @@
 from collections import namedtuple
 import extractor_util as util
 import ddlib
+import config
 import re
 
 # This defines the Row object that we read in to the extractor
@@ -53,4 +54,4 @@ def get_features_for_row(row):
   return features
 
 if __name__ == '__main__':
-  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_row)
+  util.run_features_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_row, opts=config.FEATURES)
@@ -27,7 +27,35 @@ parser = util.RowParser([
           ('pheno_mention_id', 'text'),
           ('pheno_entity', 'text'),
           ('pheno_wordidxs', 'int[]'),
-          ('pheno_is_correct', 'boolean')])
+          ('pheno_is_correct', 'boolean')], lazy=True)
+
+# In per-sentence input mode, there is one row per sentence with arrays of the gene and
+# pheno mentions in it, and candidates are all of their pairs
+sentence_parser = util.RowParser([
+          ('doc_id', 'text'),
+          ('section_id', 'text'),
+          ('sent_id', 'int'),
+          ('words', 'text[]'),
+          ('lemmas', 'text[]'),
+          ('poses', 'text[]'),
+          ('dep_paths', 'text[]'),
+          ('dep_parents', 'int[]'),
+          ('gene_mention_ids', 'text[]'),
+          ('gene_names', 'text[]'),
+          ('gene_wordidxs', 'int[][]'),
+          ('gene_is_corrects', 'boolean[]'),
+          ('pheno_mention_ids', 'text[]'),
+          ('pheno_entities', 'text[]'),
+          ('pheno_wordidxs', 'int[][]'),
+          ('pheno_is_corrects', 'boolean[]')], lazy=True)
+
+SENTENCE_COLUMNS = ['doc_id', 'section_id', 'sent_id', 'words', 'lemmas', 'poses', 'dep_paths', 'dep_parents']
+GENE_COLUMNS = [('gene_mention_id', 'gene_mention_ids'), ('gene_name', 'gene_names'),
+                ('gene_wordidxs', 'gene_wordidxs'), ('gene_is_correct', 'gene_is_corrects')]
+PHENO_COLUMNS = [('pheno_mention_id', 'pheno_mention_ids'), ('pheno_entity', 'pheno_entities'),
+                 ('pheno_wordidxs', 'pheno_wordidxs'), ('pheno_is_correct', 'pheno_is_corrects')]
+
+SENTENCES = util.SentenceCache()
 
 
 # This defines the output Relation object
@@ -58,8 +86,8 @@ def extract_candidate_relations(row):
 
   relations = []
 
-  # Create a dependencies DAG for the sentence
-  dep_dag = deps.DepPathDAG(row.dep_parents, row.dep_paths, row.words, max_path_len=HF['max-dep-path-dist'])
+  # Get the dependencies DAG for the sentence
+  dep_dag = SENTENCES.get(row).dep_dag(HF['max-dep-path-dist'])
 
   # Go through the G-P pairs in the sentence, which are passed in serialized format
   pairs = []
@@ -82,13 +110,15 @@ def extract_candidate_relations(row):
 
   return [r]
 
+def extract_sentence_candidate_relations(row):
+  """Extract the candidate relations among all G-P pairs of a per-sentence input row"""
+  relations = []
+  for pair_row in util.expand_sentence_row(row, parser.row_class, SENTENCE_COLUMNS, [GENE_COLUMNS, PHENO_COLUMNS]):
+    relations.extend(extract_candidate_relations(pair_row))
+  return relations
+
 if __name__ == '__main__':
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-    
-    # find candidate mentions
-    relations = extract_candidate_relations(row)
-
-    # print output
-    for relation in relations:
-      util.print_tsv_output(relation)
+  if util.per_sentence_input():
+    util.run_main_tsv(row_parser=sentence_parser.parse_tsv_row, row_fn=extract_sentence_candidate_relations)
+  else:
+    util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=extract_candidate_relations)
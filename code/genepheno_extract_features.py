@@ -21,7 +21,31 @@ parser = util.RowParser([
           ('poses', 'text[]'),
           ('ners', 'text[]'),
           ('dep_paths', 'text[]'),
-          ('dep_parents', 'int[]')])
+          ('dep_parents', 'int[]')], lazy=True)
+
+# In per-sentence input mode, there is one row per sentence with arrays of its relations
+sentence_parser = util.RowParser([
+          ('doc_id', 'text'),
+          ('section_id', 'text'),
+          ('sent_id', 'int'),
+          ('words', 'text[]'),
+          ('lemmas', 'text[]'),
+          ('poses', 'text[]'),
+          ('ners', 'text[]'),
+          ('dep_paths', 'text[]'),
+          ('dep_parents', 'int[]'),
+          ('relation_ids', 'text[]'),
+          ('gene_mention_ids', 'text[]'),
+          ('gene_wordidxs', 'int[][]'),
+          ('pheno_mention_ids', 'text[]'),
+          ('pheno_wordidxs', 'int[][]')], lazy=True)
+
+SENTENCE_COLUMNS = ['doc_id', 'section_id', 'sent_id', 'words', 'lemmas', 'poses', 'ners', 'dep_paths', 'dep_parents']
+RELATION_COLUMNS = [('relation_id', 'relation_ids'),
+                    ('gene_mention_id', 'gene_mention_ids'), ('gene_wordidxs', 'gene_wordidxs'),
+                    ('pheno_mention_id', 'pheno_mention_ids'), ('pheno_wordidxs', 'pheno_wordidxs')]
+
+SENTENCES = util.SentenceCache()
 
 fr = config.GENE_PHENO['F']
 
@@ -45,6 +69,11 @@ for f in bad_features:
   inv_bad_features.append('INV_' + f)
 bad_features.extend(inv_bad_features)
 
+# All bad feature patterns as one (re.match-anchored) alternation; generic feature families
+# which are filtered out entirely are not even generated by ddlib
+BAD_FEATURES_RGX = re.compile('(?:%s)' % '|'.join(bad_features))
+SKIPPED_FAMILIES = ddlib.filtered_families(bad_features)
+
 def create_ners_between(gene_wordidxs, pheno_wordidxs, ners):
   if gene_wordidxs[0] < pheno_wordidxs[0]:
     start = max(gene_wordidxs) + 1
@@ -64,13 +93,8 @@ def create_ners_between(gene_wordidxs, pheno_wordidxs, ners):
 non_alnum = re.compile('[\W_]+')
 
 def take_feature(feat):
-  take = True
-  for bad_feature_pattern in bad_features:
-    # warning, match matches only from start of string
-    if re.match(bad_feature_pattern, feat):
-      take = False
-      break
-  return take
+  # warning, match matches only from start of string
+  return BAD_FEATURES_RGX.match(feat) is None
 
 def get_sublists(lst, min_len):
   for length in xrange(min_len, len(lst)):
@@ -121,9 +145,9 @@ def get_cross_features_in(row, wordidxs1, wordidxs2, prefix):
       for sublist2 in get_sublists(lemmas2, 1):
         yield prefix + 'LEMMA_[' + '_'.join(sublist1) + ']_[' + '_'.join(sublist2) + ']'
 
-def get_custom_features(row, dds):
-  phrase = ' '.join(row.words)
-  lemma_phrase = ' '.join(row.lemmas)
+def get_custom_features(row, sentence):
+  phrase = sentence.phrase
+  lemma_phrase = sentence.lemma_phrase
   global_sentence_patterns = fr['global-sent-words']
   for p in global_sentence_patterns:
     if re.findall(p, phrase) or re.findall(p, lemma_phrase):
@@ -140,15 +164,16 @@ def get_features_for_candidate(row):
   """Extract features for candidate mention- both generic ones from ddlib & custom features"""
   features = []
   f = Feature(doc_id=row.doc_id, section_id=row.section_id, relation_id=row.relation_id, name=None)
-  dds = util.create_ddlib_sentence(row)
+  sentence = SENTENCES.get(row)
+  dds = sentence.ddlib_sentence()
 
   # (1) GENERIC FEATURES from ddlib
   gene_span = ddlib.Span(begin_word_id=row.gene_wordidxs[0], length=len(row.gene_wordidxs))
   pheno_span = ddlib.Span(begin_word_id=row.pheno_wordidxs[0], length=len(row.pheno_wordidxs))
-  for feat in ddlib.get_generic_features_relation(dds, gene_span, pheno_span):
+  for feat in ddlib.get_generic_features_relation(dds, gene_span, pheno_span, skip=SKIPPED_FAMILIES):
     if take_feature(feat):
       features.append(f._replace(name=feat))
-  features.extend([f._replace(name=feat) for feat in get_custom_features(row, dds)])
+  features.extend([f._replace(name=feat) for feat in get_custom_features(row, sentence)])
   # these seem to be hurting (?)
   # start_span = ddlib.Span(begin_word_id=0, length=4)
   # for feat in ddlib.get_generic_features_mention(dds, start_span, length_bin_size=2):
@@ -157,9 +182,19 @@ def get_features_for_candidate(row):
   # features += [f._replace(name=feat) for feat in create_ners_between(row.gene_wordidxs, row.pheno_wordidxs, row.ners)]
   return features
 
+def get_features_for_sentence(row):
+  """Extract features for all candidates of a per-sentence input row"""
+  features = []
+  for pair_row in util.expand_sentence_row(row, parser.row_class, SENTENCE_COLUMNS, [RELATION_COLUMNS]):
+    features.extend(get_features_for_candidate(pair_row))
+  return features
+
 # Helper for loading in manually defined keywords
 onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
 
 if __name__ == '__main__':
   ddlib.load_dictionary_map(fr['synonyms'])
-  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_candidate)
+  if util.per_sentence_input():
+    util.run_features_tsv(row_parser=sentence_parser.parse_tsv_row, row_fn=get_features_for_sentence, opts=config.FEATURES)
+  else:
+    util.run_features_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_candidate, opts=config.FEATURES)
@@ -28,23 +28,14 @@ parser = util.RowParser([
             ('poses', 'text[]'),
             ('ners', 'text[]'),
             ('dep_paths', 'text[]'),
-            ('dep_parents', 'int[]')])
+            ('dep_parents', 'int[]')], lazy=True)
 
 # This defines the output Relation object
 Feature = collections.namedtuple('Feature', ['doc_id', 'section_id', 'relation_id', 'name'])
 
 HPO_DAG = dutil.read_hpo_dag()
 
-def replace_opts(opts, replaceList):
-  ret = {}
-  for name in opts:
-    strings = opts[name]
-    for (pattern, subst) in replaceList:
-      if name.endswith('rgx'):
-        subst = re.escape(subst)
-      strings = [s.replace(pattern, subst) for s in strings]
-    ret[name] = strings
-  return ret
+SENTENCES = util.SentenceCache()
 
 CACHE = {}
 
@@ -68,33 +59,28 @@ def gp_between(gene_wordidxs, pheno_wordidxs, ners):
 def config_supervise(r, row, pheno_entity, gene_name, gene, pheno, 
               phrase, between_phrase, lemma_phrase, between_phrase_lemmas, 
               dep_dag, dep_path_between, gene_wordidxs, VALS, SR):
+  bindings = {'G' : gene, 'P' : pheno}
   if SR.get('phrases-in-between'):
     opts = SR['phrases-in-between']
-    orig_opts = opts.copy()
-    opts = replace_opts(opts, [('{{G}}', gene), ('{{P}}', pheno)])
     for name, val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(between_phrase, opts[name], opts['%s-rgx' % name], orig_opts[name], 
-                                     orig_opts['%s-rgx' % name], flags=re.I)
+      rules = util.rule_group(opts, name, config.GP_TEMPLATE_PARAMS)
+      if len(rules) > 0:
+        match = rules.search(between_phrase, bindings)
         if match:
           yield r._replace(name='PHRASE_BETWEEN_%s_%s' % (name, non_alnum.sub('_', match)))
-        match = util.rgx_mult_search(between_phrase_lemmas, opts[name], opts['%s-rgx' % name], 
-                                     orig_opts[name], orig_opts['%s-rgx' % name], flags=re.I)
+        match = rules.search(between_phrase_lemmas, bindings)
         if match:
           yield r._replace(name='PHRASE_BETWEEN_%s_%s' % (name, non_alnum.sub('_', match)))
 
   if SR.get('phrases-in-sent'):
     opts = SR['phrases-in-sent']
-    orig_opts = opts.copy()
-    opts = replace_opts(opts, [('{{G}}', gene), ('{{P}}', pheno)])
     for name, val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(phrase, opts[name], opts['%s-rgx' % name], orig_opts[name], 
-                                     orig_opts['%s-rgx' % name], flags=re.I)
+      rules = util.rule_group(opts, name, config.GP_TEMPLATE_PARAMS)
+      if len(rules) > 0:
+        match = rules.search(phrase, bindings)
         if match:
           yield r._replace(name='PHRASE_%s_%s' % (name, non_alnum.sub('_', match)))
-        match = util.rgx_mult_search(lemma_phrase, opts[name], opts['%s-rgx' % name], orig_opts[name], 
-                                     orig_opts['%s-rgx' % name], flags=re.I)
+        match = rules.search(lemma_phrase, bindings)
         if match:
           yield r._replace(name='PHRASE_%s_%s' % (name, non_alnum.sub('_', match)))
 
@@ -149,15 +135,16 @@ def create_supervised_relation(row, SR, HF):
   gene = row.gene_name
   pheno = ' '.join([row.words[i] for i in row.pheno_wordidxs])
 
-  phrase = ' '.join(row.words)
-  lemma_phrase = ' '.join(row.lemmas)
+  sentence = SENTENCES.get(row)
+  phrase = sentence.phrase
+  lemma_phrase = sentence.lemma_phrase
   b = sorted([gene_wordidxs[0], gene_wordidxs[-1], pheno_wordidxs[0], pheno_wordidxs[-1]])[1:-1]
   assert b[0] + 1 < len(row.words), str((b[0] + 1, len(row.words), row.doc_id, row.section_id, row.sent_id, str(row.words)))
   assert b[1] < len(row.words), str((b[1], len(row.words), row.doc_id, row.section_id, row.sent_id, str(row.words)))
   between_phrase = ' '.join(row.words[i] for i in range(b[0] + 1, b[1]))
   between_phrase_lemmas = ' '.join(row.lemmas[i] for i in range(b[0] + 1, b[1]))
 
-  dep_dag = deps.DepPathDAG(row.dep_parents, row.dep_paths, row.words, max_path_len=HF['max-dep-path-dist'])
+  dep_dag = sentence.dep_dag(HF['max-dep-path-dist'])
   
   r = Feature(row.doc_id, row.section_id, row.relation_id, None)
   path_len_sets = dep_dag.path_len_sets(gene_wordidxs, pheno_wordidxs)
@@ -195,10 +182,10 @@ def create_supervised_relation(row, SR, HF):
     yield rv
 
 def featurize(supervision_rules, hard_filters):
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-    for rv in create_supervised_relation(row, SR=supervision_rules, HF=hard_filters):
-      util.print_tsv_output(rv)
+  util.compile_rule_groups(supervision_rules, params=config.GP_TEMPLATE_PARAMS)
+  util.run_features_tsv(row_parser=parser.parse_tsv_row,
+                        row_fn=lambda row : create_supervised_relation(row, SR=supervision_rules, HF=hard_filters),
+                        opts=config.FEATURES)
 
 if __name__ == '__main__':
   sr = config.GENE_PHENO_CAUSATION['SR']
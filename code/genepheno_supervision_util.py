@@ -1,8 +1,9 @@
 import collections
+import config
 import extractor_util as util
 import data_util as dutil
-import dep_util as deps
-import random
+import sampling
+import supervision_util as supervision
 import re
 import sys
 
@@ -26,7 +27,37 @@ parser = util.RowParser([
             ('poses', 'text[]'),
             ('ners', 'text[]'),
             ('dep_paths', 'text[]'),
-            ('dep_parents', 'int[]')])
+            ('dep_parents', 'int[]')], lazy=True)
+
+# In per-sentence input mode, there is one row per sentence with arrays of its relations
+sentence_parser = util.RowParser([
+            ('doc_id', 'text'),
+            ('section_id', 'text'),
+            ('sent_id', 'int'),
+            ('words', 'text[]'),
+            ('lemmas', 'text[]'),
+            ('poses', 'text[]'),
+            ('ners', 'text[]'),
+            ('dep_paths', 'text[]'),
+            ('dep_parents', 'int[]'),
+            ('relation_ids', 'text[]'),
+            ('gene_mention_ids', 'text[]'),
+            ('gene_names', 'text[]'),
+            ('gene_wordidxs', 'int[][]'),
+            ('gene_is_corrects', 'boolean[]'),
+            ('pheno_mention_ids', 'text[]'),
+            ('pheno_entities', 'text[]'),
+            ('pheno_wordidxs', 'int[][]'),
+            ('pheno_is_corrects', 'boolean[]')], lazy=True)
+
+SENTENCE_COLUMNS = ['doc_id', 'section_id', 'sent_id', 'words', 'lemmas', 'poses', 'ners', 'dep_paths', 'dep_parents']
+RELATION_COLUMNS = [('relation_id', 'relation_ids'),
+                    ('gene_mention_id', 'gene_mention_ids'), ('gene_name', 'gene_names'),
+                    ('gene_wordidxs', 'gene_wordidxs'), ('gene_is_correct', 'gene_is_corrects'),
+                    ('pheno_mention_id', 'pheno_mention_ids'), ('pheno_entity', 'pheno_entities'),
+                    ('pheno_wordidxs', 'pheno_wordidxs'), ('pheno_is_correct', 'pheno_is_corrects')]
+
+SENTENCES = util.SentenceCache()
 
 # This defines the output Relation object
 Relation = collections.namedtuple('Relation', [
@@ -47,36 +78,22 @@ Relation = collections.namedtuple('Relation', [
 
 HPO_DAG = dutil.read_hpo_dag()
 
-def replace_opts(opts, replaceList):
-  ret = {}
-  for name in opts:
-    strings = opts[name]
-    for (pattern, subst) in replaceList:
-      if name.endswith('rgx'):
-        subst = re.escape(subst)
-      strings = [s.replace(pattern, subst) for s in strings]
-    ret[name] = strings
-  return ret
-
-def read_supervision():
-  """Reads genepheno supervision data (from charite)."""
-  supervision_pairs = set()
-  with open('%s/onto/manual/charite_supervision.tsv' % util.APP_HOME) as f:
+def read_supervision(expand='parents'):
+  """
+  Reads genepheno supervision data (from charite), as a dutil.GenePhenoIndex of its (hpo id,
+  gene name) pairs expanded up the HPO DAG (see config.GENE_PHENO['SR']['charite-expand'])
+  """
+  def pairs(f):
     for line in f:
       hpo_id, gene_name = line.strip().split('\t')
-      if hpo_id in HPO_DAG.edges:
-        hpo_ids = [hpo_id] + [parent for parent in HPO_DAG.edges[hpo_id]]
-      else:
-        hpo_ids = [hpo_id]
-      for h in hpo_ids:
-        supervision_pairs.add((h, gene_name))
-  return supervision_pairs
-
-# count_g_or_p_false_none = 0
-# count_adjacent_false_none = 0
+      yield hpo_id, gene_name
+  with open('%s/onto/manual/charite_supervision.tsv' % util.APP_HOME) as f:
+    return dutil.GenePhenoIndex(pairs(f), HPO_DAG, expand)
 
 CACHE = {}
 
+non_alnum = re.compile('[\W_]+')
+
 def gp_between(gene_wordidxs, pheno_wordidxs, ners):
   if gene_wordidxs[0] < pheno_wordidxs[0]:
     start = max(gene_wordidxs) + 1
@@ -97,220 +114,217 @@ def gp_between(gene_wordidxs, pheno_wordidxs, ners):
 charite_pos = 0
 between_neg = 0
 
-def config_supervise(r, row, pheno_entity, gene_name, gene, pheno, 
-              phrase, between_phrase, \
-              lemma_phrase, between_phrase_lemmas, dep_dag, \
-              dep_path_between, gene_wordidxs, 
-              charite_pairs, charite_allowed, VALS, SR):
+### DERIVED VALUES ###
+# Computed on first use by a rule, and shared by all of the rules of a relation (see
+# supervision_util.Candidate); the sentence values are shared by all of its relations
+
+def _between(c):
+  """The positions of the inner ends of the gene & pheno mentions"""
+  row = c.row
+  b = sorted([row.gene_wordidxs[0], row.gene_wordidxs[-1], row.pheno_wordidxs[0], row.pheno_wordidxs[-1]])[1:-1]
+  assert b[0] + 1 < len(row.words), str((b[0] + 1, len(row.words), row.doc_id, row.section_id, row.sent_id, str(row.words)))
+  assert b[1] < len(row.words), str((b[1], len(row.words), row.doc_id, row.section_id, row.sent_id, str(row.words)))
+  return b
+
+DERIVATIONS = {
+  'pheno' : lambda c: ' '.join([c.row.words[i] for i in c.row.pheno_wordidxs]),
+  'bindings' : lambda c: {'G' : c.row.gene_name, 'P' : c.pheno},
+  'phrase' : lambda c: c.sentence.phrase,
+  'lemma_phrase' : lambda c: c.sentence.lemma_phrase,
+  'sent_phrases' : lambda c: c.phrase + ' ' + c.lemma_phrase,
+  'between' : _between,
+  'between_phrase' : lambda c: ' '.join(c.row.words[i] for i in xrange(c.between[0] + 1, c.between[1])),
+  'between_phrase_lemmas' : lambda c: ' '.join(c.row.lemmas[i] for i in xrange(c.between[0] + 1, c.between[1])),
+  'dep_dag' : lambda c: c.sentence.dep_dag(c.max_path_len),
+  'path_len_sets' : lambda c: c.dep_dag.path_len_sets(c.row.gene_wordidxs, c.row.pheno_wordidxs),
+  'dep_path_between' : lambda c: frozenset(c.dep_dag.min_path_sets(c.row.gene_wordidxs, c.row.pheno_wordidxs)),
+  'verbs_between' : lambda c: [i for i in c.dep_path_between if c.row.poses[i].startswith("VB")],
+  'lemma_positions' : lambda c: supervision.position_index(c.row.lemmas),
+  'dep_path_positions' : lambda c: supervision.position_index(c.row.dep_paths),
+  'gp_between' : lambda c: gp_between(c.row.gene_wordidxs, c.row.pheno_wordidxs, c.row.ners)}
+
+### DISTANT SUPERVISION RULES ###
+# NOTE: see config.py for all documentation & values
+
+def _bad_dep_paths(c, opts):
+  if not c.path_len_sets:
+    return c.r._replace(is_correct=False, relation_supertype='BAD_OR_NO_DEP_PATH')
+
+def _no_dep_path(c, opts):
+  if not c.path_len_sets:
+    return supervision.DROP
+
+def _g_or_p_false(c, opts):
+  # The following line looks like it was written by a prosimian, but it is actually correct.
+  # Do not mess with the logic unless you know what you're doing.
+  # (Consider that Boolean variables can and will take the value ``None'' in this language.)
+  """The above comment might be necessary for a Eukaryota, otherwise hopefully the below is self-explanatory"""
+  gene_is_correct = c.row.gene_is_correct
+  pheno_is_correct = c.row.pheno_is_correct
+  if gene_is_correct == False or pheno_is_correct == False:
+    if SAMPLER.keep(c.r.relation_id, p=sampling.p_any(opts['diff'] * c.superv_diff, opts['rand']),
+                    salt='g-or-p-false'):
+      return c.r._replace(is_correct=False, relation_supertype='G_ANDOR_P_FALSE', relation_subtype='gene_is_correct: %s, pheno_is_correct: %s' % (gene_is_correct, pheno_is_correct))
+    return supervision.DROP
+
+def _adjacent_false(c, opts):
+  if re.search(r'[a-z]{3,}', c.between_phrase, flags=re.I) is None:
+    if SAMPLER.keep(c.r.relation_id, p=sampling.p_any(0.5 * c.superv_diff, 0.01), salt='adjacent-false'):
+      st = non_alnum.sub('_', c.between_phrase)
+      return c.r._replace(is_correct=False, relation_supertype='G_P_ADJACENT', relation_subtype=st)
+    return supervision.DROP
+
+def _phrases_in_between(c, opts, name, val):
+  rules = util.rule_group(opts, name, config.GP_TEMPLATE_PARAMS)
+  match = rules.search(c.between_phrase, c.bindings) or rules.search(c.between_phrase_lemmas, c.bindings)
+  if match:
+    return c.r._replace(is_correct=val, relation_supertype='PHRASE_BETWEEN_%s' % name, relation_subtype=non_alnum.sub('_', match))
+
+def _phrases_in_sent(c, opts, name, val):
+  rules = util.rule_group(opts, name, config.GP_TEMPLATE_PARAMS)
+  match = rules.search(c.phrase, c.bindings) or rules.search(c.lemma_phrase, c.bindings)
+  if match:
+    return c.r._replace(is_correct=val, relation_supertype='PHRASE_%s' % name, relation_subtype=non_alnum.sub('_', match))
+
+def _primary_verb_modifiers(c, opts, name, val):
+  if c.dep_path_between and c.verbs_between:
+    mod_words = supervision.positions(c.lemma_positions, opts[name])
+    mod_words += supervision.positions(c.dep_path_positions, opts['%s-dep-tag' % name])
+    d = c.dep_dag.path_len_sets(c.verbs_between, mod_words)
+    if d and d < opts['max-dist'] + 1:
+      subtype = 'ModWords: ' + ' '.join([str(m) for m in mod_words]) + ', VerbsBetween: ' + ' '.join([str(m) for m in c.verbs_between]) + ', d: ' + str(d)
+      return c.r._replace(is_correct=val, relation_supertype='PRIMARY_VB_MOD_%s' % name, relation_subtype=non_alnum.sub('_', subtype))
+
+def _dep_lemma_connectors(c, opts, name, val):
+  if c.dep_path_between:
+    connectors = [i for i in supervision.positions(c.lemma_positions, opts[name]) if i in c.dep_path_between]
+    if len(connectors) > 0:
+      return c.r._replace(is_correct=val, relation_supertype='DEP_LEMMA_CONNECT_%s' % name,
+                          relation_subtype=non_alnum.sub('_', ' '.join([str(x) for x in connectors])))
+
+def _dep_lemma_neighbors(c, opts, name, val):
+  for entity in ['g', 'p']:
+    lemmas = supervision.positions(c.lemma_positions, opts['%s-%s' % (name, entity)])
+    d = c.dep_dag.path_len_sets(c.row.gene_wordidxs, lemmas)
+    if d and d < opts['max-dist'] + 1:
+      subtype = ' '.join([str(l) for l in lemmas]) + ', d: ' + str(d)
+      return c.r._replace(is_correct=val, relation_supertype='DEP_LEMMA_NB_%s_%s' % (name, entity),
+                          relation_subtype=non_alnum.sub('_', subtype))
+
+def _neg_gp_between(c, opts):
+  if c.gp_between:
+    return c.r._replace(is_correct=False, relation_supertype='NEG_GP_BETWEEN')
+
+def _charite_all_pos_words(c, opts, rules, charite_pairs):
   global charite_pos
-  global between_neg
-  if SR.get('phrases-in-between'):
-    opts = SR['phrases-in-between']
-    orig_opts = opts.copy()
-    opts = replace_opts(opts, [('{{G}}', gene), ('{{P}}', pheno)])
-    for name, val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(between_phrase, opts[name], opts['%s-rgx' % name], orig_opts[name], 
-                                     orig_opts['%s-rgx' % name], flags=re.I)
-        if match:
-          return r._replace(is_correct=val, relation_supertype='PHRASE_BETWEEN_%s' % name, relation_subtype=non_alnum.sub('_', match))
-        match = util.rgx_mult_search(between_phrase_lemmas, opts[name], opts['%s-rgx' % name], orig_opts[name], 
-                                     orig_opts['%s-rgx' % name], flags=re.I)
-        if match:
-          return r._replace(is_correct=val, relation_supertype='PHRASE_BETWEEN_%s' % name, relation_subtype=non_alnum.sub('_', match))
-
-  if SR.get('phrases-in-sent'):
-    opts = SR['phrases-in-sent']
-    orig_opts = opts.copy()
-    opts = replace_opts(opts, [('{{G}}', gene), ('{{P}}', pheno)])
-    for name, val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(phrase, opts[name], opts['%s-rgx' % name], orig_opts[name], 
-                                     orig_opts['%s-rgx' % name], flags=re.I)
-        if match:
-          return r._replace(is_correct=val, relation_supertype='PHRASE_%s' % name, relation_subtype=non_alnum.sub('_', match))
-        match = util.rgx_mult_search(lemma_phrase, opts[name], opts['%s-rgx' % name], orig_opts[name], 
-                                     orig_opts['%s-rgx' % name], flags=re.I)
-        if match:
-          return r._replace(is_correct=val, relation_supertype='PHRASE_%s' % name, relation_subtype=non_alnum.sub('_', match))
-
-  if SR.get('primary-verb-modifiers') and dep_dag:
-    opts = SR['primary-verb-modifiers']
-    if dep_path_between:
-      verbs_between = [i for i in dep_path_between if row.poses[i].startswith("VB")]
-      if len(verbs_between) > 0:
-        for name, val in VALS:
-          mod_words = [i for i, x in enumerate(row.lemmas) if x in opts[name]]
-          mod_words += [i for i, x in enumerate(row.dep_paths) if x in opts['%s-dep-tag' % name]]
-          d = dep_dag.path_len_sets(verbs_between, mod_words)
-          if d and d < opts['max-dist'] + 1:
-            subtype = 'ModWords: ' + ' '.join([str(m) for m in mod_words]) + ', VerbsBetween: ' + ' '.join([str(m) for m in verbs_between]) + ', d: ' + str(d)
-            return r._replace(is_correct=val, relation_supertype='PRIMARY_VB_MOD_%s' % name, relation_subtype=non_alnum.sub('_', subtype))
-
-  if SR.get('dep-lemma-connectors') and dep_dag:
-    opts = SR['dep-lemma-connectors']
-    for name, val in VALS:
-      if dep_path_between:
-        connectors = [i for i, x in enumerate(row.lemmas) \
-                      if i in dep_path_between and x in opts[name]]
-        if len(connectors) > 0:
-          return r._replace(is_correct=val, 
-                            relation_supertype='DEP_LEMMA_CONNECT_%s' % name, 
-                            relation_subtype=non_alnum.sub('_', 
-                                  ' '.join([str(x) for x in connectors])))
-
-  if SR.get('dep-lemma-neighbors') and dep_dag:
-    opts = SR['dep-lemma-neighbors']
-    for name, val in VALS:
-      for entity in ['g', 'p']:
-        lemmas = [i for i, x in enumerate(row.lemmas) if x in opts['%s-%s' % (name, entity)]]
-        d = dep_dag.path_len_sets(gene_wordidxs, lemmas)
-        if d and d < opts['max-dist'] + 1:
-          subtype = ' '.join([str(l) for l in lemmas]) + ', d: ' + str(d)
-          return r._replace(is_correct=val, 
-                            relation_supertype='DEP_LEMMA_NB_%s_%s' % (name, entity), 
-                            relation_subtype=non_alnum.sub('_', subtype))
-  
-  if ('neg', False) in VALS:
-    if gp_between(row.gene_wordidxs, row.pheno_wordidxs, row.ners):
-      return r._replace(is_correct=False, relation_supertype='NEG_GP_BETWEEN')
-  
-  if charite_allowed:
-    if SR.get('charite-all-pos-words'):
-      opts = SR['charite-all-pos-words']
-      match = util.rgx_mult_search(phrase + ' ' + 
-                                   lemma_phrase, [], 
-                                   opts, [], opts, flags=re.I)
-      if match and (pheno_entity, gene_name) in charite_pairs:
-        if not gp_between(row.gene_wordidxs, row.pheno_wordidxs, row.ners):
-          charite_pos += 1
-          return r._replace(is_correct=True, relation_supertype='CHARITE_SUP_WORDS', 
+  match = rules.search(c.sent_phrases)
+  if match and (c.row.pheno_entity, c.row.gene_name) in charite_pairs:
+    if not c.gp_between:
+      charite_pos += 1
+      return c.r._replace(is_correct=True, relation_supertype='CHARITE_SUP_WORDS',
                           relation_subtype=non_alnum.sub('_', match))
-        else:
-          return r._replace(is_correct=False, relation_supertype='CHARITE_NEG_GP_BETWEEN', 
+    else:
+      return c.r._replace(is_correct=False, relation_supertype='CHARITE_NEG_GP_BETWEEN',
                           relation_subtype=non_alnum.sub('_', match))
-  
-  return None
 
-non_alnum = re.compile('[\W_]+')
-def create_supervised_relation(row, superv_diff, SR, HF, charite_pairs, charite_allowed):
+def _has_gp_rules(opts, name):
+  return len(util.rule_group(opts, name, config.GP_TEMPLATE_PARAMS)) > 0
+
+def _phrase_rules(vals):
+  """The rules on the phrases & dependency path of a relation, for values vals"""
+  return (supervision.val_rules('phrases-in-between', 'phrases-in-between', _phrases_in_between, vals,
+                                cost=2.0, enabled=_has_gp_rules) +
+          supervision.val_rules('phrases-in-sent', 'phrases-in-sent', _phrases_in_sent, vals,
+                                cost=4.0, enabled=_has_gp_rules) +
+          supervision.val_rules('primary-verb-modifiers', 'primary-verb-modifiers', _primary_verb_modifiers, vals,
+                                cost=8.0, enabled=lambda opts, name: opts[name] or opts['%s-dep-tag' % name]) +
+          supervision.val_rules('dep-lemma-connectors', 'dep-lemma-connectors', _dep_lemma_connectors, vals,
+                                cost=4.0, enabled=lambda opts, name: opts[name]) +
+          supervision.val_rules('dep-lemma-neighbors', 'dep-lemma-neighbors', _dep_lemma_neighbors, vals,
+                                cost=8.0, enabled=lambda opts, name: opts['%s-g' % name] or opts['%s-p' % name]))
+
+def relation_rules(SR, charite_pairs, charite_allowed):
   """
-  Given a Row object with a sentence and several gene and pheno objects, create and 
-  supervise a Relation output object for the ith gene and jth pheno objects
-  Note: outputs a list for convenience
-  Also includes an input for d = pos - neg supervision count, for neg supervision
+  The gene-pheno supervision rules, in order: relations without a dependency path, false
+  genes or phenos & adjacent mentions first, then the negative rules, the Charite rule, and
+  the positive rules
   """
-  gene_mention_id = row.gene_mention_id
-  gene_name = row.gene_name
-  gene_wordidxs = row.gene_wordidxs
-  gene_is_correct = row.gene_is_correct
-  pheno_mention_id = row.pheno_mention_id
-  pheno_entity = row.pheno_entity
-  pheno_wordidxs = row.pheno_wordidxs
-  pheno_is_correct = row.pheno_is_correct
-  gene = row.gene_name
-  pheno = ' '.join([row.words[i] for i in row.pheno_wordidxs])
-  sv_synonyms = SR['sv_synonyms']
-
-  phrase = ' '.join(row.words)
-  lemma_phrase = ' '.join(row.lemmas)
-  b = sorted([gene_wordidxs[0], gene_wordidxs[-1], pheno_wordidxs[0], pheno_wordidxs[-1]])[1:-1]
-  assert b[0] + 1 < len(row.words), str((b[0] + 1, len(row.words), row.doc_id, row.section_id, row.sent_id, str(row.words)))
-  assert b[1] < len(row.words), str((b[1], len(row.words), row.doc_id, row.section_id, row.sent_id, str(row.words)))
-  between_phrase = ' '.join(row.words[i] for i in range(b[0] + 1, b[1]))
-  between_phrase_lemmas = ' '.join(row.lemmas[i] for i in range(b[0] + 1, b[1]))
-
-  # Create a dependencies DAG for the sentence
-  dep_dag = deps.DepPathDAG(row.dep_parents, row.dep_paths, row.words, max_path_len=HF['max-dep-path-dist'])
-
-  relation_id = '%s_%s' % (gene_mention_id, pheno_mention_id)
-  r = Relation(None, relation_id, row.doc_id, row.section_id, row.sent_id, gene_mention_id, gene_name, \
-               gene_wordidxs, pheno_mention_id, pheno_entity, pheno_wordidxs, None, None, None)
-  path_len_sets = dep_dag.path_len_sets(gene_wordidxs, pheno_wordidxs)
-  if not path_len_sets:
-    if SR.get('bad-dep-paths'):
-      return r._replace(is_correct=False, relation_supertype='BAD_OR_NO_DEP_PATH')
-    else:
-      return None
-
-  dep_path_between = frozenset(dep_dag.min_path_sets(gene_wordidxs, pheno_wordidxs)) if dep_dag else None
-
-  # distant supervision rules & hyperparameters
-  # NOTE: see config.py for all documentation & values
-
-  # global count_g_or_p_false_none
-  # global count_adjacent_false_none
-
-  if SR.get('g-or-p-false'):
-    opts = SR['g-or-p-false']
-    # The following line looks like it was written by a prosimian, but it is actually correct.
-    # Do not mess with the logic unless you know what you're doing.
-    # (Consider that Boolean variables can and will take the value ``None'' in this language.)
-    """The above comment might be necessary for a Eukaryota, otherwise hopefully the below is self-explanatory"""
-    if gene_is_correct == False or pheno_is_correct == False:
-      if random.random() < opts['diff'] * superv_diff or random.random() < opts['rand']:
-        return r._replace(is_correct=False, relation_supertype='G_ANDOR_P_FALSE', relation_subtype='gene_is_correct: %s, pheno_is_correct: %s' % (gene_is_correct, pheno_is_correct))
-      else:
-        # count_g_or_p_false_none += 1
-        return None
-
-  if SR.get('adjacent-false'):
-    if re.search(r'[a-z]{3,}', between_phrase, flags=re.I) is None:
-      if random.random() < 0.5 * superv_diff or random.random() < 0.01:
-        st = non_alnum.sub('_', between_phrase)
-        return r._replace(is_correct=False, relation_supertype='G_P_ADJACENT', relation_subtype=st)
-      else:
-        # count_adjacent_false_none += 1
-        return None
-
-  gene_name = row.gene_name
-
-  VALS = [('neg', False)]
-  rv = config_supervise(r, row, pheno_entity, gene_name, gene, pheno, 
-              phrase, between_phrase, \
-              lemma_phrase, between_phrase_lemmas, dep_dag, \
-              dep_path_between, gene_wordidxs, 
-              charite_pairs, charite_allowed, VALS, SR)
-  if rv is not None:
-    return rv
-  
-  VALS = [('pos', True)]
-  rv = config_supervise(r, row, pheno_entity, gene_name, gene, pheno, 
-              phrase, between_phrase, \
-              lemma_phrase, between_phrase_lemmas, dep_dag, \
-              dep_path_between, gene_wordidxs, 
-              charite_pairs, charite_allowed, VALS, SR)
-  if rv is not None:
-    return rv
+  rules = [supervision.Rule('bad-dep-paths', 'bad-dep-paths', _bad_dep_paths, label=False),
+           supervision.Rule('no-dep-path', None, _no_dep_path),
+           supervision.Rule('g-or-p-false', 'g-or-p-false', _g_or_p_false),
+           supervision.Rule('adjacent-false', 'adjacent-false', _adjacent_false)]
+  rules += _phrase_rules([('neg', False)])
+  rules.append(supervision.Rule('neg-gp-between', None, _neg_gp_between, label=False))
+  if charite_allowed and SR.get('charite-all-pos-words'):
+    all_pos_words = util.compile_rules(rgxs=SR['charite-all-pos-words'])
+    rules.append(supervision.Rule('charite-all-pos-words', 'charite-all-pos-words', _charite_all_pos_words,
+                                  args=(all_pos_words, charite_pairs), cost=4.0))
+  rules += _phrase_rules([('pos', True)])
+  return rules
 
+def create_supervised_relation(row, superv_diff, rules, HF):
+  """
+  Given a Row object with a sentence and a gene and pheno mention, create and supervise
+  a Relation output object with RuleSet rules (see relation_rules), or return None;
+  superv_diff = pos - neg supervision count, for neg supervision
+  """
+  relation_id = '%s_%s' % (row.gene_mention_id, row.pheno_mention_id)
+  r = Relation(None, relation_id, row.doc_id, row.section_id, row.sent_id, row.gene_mention_id, row.gene_name, \
+               row.gene_wordidxs, row.pheno_mention_id, row.pheno_entity, row.pheno_wordidxs, None, None, None)
+  c = supervision.Candidate(DERIVATIONS, row=row, r=r, sentence=SENTENCES.get(row), superv_diff=superv_diff,
+                            max_path_len=HF['max-dep-path-dist'])
+  rv = rules.evaluate(c)
+  if rv is supervision.DROP:
+    return None
   # Return GP relation object
-  return r
+  return r if rv is None else rv
+
+# generate the mentions, while trying to keep the supervision approx. balanced
+pos_count = 0
+neg_count = 0
+SAMPLER = sampling.NegativeSampler()
 
 def supervise(supervision_rules, hard_filters, charite_allowed):
   # print >> sys.stderr, supervision_rules
-  # generate the mentions, while trying to keep the supervision approx. balanced
-  # print out right away so we don't bloat memory...
-  pos_count = 0
-  neg_count = 0
   # load in static data
   CACHE['example-trees'] = {}
   if charite_allowed:
-    CHARITE_PAIRS = read_supervision()
+    CHARITE_PAIRS = read_supervision(supervision_rules.get('charite-expand', 'parents'))
   else:
     CHARITE_PAIRS = []
-    
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
+  util.compile_rule_groups(supervision_rules, params=config.GP_TEMPLATE_PARAMS)
+  rules = supervision.RuleSet(relation_rules(supervision_rules, CHARITE_PAIRS, charite_allowed), supervision_rules)
 
-    relation = create_supervised_relation(row, superv_diff=pos_count - neg_count, SR=supervision_rules, HF=hard_filters, 
-                                          charite_pairs=CHARITE_PAIRS, charite_allowed=charite_allowed)
+  def supervise_row(row):
+    global pos_count
+    global neg_count
+    relation = create_supervised_relation(row, superv_diff=pos_count - neg_count, rules=rules, HF=hard_filters)
 
     if relation:
+      SAMPLER.count(relation.is_correct)
       if relation.is_correct == True:
         pos_count += 1
       elif relation.is_correct == False:
         neg_count += 1
-      util.print_tsv_output(relation)
+      return [relation]
+    return []
+
+  def supervise_sentence_row(row):
+    relations = []
+    for pair_row in util.expand_sentence_row(row, parser.row_class, SENTENCE_COLUMNS, [RELATION_COLUMNS]):
+      relations.extend(supervise_row(pair_row))
+    return relations
+
+  counters = [util.ModuleCounters(sys.modules[__name__], ['pos_count', 'neg_count'],
+                                  balancing=SAMPLER.balancing()),
+              SAMPLER.counters()]
+  # With workers, supervision is balanced per chunk (see util.run_main_tsv)
+  if util.per_sentence_input():
+    SAMPLER.run_main_tsv(row_parser=sentence_parser.parse_tsv_row, row_fn=supervise_sentence_row,
+                         counters=counters, chunk_balancing=True)
+  else:
+    SAMPLER.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=supervise_row, counters=counters,
+                         chunk_balancing=True)
   # sys.stderr.write('count_g_or_p_false_none: %s\n' % count_g_or_p_false_none)
   # sys.stderr.write('count_adjacent_false_none: %s\n' % count_adjacent_false_none)
 
@@ -4,7 +4,7 @@ import collections
 import extractor_util as eutil
 import sys
 from dep_alignment.alignment_util import row_to_canonical_match_tree, DepParentsCycleException, OverlappingCandidatesException, RootException
-from dep_alignment.multi_dep_alignment import MultiDepAlignment
+from dep_alignment.multi_dep_alignment import MatchTreeIndex, MultiDepAlignment
 import os
 import random
 import time
@@ -28,7 +28,7 @@ parser = eutil.RowParser([
             ('poses', 'text[]'),
             ('dep_paths', 'text[]'),
             ('dep_parents', 'int[]'),
-            ('ners', 'text')])
+            ('ners', 'text')], lazy=True)
 
 ds_parser = eutil.RowParser([
             ('words', 'text[]'),
@@ -104,14 +104,15 @@ def print_example_tree(example_sentences_filename, synonyms):
     mt_root1, match_tree1 = mda.get_match_tree()
   mda.print_match_tree(sys.stderr)
 
-def get_score(genepheno_row, example_tree_root, example_tree, synonyms, rescores):
+def get_score(genepheno_row, example_tree_root, example_tree, synonyms, rescores, example_index=None):
   row = genepheno_row
   try:
     mt_root2, match_tree2 = row_to_canonical_match_tree(row, [row.gene_wordidxs, row.pheno_wordidxs])
     assert len(match_tree2) <= len(row.words) + 1, (len(row.words), len(match_tree2), row.words, match_tree2) 
   except (DepParentsCycleException, OverlappingCandidatesException, RootException):
     return -1, -1
-  mda = MultiDepAlignment(example_tree_root, example_tree, mt_root2, match_tree2, 2, synonyms)
+  mda = MultiDepAlignment(example_tree_root, example_tree, mt_root2, match_tree2, 2, synonyms,
+                          index1=example_index)
   score1 = mda.overall_score()
   score2 = mda.rescore(rescores)
   return score1, score2
@@ -145,32 +146,34 @@ if __name__ == '__main__':
       
     # mt_root1, match_tree1 = match_trees[0]
     mda.print_match_tree(match_path_file)
-    lc = 0
-    start_time = time.time()
-    for line in sys.stdin:
-      lc += 1
-      row = parser.parse_tsv_row(line)
+    match_path_file.flush()
+
+    synonyms = [set(['disease', 'disorder']), \
+                set(['mutation', 'variant', 'allele', 'polymorphism', \
+                     'SNP', 'truncation', 'deletion', 'duplication']), \
+                set(['case', 'patient']), \
+                set(['identify', 'report', 'find', 'detect']), \
+                set(['cause', 'associate', 'link', 'lead', 'result']),
+                set(['mutation', 'inhibition', 'deficiency'])]
+    # The example tree side of all alignments is precomputed once
+    example_index = MatchTreeIndex(mt_root1, match_tree1, 2, synonyms)
+
+    def score_candidate(row):
       if row.gene_is_correct == False or row.pheno_is_correct == False:
-        continue
+        return []
       try:
         mt_root2, match_tree2 = row_to_canonical_match_tree(row, [row.gene_wordidxs, row.pheno_wordidxs])
         assert len(match_tree2) <= len(row.words) + 1, (len(row.words), len(match_tree2), row.words, match_tree2) 
       except (DepParentsCycleException, OverlappingCandidatesException, RootException):
-        continue
+        return []
       matching_scores = []
       rescores = []
       # for (mt_root1, match_tree1) in match_trees:
-      mda = MultiDepAlignment(mt_root1, match_tree1, mt_root2, match_tree2, 2, \
-                              [set(['disease', 'disorder']), \
-                               set(['mutation', 'variant', 'allele', 'polymorphism', \
-                                    'SNP', 'truncation', 'deletion', 'duplication']), \
-                               set(['case', 'patient']), \
-                               set(['identify', 'report', 'find', 'detect']), \
-                               set(['cause', 'associate', 'link', 'lead', 'result']),
-                               set(['mutation', 'inhibition', 'deficiency'])])
+      mda = MultiDepAlignment(mt_root1, match_tree1, mt_root2, match_tree2, 2, synonyms,
+                              index1=example_index)
       # mda.print_matched_lemmas(match_path_file)
-      print >>match_path_file, ' '.join(row.words)
-      mda.print_match_tree(match_path_file)
+      print >>match_paths_out, ' '.join(row.words)
+      mda.print_match_tree(match_paths_out)
       score1 = mda.overall_score()
       score2 = mda.rescore([(set(['cause', 'lead', 'result']), set(['associate', 'link']), -50),
                             (set(['mutation']), set(['inhibition', 'deficiency']), -50)])
@@ -178,7 +181,13 @@ if __name__ == '__main__':
       matching_scores.append(int(score1))
       rescores.append(int(score1 + score2))
       # end for
-      eutil.print_tsv_output(r._replace(matching_scores=matching_scores, rescores=rescores))
+      return [r._replace(matching_scores=matching_scores, rescores=rescores)]
+
+    start_time = time.time()
+    # Written by this process only, as rows may be scored by several worker processes
+    match_paths_out = eutil.SideOutput(match_path_file)
+    lc = eutil.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=score_candidate,
+                            sides=match_paths_out)
     end_time = time.time()
     if lc != 0:
       print >>sys.stderr, "Number of lines: %d, time per line: %f seconds" % (lc, (end_time - start_time) / (float(lc)))
@@ -96,12 +96,4 @@ def create_relation(row, i, j):
   return r
 
 if __name__ == '__main__':
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-    
-    # find candidate mentions
-    relations = extract_candidate_relations(row)
-
-    # print output
-    for relation in relations:
-      util.print_tsv_output(relation)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=extract_candidate_relations)
@@ -0,0 +1,408 @@
+"""Incremental extraction: reuse the output of UDF input rows seen by a previous run.
+
+In incremental mode (see enabled), run_main_tsv looks each input row up by the content hash
+of its line, in a cache of the rows processed by previous runs of the same UDF with the same
+fingerprint; only new or changed rows (i.e. the sentences & candidates of new or changed
+documents) go through row_fn, and the output of the others is copied from the cache. Nightly
+PubMed updates thus only process the new documents.
+
+The fingerprint of a UDF covers everything its output depends on besides its input:
+  - the source of every module it has loaded from code/
+  - the sections of config.py these sources refer to (config.<SECTION>)
+  - the size & mtime of the dictionaries they refer to (onto_path('...') & onto/... paths),
+    and of any other file registered with depends_on (e.g. the sources of artifacts), as for
+    artifacts, so that large data files are not read at every start
+  - its command line arguments
+so that changing one dictionary or config section only invalidates the UDFs which use it.
+See config.INCREMENTAL for where the cache is kept.
+"""
+import collections
+import errno
+import fcntl
+import glob
+import hashlib
+import heapq
+import mmap
+import os
+import re
+import shutil
+import sys
+
+import config
+
+OPTS = config.INCREMENTAL
+APP_HOME = os.environ['GDD_HOME']
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Files the output of this process depends on, registered while loading static data
+DEPENDENCIES = set()
+
+# Arguments which do not change the output of a UDF
+NEUTRAL_ARGS = re.compile(r'^--(incremental|profile|instrument|(workers|instrument-sample|progress)(=.*)?)$')
+# ... and those of them followed by a value
+NEUTRAL_VALUE_ARGS = ('--workers', '--instrument-sample', '--progress')
+
+CONFIG_SECTION = re.compile(r'\bconfig\.([A-Z][A-Z0-9_]*)\b')
+ONTO_FILE = re.compile(r'''onto_path\(\s*['"]([^'"]+)['"]|/onto/((?:data|manual)/[\w./-]+)''')
+
+
+def enabled():
+  """
+  Incremental mode is turned on by an --incremental argument, or GDD_INCREMENTAL=1 from
+  within DeepDive; it is off during sampling counting passes, whose output is discarded
+  """
+  if '--sampling-count' in sys.argv or os.environ.get('GDD_SAMPLING_COUNT'):
+    return False
+  return '--incremental' in sys.argv or bool(os.environ.get('GDD_INCREMENTAL'))
+
+
+def depends_on(*paths):
+  """Register files the output of this process depends on"""
+  DEPENDENCIES.update(os.path.abspath(path) for path in paths)
+
+
+def content_hash(s):
+  return hashlib.md5(s).hexdigest()
+
+
+def file_stamp(path):
+  st = os.stat(path)
+  return '%d:%r' % (st.st_size, st.st_mtime)
+
+
+def canonical(value):
+  """A repr of a config value which does not depend on set or dict ordering"""
+  if isinstance(value, dict):
+    return '{%s}' % ', '.join(sorted('%s: %s' % (canonical(k), canonical(v)) for k, v in value.iteritems()))
+  if isinstance(value, (set, frozenset)):
+    return '{%s}' % ', '.join(sorted(canonical(v) for v in value))
+  if isinstance(value, (list, tuple)):
+    return '[%s]' % ', '.join(canonical(v) for v in value)
+  return repr(value)
+
+
+def loaded_sources():
+  """
+  The paths of the .py sources of all modules loaded from code/, except config.py, which
+  is covered by the hashes of the sections used
+  """
+  rv = set()
+  for module in sys.modules.values():
+    path = getattr(module, '__file__', None)
+    if not path:
+      continue
+    path = os.path.abspath(path)
+    if path.endswith(('.pyc', '.pyo')):
+      path = path[:-1]
+    if path.startswith(CODE_DIR + os.sep) and os.path.isfile(path) and module is not config:
+      rv.add(path)
+  main = getattr(sys.modules.get('__main__'), '__file__', None)
+  if main and os.path.isfile(main):
+    rv.add(os.path.abspath(main))
+  return rv
+
+
+def fingerprint_parts(argv=None):
+  """The (kind, name, hash) parts of the fingerprint of this process, in a stable order"""
+  argv = sys.argv if argv is None else argv
+  parts = []
+  sections = set()
+  data_files = set(DEPENDENCIES)
+  for path in sorted(loaded_sources()):
+    with open(path, 'rb') as f:
+      source = f.read()
+    parts.append(('code', os.path.relpath(path, CODE_DIR), content_hash(source)))
+    sections.update(CONFIG_SECTION.findall(source))
+    for onto_path, onto_file in ONTO_FILE.findall(source):
+      data_files.add('%s/onto/%s' % (APP_HOME, onto_path or onto_file))
+  for section in sorted(sections):
+    if hasattr(config, section):
+      parts.append(('config', section, content_hash(canonical(getattr(config, section)))))
+  for path in sorted(data_files):
+    if os.path.isfile(path):
+      parts.append(('data', path, file_stamp(path)))
+  args = []
+  for i, arg in enumerate(argv[1:], 1):
+    if not NEUTRAL_ARGS.match(arg) and argv[i - 1] not in NEUTRAL_VALUE_ARGS:
+      args.append(arg)
+  parts.append(('args', ' '.join(args), ''))
+  return parts
+
+
+def fingerprint(argv=None):
+  return content_hash(repr(fingerprint_parts(argv)))
+
+
+# Index records, fixed width so that a sorted index is searched in place: the row hash, then
+# in hex the number of the .out file (in the file list of the index), the offset & length of
+# the output, its number of rows, and the length of the extra data which follows it
+RECORD = '%32s%04x%012x%08x%08x%08x\n'
+RECORD_SIZE = 73
+
+
+def parse_record(record):
+  """The (row hash, file number, offset, length, rows, extra length) of an index record"""
+  return (record[:32], int(record[32:36], 16), int(record[36:48], 16), int(record[48:56], 16),
+          int(record[56:64], 16), int(record[64:72], 16))
+
+
+def renumbered(records, file_no):
+  for record in records:
+    yield record[:32] + '%04x' % file_no + record[36:]
+
+
+def write_atomic(path, lines):
+  tmp_path = '%s.%d.tmp' % (path, os.getpid())
+  with open(tmp_path, 'wb') as f:
+    f.writelines(lines)
+  os.rename(tmp_path, path)
+
+
+def process_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    return e.errno == errno.EPERM
+  return True
+
+
+class RowCache:
+  """
+  The output of the input rows processed by runs of UDF name (by default the name of the
+  running script) with the same fingerprint, in <cache-dir>/<name>/<fingerprint>/.
+
+  Each process appends the rows it computes to its own segments, of up to SEGMENT_ROWS rows:
+  <pid>.<n>.out holds their output lines, each followed by the extra data replayed when the
+  row is reused (see extractor_util.run_main_tsv), and <pid>.<n>.idx, written once the
+  segment is complete, their index records (see RECORD), sorted by row hash.
+  Rows are looked up by binary search in the base index base.<g>.idx, which merges the indexes
+  of all complete segments, over the .out files listed in base.<g>.files; .out files are
+  opened on first use, at most OPEN_FILES at a time. Whenever a cache is opened or closed,
+  the segments completed since are merged into a new base index (by one process at a time;
+  the others skip this), and once there are more than MAX_OUT_FILES .out files, their data is
+  rewritten into one. The directories of all but the opts['keep-fingerprints'] most recently
+  used fingerprints of the UDF are removed.
+  Processes are assumed to run on one host, which is how segments left incomplete by
+  processes which died are told apart from those being written
+  """
+  SEGMENT_ROWS = 100000
+  OPEN_FILES = 8
+  MAX_OUT_FILES = 32
+
+  def __init__(self, name=None, fp=None, opts=OPTS):
+    self.name = name or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    self.fingerprint = fp or fingerprint()
+    self.dir = '%s/%s/%s/%s' % (APP_HOME, opts['cache-dir'], self.name, self.fingerprint)
+    if not os.path.isdir(self.dir):
+      os.makedirs(self.dir)
+    os.utime(self.dir, None)
+    self.prune(opts['keep-fingerprints'])
+    self.handles = collections.OrderedDict()
+    self.compact()
+    self.files = []
+    self.index = None
+    self.n = 0
+    self._open_base()
+    self.out = None
+    self.segment = None
+    self.records = []
+    self.offset = 0
+    self.reused = 0
+    self.computed = 0
+
+  def _path(self, name):
+    return '%s/%s' % (self.dir, name)
+
+  def _generation(self):
+    """The generation g of the current base index, or None if there is none yet"""
+    gens = [int(os.path.basename(p).split('.')[1]) for p in glob.glob(self._path('base.*.idx'))]
+    return max(gens) if gens else None
+
+  def _base_files(self, g):
+    if g is None:
+      return []
+    with open(self._path('base.%d.files' % g)) as f:
+      return [line.rstrip('\n') for line in f]
+
+  def _open_base(self):
+    # Retried if the base index is replaced by the compaction of another process meanwhile
+    for attempt in xrange(3):
+      g = self._generation()
+      if g is None:
+        return
+      try:
+        self.files = self._base_files(g)
+        f = open(self._path('base.%d.idx' % g), 'rb')
+      except IOError:
+        continue
+      with f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+          self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+          self.n = size // RECORD_SIZE
+      return
+
+  def _find(self, key):
+    lo, hi = 0, self.n
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.index[mid * RECORD_SIZE:mid * RECORD_SIZE + 32] < key:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo < self.n and self.index[lo * RECORD_SIZE:lo * RECORD_SIZE + 32] == key:
+      return parse_record(self.index[lo * RECORD_SIZE:(lo + 1) * RECORD_SIZE])
+    return None
+
+  def _handle(self, name):
+    f = self.handles.pop(name, None)
+    if f is None:
+      if len(self.handles) >= self.OPEN_FILES:
+        self.handles.popitem(last=False)[1].close()
+      f = open(self._path(name), 'rb')
+    self.handles[name] = f
+    return f
+
+  def _read(self, file_name, offset, size):
+    f = self._handle(file_name)
+    f.seek(offset)
+    return f.read(size)
+
+  def get(self, line):
+    """The (output text, number of output rows, extra data) of an input line, or None if not cached"""
+    if self.index is None:
+      return None
+    entry = self._find(content_hash(line))
+    if entry is None:
+      return None
+    _, file_no, offset, length, rows, extra = entry
+    try:
+      data = self._read(self.files[file_no], offset, length + extra)
+    except IOError:
+      # Rewritten by the compaction of another process since the base index was opened
+      return None
+    if len(data) != length + extra:
+      return None
+    self.reused += 1
+    return data[:length], rows, data[length:]
+
+  def put(self, line, out_lines, extra=''):
+    """Cache the output lines (formatted, with newlines) and extra data of an input line"""
+    if self.out is None:
+      # Never the name of an earlier segment, which an open base index may still refer to
+      self.segment = self._path('%d.%s' % (os.getpid(), os.urandom(6).encode('hex')))
+      self.out = open(self.segment + '.out', 'wb')
+      self.offset = 0
+    text = ''.join(out_lines)
+    self.out.write(text)
+    self.out.write(extra)
+    self.records.append(RECORD % (content_hash(line), 0, self.offset, len(text), len(out_lines),
+                                  len(extra)))
+    self.offset += len(text) + len(extra)
+    self.computed += 1
+    if len(self.records) >= self.SEGMENT_ROWS:
+      self._end_segment()
+
+  def _end_segment(self):
+    # The output is flushed before the index which refers to it, and which marks it complete
+    self.out.close()
+    self.out = None
+    self.records.sort()
+    write_atomic(self.segment + '.idx', self.records)
+    self.records = []
+
+  def compact(self):
+    """Merge the complete segments into a new base index, unless another process is at it"""
+    with open(self._path('compact.lock'), 'a') as lock:
+      try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except IOError:
+        return
+      self._compact()
+
+  def _compact(self):
+    g = self._generation()
+    files = self._base_files(g)
+    referenced = set(files)
+    # The output of segments whose process died before completing them is never indexed
+    for out_path in glob.glob(self._path('[0-9]*.out')):
+      segment = out_path[:-len('.out')]
+      if os.path.basename(out_path) not in referenced and not os.path.isfile(segment + '.idx') \
+          and not process_alive(int(os.path.basename(segment).split('.')[0])):
+        os.remove(out_path)
+    segments = sorted(p[:-len('.idx')] for p in glob.glob(self._path('[0-9]*.idx')))
+    if not segments:
+      return
+    inputs = []
+    if g is not None:
+      inputs.append(open(self._path('base.%d.idx' % g), 'rb'))
+    streams = [iter(inputs[0])] if inputs else []
+    for segment in segments:
+      f = open(segment + '.idx', 'rb')
+      inputs.append(f)
+      streams.append(renumbered(f, len(files)))
+      files.append(os.path.basename(segment) + '.out')
+    new_g = 0 if g is None else g + 1
+    rewrite = len(files) > self.MAX_OUT_FILES
+    data_file = 'data.%d.out' % new_g
+    try:
+      records = self._merged(heapq.merge(*streams))
+      if rewrite:
+        records = self._rewritten(records, files, data_file)
+      # The file list goes first: the index marks the new base complete
+      write_atomic(self._path('base.%d.files' % new_g),
+                   ['%s\n' % name for name in ([data_file] if rewrite else files)])
+      write_atomic(self._path('base.%d.idx' % new_g), records)
+    finally:
+      for f in inputs:
+        f.close()
+      for f in self.handles.values():
+        f.close()
+      self.handles.clear()
+    for segment in segments:
+      os.remove(segment + '.idx')
+    if g is not None:
+      os.remove(self._path('base.%d.idx' % g))
+      os.remove(self._path('base.%d.files' % g))
+    if rewrite:
+      for name in files:
+        os.remove(self._path(name))
+
+  def _merged(self, records):
+    """The records of a sorted stream, keeping the first one of each row hash"""
+    last = None
+    for record in records:
+      if record[:32] != last:
+        last = record[:32]
+        yield record
+
+  def _rewritten(self, records, files, data_file):
+    """Copy the data of records into data_file, yielding the records of the copies"""
+    offset = 0
+    with open(self._path(data_file), 'wb') as out:
+      for record in records:
+        key, file_no, start, length, rows, extra = parse_record(record)
+        out.write(self._read(files[file_no], start, length + extra))
+        yield RECORD % (key, 0, offset, length, rows, extra)
+        offset += length + extra
+
+  def prune(self, keep):
+    """Remove the directories of all but the keep most recently used fingerprints of this UDF"""
+    others = [d for d in glob.glob('%s/*' % os.path.dirname(self.dir))
+              if os.path.isdir(d) and d != self.dir]
+    others.sort(key=os.path.getmtime, reverse=True)
+    for d in others[max(keep - 1, 0):]:
+      shutil.rmtree(d, ignore_errors=True)
+
+  def close(self):
+    if self.out is not None:
+      self._end_segment()
+    for f in self.handles.values():
+      f.close()
+    self.handles.clear()
+    if self.index is not None:
+      self.index.close()
+      self.index = None
+    self.compact()
+    sys.stderr.write('INCREMENTAL[%s]: fingerprint %s, %d rows reused, %d rows computed\n' %
+                     (self.name, self.fingerprint, self.reused, self.computed))
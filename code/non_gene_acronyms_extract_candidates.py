@@ -165,35 +165,38 @@ def read_gene_to_full_name():
       rv[geneAbbrev] = geneFullName
   return rv
 
+# generate the mentions, while trying to keep the supervision approx. balanced
+pos_count = 0
+neg_count = 0
+
+def get_mentions(row):
+  global pos_count
+  global neg_count
+
+  #Specific to ddlog, add two conditions that are not possible directly in the sql query.
+  row.gene_wordidx = row.gene_wordidx_array[0]
+  # print >> sys.stderr, 'patate'
+  # print >> sys.stderr, row
+  if '-LRB-' not in row.words[row.gene_wordidx - 1]:
+    return []
+
+  # Skip row if sentence doesn't contain a verb, contains URL, etc.
+  if util.skip_row(row):
+    return []
+
+  # Find candidate mentions & supervise
+  mentions = extract_candidate_mentions(row, pos_count, neg_count)
+
+  pos_count += len([m for m in mentions if m.is_correct])
+  neg_count += len([m for m in mentions if m.is_correct is False])
+  return mentions
+
 if __name__ == '__main__':
   # load static data
   onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
   CACHE['gene_to_full_name'] = read_gene_to_full_name()
 
-  # generate the mentions, while trying to keep the supervision approx. balanced
-  # print out right away so we don't bloat memory...
-  pos_count = 0
-  neg_count = 0
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-
-    #Specific to ddlog, add two conditions that are not possible directly in the sql query.
-    row.gene_wordidx = row.gene_wordidx_array[0]
-    # print >> sys.stderr, 'patate'
-    # print >> sys.stderr, row
-    if '-LRB-' not in row.words[row.gene_wordidx - 1]:
-      continue
-
-    # Skip row if sentence doesn't contain a verb, contains URL, etc.
-    if util.skip_row(row):
-      continue
-
-    # Find candidate mentions & supervise
-    mentions = extract_candidate_mentions(row, pos_count, neg_count)
-
-    pos_count += len([m for m in mentions if m.is_correct])
-    neg_count += len([m for m in mentions if m.is_correct is False])
-
-    # print output
-    for mention in mentions:
-      util.print_tsv_output(mention)
+  # With workers, supervision is balanced per chunk (see util.run_main_tsv)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_mentions,
+                    counters=util.ModuleCounters(sys.modules[__name__], ['pos_count', 'neg_count']),
+                    chunk_balancing=True)
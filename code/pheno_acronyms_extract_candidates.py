@@ -95,33 +95,36 @@ def create_supervised_mention(row, is_correct,
     m = None
   return m
 
-if __name__ == '__main__':
-  # load static data
-  onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
+# generate the mentions, while trying to keep the supervision approx. balanced
+pos_count = 0
+neg_count = 0
+
+def get_mentions(row):
+  global pos_count
+  global neg_count
 
-  # generate the mentions, while trying to keep the supervision approx. balanced
-  # print out right away so we don't bloat memory...
-  pos_count = 0
-  neg_count = 0
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
+  try:
+    if '-LRB-' not in row.words[row.pheno_wordidxs[len(row.pheno_wordidxs)-1] + 1]:
+      return []
+  except:
+    pass
+    #print >> sys.stderr, 'error in condition for extractor pheno_acronyms extract candidates'
+  # Skip row if sentence doesn't contain a verb, contains URL, etc.
+  if util.skip_row(row):
+    return []
 
-    try:
-      if '-LRB-' not in row.words[row.pheno_wordidxs[len(row.pheno_wordidxs)-1] + 1]:
-        continue
-    except:
-      pass
-      #print >> sys.stderr, 'error in condition for extractor pheno_acronyms extract candidates'
-    # Skip row if sentence doesn't contain a verb, contains URL, etc.
-    if util.skip_row(row):
-      continue
+  # Find candidate mentions & supervise
+  mentions = extract_candidate_mentions(row, pos_count, neg_count)
 
-    # Find candidate mentions & supervise
-    mentions = extract_candidate_mentions(row, pos_count, neg_count)
+  pos_count += len([m for m in mentions if m.is_correct])
+  neg_count += len([m for m in mentions if m.is_correct is False])
+  return mentions
 
-    pos_count += len([m for m in mentions if m.is_correct])
-    neg_count += len([m for m in mentions if m.is_correct is False])
+if __name__ == '__main__':
+  # load static data
+  onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
 
-    # print output
-    for mention in mentions:
-      util.print_tsv_output(mention)
+  # With workers, supervision is balanced per chunk (see util.run_main_tsv)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_mentions,
+                    counters=util.ModuleCounters(sys.modules[__name__], ['pos_count', 'neg_count']),
+                    chunk_balancing=True)
@@ -111,34 +111,39 @@ def generate_rand_negatives(row, pos, neg):
       neg += 1
   return mentions
 
+pos = 0
+neg = 0
+
+def get_mentions(array_row):
+  global pos
+  global neg
+  abbrevs = set()
+  for row in expand_array_rows(array_row):
+    if row.pa_abbrev in abbrevs:
+      continue
+    abbrevs.add(row.pa_abbrev)
+
+    # Skip row if sentence doesn't contain a verb, contains URL, etc.
+    if util.skip_row(row):
+      continue
+
+    # find candidate mentions & supervise
+    mentions = extract_candidate_mentions(row)
+    pos += len(mentions)
+    if SR.get('rand-negs'):
+      negs = generate_rand_negatives(row, pos, neg)
+      neg += len(negs)
+      mentions.extend(negs)
+
+    for mention in mentions:
+      yield mention
+
 if __name__ == '__main__':
   onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
 
-  pos = 0
-  neg = 0
-
   # Read TSV data in as Row objects
-  for line in sys.stdin:
-    array_row = parser.parse_tsv_row(line)
-    abbrevs = set()
-    for row in expand_array_rows(array_row):
-      if row.pa_abbrev in abbrevs:
-        continue
-      abbrevs.add(row.pa_abbrev)
-  
-      # Skip row if sentence doesn't contain a verb, contains URL, etc.
-      if util.skip_row(row):
-        continue
-  
-      # find candidate mentions & supervise
-      mentions = extract_candidate_mentions(row)
-      pos += len(mentions)
-      if SR.get('rand-negs'):
-        negs = generate_rand_negatives(row, pos, neg)
-        neg += len(negs)
-        mentions.extend(negs)
-  
-      # print output
-      for mention in mentions:
-        util.print_tsv_output(mention)
+  # With workers, supervision is balanced per chunk (see util.run_main_tsv)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_mentions,
+                    counters=util.ModuleCounters(sys.modules[__name__], ['pos', 'neg']),
+                    chunk_balancing=True)
 #!/usr/bin/env python
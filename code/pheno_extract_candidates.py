@@ -3,11 +3,14 @@ from collections import defaultdict, namedtuple
 import sys
 import re
 import os
-import random
+import sampling
 from itertools import chain
+import artifacts
 import extractor_util as util
 import data_util as dutil
 import config
+import supervision_util as supervision
+import term_trie
 
 onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
 
@@ -129,10 +132,18 @@ def load_disease_terms():
 def keep_word(w):
   return (w.lower() not in STOPWORDS and len(w) > HF['min-word-len'] - 1)
 
-def extract_candidate_mentions(row, terms, term_sets):
+def extract_candidate_mentions(row, matcher):
   """Extracts candidate phenotype mentions from an input row object"""
   mentions = []
 
+  # Normalize words & lemmas once per sentence, rather than once per window
+  words = [re.sub(r'\W+', ' ', w.lower()) for w in row.words]
+  lemmas = [re.sub(r'\W+', ' ', w.lower()) for w in row.lemmas]
+
+  # Note: we filter stop words coordinated between word and lemma lists
+  # (i.e. if lemmatized version of a word is stop word, it should be stop word too)
+  keep = [keep_word(w) and keep_word(l) for w, l in zip(words, lemmas)]
+
   # First we initialize a list of indices which we 'split' on,
   # i.e. if a window intersects with any of these indices we skip past it
   split_indices = set()
@@ -150,108 +161,114 @@ def extract_candidate_mentions(row, terms, term_sets):
         split_indices.update(seq)
       seq = []
 
-  # Next, pass a window of size n (dec.) over the sentence looking for candidate mentions
-  for n in reversed(range(1, min(len(row.words), HF['max-len'])+1)):
-    for i in range(len(row.words)-n+1):
-      wordidxs = range(i,i+n)
-      words = [re.sub(r'\W+', ' ', w.lower()) for w in row.words[i:i+n]]
-      lemmas = [re.sub(r'\W+', ' ', w.lower()) for w in row.lemmas[i:i+n]]
-
-      # skip this window if it intersects with the split set
-      if not split_indices.isdisjoint(wordidxs):
-        continue
-
-      # skip this window if it is sub-optimal: e.g. starts with a skip word, etc.
-      if not all(map(keep_word, [words[0], lemmas[0], words[-1], lemmas[-1]])):
-        continue
-      
-      # Note: we filter stop words coordinated between word and lemma lists
-      # (i.e. if lemmatized version of a word is stop word, it should be stop word too)
-      # This also keeps these filtered lists in sync!
-      ws, lws = zip(*[(words[k], lemmas[k]) for k in range(n) if keep_word(words[k]) and keep_word(lemmas[k])])
-
-      # (1) Check for exact match (including exact match of lemmatized / stop words removed)
-      # If found add to split list so as not to consider subset phrases
-      p, lp = map(' '.join, [ws, lws])
-
-      if p in terms or lp in terms:
-        entities = terms[p] if p in terms else terms[lp]
+  # Find all windows matching a term in one pass over the sentence...
+  matches = matcher.find_matches(words, lemmas, keep, split_indices, HF['max-len'],
+                                 permuted=HF['permuted'], omitted_interior=HF['omitted-interior'])
+
+  # ...then take them longest first (and left to right), as a window of size n (dec.)
+  # passed over the sentence would
+  for (n, i) in sorted(matches, key=lambda k : (-k[0], k[1])):
+    wordidxs = range(i,i+n)
+
+    # skip this window if it intersects with the split set
+    if not split_indices.isdisjoint(wordidxs):
+      continue
+
+    kind, found = matches[(n, i)]
+
+    # (1) Exact match (including exact match of lemmatized / stop words removed)
+    # If found add to split list so as not to consider subset phrases
+    if kind == term_trie.EXACT:
+      for (entity, entry_type) in found[0][0]:
+        mentions.append(create_supervised_mention(row, wordidxs, entity, entry_type + '_EXACT'))
+      split_indices.update(wordidxs)
+
+    # (2) Permuted match
+    elif kind == term_trie.PERM:
+      for (entity, entry_type) in found[0][0]:
+        mentions.append(create_supervised_mention(row, wordidxs, entity, entry_type + '_PERM'))
+
+    # (3) Exact match with one ommitted (interior) word/lemma
+    elif kind == term_trie.OMIT:
+      for entities, omit in found:
         for (entity, entry_type) in entities:
-          mentions.append(create_supervised_mention(row, wordidxs, entity, entry_type + '_EXACT'))
-        split_indices.update(wordidxs)
-        continue
-
-      # (2) Check for permuted match
-      # Note: avoid repeated words here!
-      if HF['permuted']:
-        ps, lps = map(frozenset, [ws, lws])
-        if (len(ps)==len(ws) and ps in term_sets) or (len(lps)==len(lws) and lps in term_sets):
-          entities = term_sets[ps] if ps in term_sets else term_sets[lps]
-          for (entity, entry_type) in entities:
-            mentions.append(create_supervised_mention(row, wordidxs, entity, entry_type + '_PERM'))
-          continue
-
-      # (3) Check for an exact match with one ommitted (interior) word/lemma
-      # Note: only consider ommiting non-stop words!
-      if HF['omitted-interior']:
-        if len(ws) > 2:
-          for omit in range(1, len(ws)-1):
-            p, lp = [' '.join([w for i,w in enumerate(x) if i != omit]) for x in [ws, lws]]
-            if p in terms or lp in terms:
-              entities = terms[p] if p in terms else terms[lp]
-              for (entity, entry_type) in entities:
-                mentions.append(create_supervised_mention(row, wordidxs, entity, entry_type + '_OMIT_%s' % omit))
+          mentions.append(create_supervised_mention(row, wordidxs, entity, entry_type + '_OMIT_%s' % omit))
   return mentions    
 
 
 ### DISTANT SUPERVISION ###
 VALS = config.PHENO['vals']
+
+# Derived values, computed on first use by a rule (see supervision_util.Candidate)
+DERIVATIONS = {
+  'phrase_post' : lambda c: " ".join(c.row.words[c.idxs[-1]:]),
+  'pubmed_id' : lambda c: dutil.get_pubmed_id_for_doc(c.row.doc_id)}
+
+def _post_match(c, opts, name, val):
+  match = util.rule_group(opts, name).search(c.phrase_post)
+  if match:
+    return c.m._replace(is_correct=val, mention_supertype='%s_POST_MATCH_%s_%s' % (c.mention_supertype, name, val), mention_subtype=match)
+
+def _bad_pheno_names(c, opts):
+  if ' '.join(c.words) in opts:
+    return c.m._replace(is_correct=False, mention_supertype='%s_BAD_PHENO_NAME' % c.mention_supertype)
+
+def _bad_phenos(c, opts):
+  if c.entity in opts:
+    return c.m._replace(is_correct=False, mention_supertype='%s_BAD_PHENO_ENTITY' % c.mention_supertype)
+
+def _mesh_supervise(c, opts):
+  pubmed_id = c.pubmed_id
+  if pubmed_id and pubmed_id in PMID_TO_HPO:
+    if c.entity in PMID_TO_HPO[pubmed_id]:
+      return c.m._replace(is_correct=True, mention_supertype='%s_MESH_SUPERV' % c.mention_supertype, mention_subtype=str(pubmed_id) + ' ::: ' + str(c.entity))
+
+# If this is more specific than MeSH term, also consider true.
+def _mesh_specific_true(c, opts):
+  pubmed_id = c.pubmed_id
+  if pubmed_id and pubmed_id in PMID_TO_HPO:
+    if c.entity not in PMID_TO_HPO[pubmed_id] and c.entity in hpo_dag.node_set:
+      for parent in PMID_TO_HPO[pubmed_id]:
+        if hpo_dag.has_child(parent, c.entity):
+          return c.m._replace(is_correct=True, mention_supertype='%s_MESH_CHILD_SUPERV' % c.mention_supertype, mention_subtype=str(parent) + ' -> ' + str(c.entity))
+
+def _exact(c, opts, english_word_opts):
+  if c.mention_supertype == 'EXACT':
+    phrase = " ".join(c.words).lower()
+    if english_word_opts and \
+      len(c.words) == 1 and phrase in ENGLISH_WORDS and \
+      sampling.uniform(c.m.mention_id, 'exact-english-word') < english_word_opts['p']:
+      return c.m._replace(is_correct=True, mention_supertype='%s_EXACT_AND_ENGLISH_WORD' % c.mention_supertype, mention_subtype=phrase)
+    else:
+      return c.m._replace(is_correct=True, mention_supertype='%s_NON_EXACT_AND_ENGLISH_WORD' % c.mention_supertype, mention_subtype=phrase)
+
+def mention_rules(SR):
+  """The pheno mention supervision rules, in order"""
+  rules = supervision.val_rules('post-match', 'post-match', _post_match, VALS, cost=2.0,
+                                enabled=supervision.has_rule_group)
+  rules += [supervision.Rule('bad-pheno-names', 'bad-pheno-names', _bad_pheno_names, label=False),
+            supervision.Rule('bad-phenos', 'bad-phenos', _bad_phenos, label=False)]
+  if SR.get('mesh-supervise'):
+    rules += [supervision.Rule('mesh-supervise', 'mesh-supervise', _mesh_supervise, label=True),
+              supervision.Rule('mesh-specific-true', 'mesh-specific-true', _mesh_specific_true, label=True, cost=8.0)]
+  rules.append(supervision.Rule('exact', None, _exact, args=(SR.get('exact-english-word'),), label=True))
+  return rules
+
+util.compile_rule_groups(SR)
+RULES = supervision.RuleSet(mention_rules(SR), SR)
+
 def create_supervised_mention(row, idxs, entity=None, mention_supertype=None, mention_subtype=None):
   """Given a Row object consisting of a sentence, create & supervise a Mention output object"""
   words = [row.words[i] for i in idxs]
   idxs_strs = [str(i) for i in idxs]
   mid = '%s_%s_%s_%s' % (row.doc_id, row.section_id, row.sent_id, '-'.join(idxs_strs))
   m = Mention(None, row.doc_id, row.section_id, row.sent_id, idxs, mid, mention_supertype, mention_subtype, entity, words, None)
-
-  if SR.get('post-match'):
-    opts = SR['post-match']
-    phrase_post = " ".join(row.words[idxs[-1]:])
-    for name,val in VALS:
-      if len(opts[name]) + len(opts['%s-rgx' % name]) > 0:
-        match = util.rgx_mult_search(phrase_post, opts[name], opts['%s-rgx' % name], opts[name], opts['%s-rgx' % name], flags=re.I)
-        if match:
-          return m._replace(is_correct=val, mention_supertype='%s_POST_MATCH_%s_%s' % (mention_supertype, name, val), mention_subtype=match)
-
-  if SR.get('bad-pheno-names'):
-    if ' '.join(words) in SR['bad-pheno-names']:
-      return m._replace(is_correct=False, mention_supertype='%s_BAD_PHENO_NAME' % mention_supertype)
-  
-  if SR.get('bad-phenos'):
-    if entity in SR['bad-phenos']:
-      return m._replace(is_correct=False, mention_supertype='%s_BAD_PHENO_ENTITY' % mention_supertype)
-
-  if SR.get('mesh-supervise'):
-    pubmed_id = dutil.get_pubmed_id_for_doc(row.doc_id)
-    if pubmed_id and pubmed_id in PMID_TO_HPO:
-      if entity in PMID_TO_HPO[pubmed_id]:
-        return m._replace(is_correct=True, mention_supertype='%s_MESH_SUPERV' % mention_supertype, mention_subtype=str(pubmed_id) + ' ::: ' + str(entity))
-  
-      # If this is more specific than MeSH term, also consider true.
-      elif SR.get('mesh-specific-true') and entity in hpo_dag.node_set:
-        for parent in PMID_TO_HPO[pubmed_id]:
-          if hpo_dag.has_child(parent, entity):
-            return m._replace(is_correct=True, mention_supertype='%s_MESH_CHILD_SUPERV' % mention_supertype, mention_subtype=str(parent) + ' -> ' + str(entity))
-
-  phrase = " ".join(words).lower()
-  if mention_supertype == 'EXACT':
-    if SR.get('exact-english-word') and \
-      len(words) == 1 and phrase in ENGLISH_WORDS and random.random() < SR['exact-english-word']['p']:
-      return m._replace(is_correct=True, mention_supertype='%s_EXACT_AND_ENGLISH_WORD' % mention_supertype, mention_subtype=phrase)
-    else:
-      return m._replace(is_correct=True, mention_supertype='%s_NON_EXACT_AND_ENGLISH_WORD' % mention_supertype, mention_subtype=phrase)
+  c = supervision.Candidate(DERIVATIONS, row=row, idxs=idxs, words=words, entity=entity,
+                            mention_supertype=mention_supertype, m=m)
+  rv = RULES.evaluate(c)
 
   # Else default to existing values / NULL
-  return m
+  return m if rv is None else rv
 
 
 ### RANDOM NEGATIVE SUPERVISION ###
@@ -265,13 +282,15 @@ def generate_rand_negatives(s, candidates):
   # pick random noun / adj phrases which do not overlap with candidate mentions
   covered = set(chain.from_iterable([m.wordidxs for m in candidates]))
   idxs = set([i for i in range(len(s.words)) if re.match(SR['rand-negs']['pos-tag-rgx'], s.poses[i])])
+  # Random choices are determined by the sentence, see sampling.py
+  rnd = sampling.rng('%s_%s_%s' % (s.doc_id, s.section_id, s.sent_id), 'rand-negs')
 
   for i in range(n_negs):
     x = sorted(list(idxs - covered))
     if len(x) == 0:
       break
-    ridxs = [random.randint(0, len(x)-1)]
-    while random.random() > 0.5:
+    ridxs = [rnd.randint(0, len(x)-1)]
+    while rnd.random() > 0.5:
       j = ridxs[-1]
       if j + 1 < len(x) and x[j+1] == x[j] + 1:
         ridxs.append(j+1)
@@ -289,42 +308,54 @@ def generate_rand_negatives(s, candidates):
       covered.add(i)
   return negs
 
-if __name__ == '__main__':
-
-  # Load static dictionaries
-  # TODO: any simple ways to speed this up? 
-  STOPWORDS = frozenset([w.strip() for w in open(onto_path('manual/stopwords.tsv'), 'rb')])
-  ENGLISH_WORDS = frozenset([w.strip() for w in open(onto_path('data/english_words.tsv'), 'rb')])
+def get_mentions(row):
+  # Skip row if sentence doesn't contain a verb, contains URL, etc.
+  if util.skip_row(row):
+    return []
+
+  # find candidate mentions & supervise
+  disease_mentions = extract_candidate_mentions(row, DISEASE_MATCHER)
+  pheno_mentions = extract_candidate_mentions(row, PHENO_MATCHER)
+  dwi = [d.wordidxs for d in disease_mentions]
+  pheno_mentions_2 = []
+  for p in pheno_mentions:
+    if p.wordidxs not in dwi:
+      pheno_mentions_2.append(p)
+  mentions = disease_mentions + pheno_mentions_2
+
+  if SR.get('rand-negs'):
+    mentions += generate_rand_negatives(row, mentions)
+  return mentions
+
+def _read_word_set(path):
+  return frozenset([w.strip() for w in open(path, 'rb')])
+
+def load_static_data():
+  """Load the static dictionaries (as module globals), from precompiled artifacts where up to date"""
+  global STOPWORDS, ENGLISH_WORDS, hpo_dag, hpo_phenos, PMID_TO_HPO
+  global PHENOS, PHENO_SETS, DISEASES, DISEASE_SETS
+  STOPWORDS = artifacts.cached('stopwords', [onto_path('manual/stopwords.tsv')],
+                               _read_word_set, onto_path('manual/stopwords.tsv'))
+  ENGLISH_WORDS = artifacts.cached('english_words', [onto_path('data/english_words.tsv')],
+                                   _read_word_set, onto_path('data/english_words.tsv'))
   hpo_dag = dutil.read_hpo_dag()
   hpo_phenos = set(dutil.get_hpo_phenos(hpo_dag))
   if SR.get('mesh-supervise'):
     # unnecessary and hope it will never be used again --- our doc id is the pmid currently
     # DOI_TO_PMID = dutil.read_doi_to_pmid()
     PMID_TO_HPO = dutil.load_pmid_to_hpo()
-  PHENOS, PHENO_SETS = load_pheno_terms()
-  DISEASES, DISEASE_SETS = load_disease_terms()
+  PHENOS, PHENO_SETS = artifacts.cached('pheno_terms',
+                                        [onto_path('manual/pheno_terms.tsv'), dutil.HPO_PHENOTYPES_TSV],
+                                        load_pheno_terms)
+  DISEASES, DISEASE_SETS = artifacts.cached('disease_terms',
+                                            [onto_path('manual/disease_terms.tsv'), onto_path('manual/allowed_omim_ps.tsv')],
+                                            load_disease_terms)
 
-  # Read TSV data in as Row objects
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
+if __name__ == '__main__':
 
-    # Skip row if sentence doesn't contain a verb, contains URL, etc.
-    if util.skip_row(row):
-      continue
+  # Load static dictionaries
+  load_static_data()
+  PHENO_MATCHER = term_trie.TermTrie(PHENOS, PHENO_SETS)
+  DISEASE_MATCHER = term_trie.TermTrie(DISEASES, DISEASE_SETS)
 
-    # find candidate mentions & supervise
-    disease_mentions = extract_candidate_mentions(row, DISEASES, DISEASE_SETS)
-    pheno_mentions = extract_candidate_mentions(row, PHENOS, PHENO_SETS)
-    dwi = [d.wordidxs for d in disease_mentions]
-    pheno_mentions_2 = []
-    for p in pheno_mentions:
-      if p.wordidxs not in dwi:
-        pheno_mentions_2.append(p)
-    mentions = disease_mentions + pheno_mentions_2
-
-    if SR.get('rand-negs'):
-      mentions += generate_rand_negatives(row, mentions)
-
-    # print output
-    for mention in mentions:
-      util.print_tsv_output(mention)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_mentions)
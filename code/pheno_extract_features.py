@@ -47,4 +47,4 @@ onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
 if __name__ == '__main__':
   if OPTS.get('sentence-kws'):
     ddlib.load_dictionary(onto_path('manual/pheno_sentence_keywords.tsv'), dict_id='pheno_kws')
-  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_candidate)
+  util.run_features_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_candidate, opts=config.FEATURES)
@@ -40,68 +40,27 @@ Mention = collections.namedtuple('Mention', [
             'is_correct'])
 
 hpo_dag = dutil.read_hpo_dag()
-def pheno_is_child_of(child_entity, parent_entity):
-  child_parent_ids = dutil.get_parents(child_entity, hpo_dag)
-  return parent_entity in child_parent_ids
 
 def filter_phenos(row):
-  doc_id = None
-  section_id = None
-  sent_id = None
-  wordidxs = None
-  words = None
-  cands = []
+  """
+  Keep only the most specific of the phenotype entities of a span, i.e. drop any entity which
+  has a descendant among the others in the HPO DAG, below HP:0000118 as in get_parents (and
+  all but the first mention of each entity)
+  """
+  mentions = []
+  entities = set()
   for i in xrange(len(row.mention_ids)):
-    if doc_id is None:
-      doc_id = row.doc_id
-    assert doc_id == row.doc_id
-    if section_id is None:
-      section_id = row.section_id
-    assert section_id == row.section_id
-    if sent_id is None:
-      sent_id = row.sent_id
-    assert sent_id == row.sent_id
-    if wordidxs is None:
-      wordidxs = row.wordidxs
-    assert wordidxs == row.wordidxs
-    if words is None:
-      words = row.words
-    assert words == row.words
-
-    mention_id = row.mention_ids[i]
-    supertype = row.supertypes[i]
-    subtype = row.subtypes[i]
     entity = row.entities[i]
-    is_correct = row.is_corrects[i]
-    
-    current_pheno = Mention(None, doc_id, section_id, sent_id, wordidxs, mention_id, supertype, subtype, entity, words, is_correct)
-
-    found = False
-    for i in xrange(len(cands)):
-      cand = cands[i]
-      if pheno_is_child_of(cand.entity, current_pheno.entity):
-        found = True
-        break
-      if pheno_is_child_of(current_pheno.entity, cand.entity):
-        cands[i] = current_pheno
-        found = True
-        break
-    if not found:
-      cands.append(current_pheno)
-
-    return cands
+    if entity in entities:
+      continue
+    entities.add(entity)
+    mentions.append(Mention(None, row.doc_id, row.section_id, row.sent_id, row.wordidxs,
+                            row.mention_ids[i], row.supertypes[i], row.subtypes[i], entity,
+                            row.words, row.is_corrects[i]))
+  most_specific = hpo_dag.most_specific(entities, stop='HP:0000118')
+  return [m for m in mentions if m.entity in most_specific]
 
 if __name__ == '__main__':
   onto_path = lambda p : '%s/onto/%s' % (os.environ['GDD_HOME'], p)
 
-  # generate the mentions, while trying to keep the supervision approx. balanced
-  # print out right away so we don't bloat memory...
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-
-    # Find candidate mentions & supervise
-    mentions = filter_phenos(row)
-
-    # print output
-    for mention in mentions:
-      util.print_tsv_output(mention)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=filter_phenos)
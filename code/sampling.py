@@ -0,0 +1,188 @@
+"""Deterministic sampling of (negative) supervision examples.
+
+Sampling decisions hash a stable key of the example (its mention_id or relation_id) with a
+seed into a uniform value in [0, 1), instead of drawing from a process-global random
+sequence: the same example is kept or not regardless of input order, process or shard.
+
+NegativeSampler balances sampled negatives against positive examples, either with the
+probabilities the extractors compute from their running pos/neg counters (order dependent,
+but reproducible), or in 'ratio' mode, with one fixed probability per UDF which hits a target
+neg:pos ratio, computed from the counts recorded by a first, counting pass over all of the
+input (run by the pipeline before the UDF, see application.conf, or else by the UDF itself,
+see NegativeSampler.run_main_tsv). See config.SAMPLING.
+"""
+import glob
+import hashlib
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+
+import config
+import extractor_util as util
+import incremental
+
+OPTS = config.SAMPLING
+APP_HOME = os.environ['GDD_HOME']
+
+SAMPLING_MODES = ('counters', 'ratio')
+
+
+def key_hash(key, salt='', seed=None):
+  """A stable, unsigned 64-bit hash of (seed, salt, key)"""
+  seed = OPTS['seed'] if seed is None else seed
+  return struct.unpack('>Q', hashlib.md5('%s\t%s\t%s' % (seed, salt, key)).digest()[:8])[0]
+
+
+def uniform(key, salt='', seed=None):
+  """A uniform value in [0, 1) determined by key; use a different salt for each decision"""
+  return key_hash(key, salt, seed) / float(1 << 64)
+
+
+def rng(key, salt='', seed=None):
+  """A random.Random seeded by key, for decisions which need a sequence of random values"""
+  return random.Random(key_hash(key, salt, seed))
+
+
+def p_any(*ps):
+  """The probability that at least one of independent events with probabilities ps occurs"""
+  q = 1.0
+  for p in ps:
+    q *= 1.0 - min(max(p, 0.0), 1.0)
+  return 1.0 - q
+
+
+def counting_pass():
+  """The counting pass of 'ratio' mode is turned on by a --sampling-count argument"""
+  return '--sampling-count' in sys.argv or bool(os.environ.get('GDD_SAMPLING_COUNT'))
+
+
+class NegativeSampler:
+  """
+  Samples candidate negative examples to balance the positive ones of a UDF (name, by default
+  the name of the running script).
+  Call count(is_correct) for each example labeled independently of sampling, and
+  keep(key, p) for each candidate negative example:
+    - in 'counters' mode, it is kept with probability p (computed by the caller from its
+      running pos/neg counts, as before)
+    - in 'ratio' mode, during the counting pass (see counting_pass) no candidate is kept and
+      the counts are written to <stats-dir>/<name>.<pid>.tsv by finish(); during the
+      sampling pass, each candidate is kept with probability weight * rate(), where rate() is
+      set from the counts of all counting pass processes to hit the target neg:pos ratio; if
+      there are none, run_main_tsv counts the input of this process first
+  The counts are attributes (pos, neg, candidates), so that they can be totaled across
+  run_main_tsv workers with counters(); the output depends on running counts only in
+  'counters' mode (see balancing())
+  """
+  def __init__(self, name=None, opts=OPTS):
+    if opts['mode'] not in SAMPLING_MODES:
+      raise ValueError('Unknown sampling mode: %s' % opts['mode'])
+    self.name = name or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    self.mode = opts['mode']
+    self.ratio = opts['neg-pos-ratio']
+    self.stats_dir = '%s/%s' % (APP_HOME, opts['stats-dir'])
+    self.counting = self.mode == 'ratio' and counting_pass()
+    if self.mode == 'ratio' and not self.counting:
+      incremental.depends_on(*self.stats_paths())
+    self.pos = 0
+    self.neg = 0
+    self.candidates = 0.0
+    self._rate = None
+
+  def count(self, is_correct):
+    if is_correct is True:
+      self.pos += 1
+    elif is_correct is False:
+      self.neg += 1
+
+  def keep(self, key, p=None, weight=1.0, salt=''):
+    if self.mode == 'counters':
+      return uniform(key, salt) < p
+    if self.counting:
+      self.candidates += weight
+      return False
+    return uniform(key, salt) < weight * self.rate()
+
+  def stats_path(self):
+    return '%s/%s.%d.tsv' % (self.stats_dir, self.name, os.getpid())
+
+  def stats_paths(self):
+    """The counts written by all processes of the counting pass"""
+    return glob.glob('%s/%s.*.tsv' % (self.stats_dir, self.name))
+
+  def rate(self):
+    """The probability (per unit of weight) of keeping a candidate, in 'ratio' mode"""
+    if self._rate is None:
+      paths = self.stats_paths()
+      if not paths:
+        raise IOError('No sampling counts for %s in %s: run the counting pass first' %
+                      (self.name, self.stats_dir))
+      totals = {'pos' : 0.0, 'neg' : 0.0, 'candidates' : 0.0}
+      for path in paths:
+        with open(path) as f:
+          for line in f:
+            name, value = line.rstrip('\n').split('\t')
+            totals[name] += float(value)
+      self._rate = self.rate_of(totals['pos'], totals['neg'], totals['candidates'])
+    return self._rate
+
+  def rate_of(self, pos, neg, candidates):
+    """The rate which keeps enough of candidates to hit the target neg:pos ratio"""
+    needed = self.ratio * pos - neg
+    return max(needed, 0.0) / candidates if candidates else 0.0
+
+  def balancing(self):
+    """Whether the running pos/neg counts of the UDF set the probabilities of keep()"""
+    return self.mode == 'counters'
+
+  def counters(self):
+    return util.ModuleCounters(self, ['pos', 'neg', 'candidates'], balancing=False)
+
+  def run_main_tsv(self, **kwargs):
+    """
+    util.run_main_tsv(**kwargs) for the UDF, then finish(). The output of the counting pass is
+    discarded. In 'ratio' mode with no counts in <stats-dir> (i.e. the UDF is run once, e.g.
+    by app.ddlog), the input is spooled to a temporary file and run through twice, counting
+    then sampling, with the rate set from the counts of this process' input only. Its output
+    then depends on all of that input, so rows are not reused in incremental mode
+    """
+    if self.counting:
+      with open(os.devnull, 'w') as devnull:
+        rv = util.run_main_tsv(**dict(kwargs, outstream=devnull))
+    elif self.mode == 'ratio' and not self.stats_paths():
+      rv = self._run_two_passes(kwargs)
+    else:
+      rv = util.run_main_tsv(**kwargs)
+    self.finish()
+    return rv
+
+  def _run_two_passes(self, kwargs):
+    sys.stderr.write('SAMPLING[%s]: no counts in %s, counting the input of this process\n' %
+                     (self.name, self.stats_dir))
+    counters = kwargs.get('counters') or []
+    if isinstance(counters, util.ModuleCounters):
+      counters = [counters]
+    with tempfile.TemporaryFile() as spool:
+      shutil.copyfileobj(kwargs.get('instream') or sys.stdin, spool)
+      spool.seek(0)
+      self.counting = True
+      with open(os.devnull, 'w') as devnull:
+        util.run_main_tsv(**dict(kwargs, instream=spool, outstream=devnull, incremental=False))
+      self.counting = False
+      self._rate = self.rate_of(self.pos, self.neg, self.candidates)
+      for c in counters:
+        c.reset()
+      spool.seek(0)
+      return util.run_main_tsv(**dict(kwargs, instream=spool, incremental=False))
+
+  def finish(self):
+    """Write this process' counts, at the end of the counting pass"""
+    if not self.counting:
+      return
+    if not os.path.isdir(self.stats_dir):
+      os.makedirs(self.stats_dir)
+    with open(self.stats_path(), 'w') as f:
+      for name in ['pos', 'neg', 'candidates']:
+        f.write('%s\t%r\n' % (name, getattr(self, name)))
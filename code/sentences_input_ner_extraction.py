@@ -67,11 +67,4 @@ def create_ners(row):
                       lemmas_ner='|^|'.join(lemmas_ner))
 
 if __name__ == '__main__':
-  # generate the mentions, while trying to keep the supervision approx. balanced
-  # print out right away so we don't bloat memory...
-  pos_count = 0
-  neg_count = 0
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-    out_row = create_ners(row)
-    util.print_tsv_output(out_row)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=lambda row : [create_ners(row)])
@@ -0,0 +1,170 @@
+"""Declarative distant supervision rules.
+
+The supervision of a candidate (mention or relation) is a list of Rules, tried in order until
+one of them fires. A RuleSet compiles such a list once, against the SR dict of config.py: the
+rules whose config entry is unset, or whose rule groups are all empty, are dropped, and the
+options of the others are bound. Rules test a Candidate, whose derived values (phrases,
+dependency path, lemma positions...) are computed on first use by one rule and shared by the
+rules tried after it.
+
+Each rule counts its calls & fires (and its time, on the rows sampled) in util.INSTRUMENTS,
+under its name; see extractor_util.Instruments. With config.SUPERVISION['rule-order'] set to
+'selective', each run of consecutive rules which all give the same label is periodically
+reordered, cheapest & most selective first. The labels do not change, but the supertype of a
+candidate which several rules of a run match may; see RuleSet.reorder.
+"""
+import config
+import extractor_util as util
+
+OPTS = config.SUPERVISION
+
+RULE_ORDERS = ('config', 'selective')
+
+# What a rule returns to drop the candidate, i.e. to output nothing for it
+DROP = object()
+
+
+class Candidate(object):
+  """
+  The values a candidate is supervised on: those given to the constructor, and derived ones,
+  computed by derivations[name](candidate) when candidate.name is first read
+  """
+  def __init__(self, derivations, **values):
+    self.__dict__.update(values)
+    self.derivations = derivations
+
+  def __getattr__(self, name):
+    # Only called for the values which are not set yet
+    derive = self.derivations.get(name)
+    if derive is None:
+      raise AttributeError(name)
+    value = derive(self)
+    setattr(self, name, value)
+    return value
+
+
+class Rule(object):
+  """
+  A supervision rule: fn(c, opts, *args) returns the supervised output for Candidate c if the
+  rule fires (or DROP), else None, where opts is SR[key] (None if key is None, for the rules
+  which always apply). The rule is compiled only if SR[key] is set and enabled(opts) holds.
+  label is the is_correct of all of the outputs of the rule, if fixed (None if not, or if it
+  may DROP), and cost an estimate of the relative cost of a call, used to order the rules
+  until they are timed
+  """
+  __slots__ = ('name', 'key', 'fn', 'args', 'label', 'cost', 'enabled')
+
+  def __init__(self, name, key, fn, args=(), label=None, cost=1.0, enabled=None):
+    self.name = name
+    self.key = key
+    self.fn = fn
+    self.args = tuple(args)
+    self.label = label
+    self.cost = cost
+    self.enabled = enabled
+
+  def applies(self, SR):
+    if self.key is None:
+      return True
+    opts = SR.get(self.key)
+    return bool(opts) and (self.enabled is None or bool(self.enabled(opts)))
+
+
+def val_rules(name, key, fn, vals, cost=1.0, enabled=None):
+  """
+  A Rule <name>/<val name> for each (val name, val) of vals (e.g. config.BOOL_VALS), which
+  labels is_correct = val: fn is called as fn(c, opts, val name, val), and enabled, if
+  given, as enabled(opts, val name)
+  """
+  def enabled_for(val_name):
+    if enabled is None:
+      return None
+    return lambda opts: enabled(opts, val_name)
+  return [Rule('%s/%s' % (name, val_name), key, fn, (val_name, val), label=val, cost=cost,
+               enabled=enabled_for(val_name))
+          for val_name, val in vals]
+
+
+def has_rule_group(opts, name):
+  """Whether the rule group opts[name] + opts['<name>-rgx'] (see util.rule_group) has any rule"""
+  return len(opts[name]) + len(opts['%s-rgx' % name]) > 0
+
+
+def positions(index, values):
+  """The sorted positions of values in a sequence, given its index of positions by value"""
+  rv = set()
+  for value in values:
+    rv.update(index.get(value, ()))
+  return sorted(rv)
+
+
+def position_index(seq):
+  """The positions of each value of seq"""
+  rv = {}
+  for i, x in enumerate(seq):
+    rv.setdefault(x, []).append(i)
+  return rv
+
+
+class RuleSet(object):
+  """
+  The rules of a list which apply under supervision rules SR, compiled once: evaluate(c)
+  returns the output of the first of them which fires on Candidate c, or None if none does
+  """
+  def __init__(self, rules, SR, opts=OPTS):
+    if opts['rule-order'] not in RULE_ORDERS:
+      raise ValueError('Unknown supervision rule order: %s' % opts['rule-order'])
+    self.rules = [(rule, SR.get(rule.key) if rule.key is not None else None,
+                   util.INSTRUMENTS.rule(rule.name))
+                  for rule in rules if rule.applies(SR)]
+    self.selective = opts['rule-order'] == 'selective'
+    self.reorder_every = opts['reorder-every']
+    self.evaluated = 0
+    self.order = list(self.rules)
+    if self.selective:
+      self.reorder()
+
+  def names(self):
+    """The names of the rules, in their current order"""
+    return [rule.name for rule, _, _ in self.order]
+
+  def evaluate(self, c):
+    if self.selective:
+      self.evaluated += 1
+      if self.evaluated % self.reorder_every == 0:
+        self.reorder()
+    for rule, opts, stage in self.order:
+      with stage:
+        rv = rule.fn(c, opts, *rule.args)
+      if rv is not None:
+        return stage.fired(rv)
+    return None
+
+  def runs(self):
+    """The runs of consecutive rules with the same fixed label; other rules are runs of one"""
+    run = []
+    for entry in self.rules:
+      label = entry[0].label
+      if run and (label is None or label is not run[0][0].label):
+        yield run
+        run = []
+      run.append(entry)
+    if run:
+      yield run
+
+  def reorder(self):
+    """
+    Sort each run of rules with the same label by expected cost, i.e. cost per call over
+    the probability of firing (smoothed), which minimizes the expected cost of trying the run
+    if the rules fire independently. Costs are the times measured by the instruments if all
+    of the rules of the run have been timed, else the estimates of the rules
+    """
+    order = []
+    for run in self.runs():
+      timed = all(stage.seconds > 0 for _, _, stage in run)
+      def expected_cost(entry):
+        rule, _, stage = entry
+        cost = stage.seconds / stage.calls if timed else rule.cost
+        return cost * (stage.calls + 2.0) / (stage.fires + 1.0)
+      order.extend(sorted(run, key=expected_cost) if run[0][0].label is not None else run)
+    self.order = order
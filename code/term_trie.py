@@ -0,0 +1,139 @@
+"""Token-trie phrase matcher for dictionary-based candidate extraction.
+
+Builds a trie once over the keys of a term dictionary (phrase -> entities) so
+that all exact, permuted and omitted-interior-word matches in a sentence can
+be found in a single left-to-right pass, instead of re-joining and looking up
+every window of every length.
+"""
+
+EXACT = 'EXACT'
+PERM = 'PERM'
+OMIT = 'OMIT'
+
+
+class TrieNode:
+  __slots__ = ('children', 'phrase')
+
+  def __init__(self):
+    self.children = {}
+    self.phrase = None
+
+
+def _pieces(tok):
+  """Split a token the same way the joined phrase would be split, so that
+  ' '.join(toks) == key exactly iff the concatenated pieces match the key's pieces"""
+  return tok.split(' ')
+
+
+class TermTrie:
+  """
+  Initialized with a dict of term phrases (keys are space-joined tokens) and a dict
+  of term bags-of-words (frozenset keys), as output by e.g. load_pheno_terms()
+  """
+  def __init__(self, terms, term_sets):
+    self.terms = terms
+    self.term_sets = term_sets
+    self.root = TrieNode()
+    for phrase in terms:
+      node = self.root
+      for piece in phrase.split(' '):
+        child = node.children.get(piece)
+        if child is None:
+          child = node.children[piece] = TrieNode()
+        node = child
+      node.phrase = phrase
+    self.set_vocab = frozenset(w for ts in term_sets for w in ts)
+    self.max_set_len = max([len(ts) for ts in term_sets]) if term_sets else 0
+
+  def advance(self, node, tok):
+    """Walk the trie from node along all pieces of tok; None if the path leaves the trie"""
+    for piece in _pieces(tok):
+      node = node.children.get(piece)
+      if node is None:
+        return None
+    return node
+
+  def lookup(self, node, lnode):
+    """Return the term entities for a (word, lemma) pair of trie nodes, preferring words"""
+    if node is not None and node.phrase is not None:
+      return self.terms[node.phrase]
+    if lnode is not None and lnode.phrase is not None:
+      return self.terms[lnode.phrase]
+    return None
+
+  def _perm_lookup(self, ws, lws):
+    ps, lps = frozenset(ws), frozenset(lws)
+    if (len(ps) == len(ws) and ps in self.term_sets) or (len(lps) == len(lws) and lps in self.term_sets):
+      return self.term_sets[ps] if ps in self.term_sets else self.term_sets[lps]
+    return None
+
+  def find_matches(self, words, lemmas, keep, split_indices, max_len, permuted=True, omitted_interior=True):
+    """
+    Find all windows [i, i+n) of at most max_len tokens, not intersecting split_indices,
+    which start and end on a kept token and whose kept words or lemmas match a term.
+    words, lemmas are normalized token lists; keep[k] says whether token k is kept.
+    Returns a dict mapping (n, i) -> (match_kind, [(entities, subtype_suffix), ...]),
+    where at most one match kind (exact, then permuted, then omitted) is reported per window.
+    """
+    matches = {}
+    root = self.root
+    for i in xrange(len(words)):
+      if not keep[i] or i in split_indices:
+        continue
+      node, lnode = root, root
+      ws, lws = [], []
+      # Trie states with exactly one interior kept token skipped: (node, lnode, omit)
+      skips = []
+      perm_ok, lperm_ok = permuted, permuted
+      for j in xrange(i, min(len(words), i + max_len)):
+        if j in split_indices:
+          break
+        if not keep[j]:
+          continue
+        w, lw = words[j], lemmas[j]
+        t = len(ws)
+        if omitted_interior:
+          nskips = []
+          for (sn, sln, omit) in skips:
+            sn = self.advance(sn, w) if sn is not None else None
+            sln = self.advance(sln, lw) if sln is not None else None
+            if sn is not None or sln is not None:
+              nskips.append((sn, sln, omit))
+          if t >= 1 and (node is not None or lnode is not None):
+            nskips.append((node, lnode, t))
+          skips = nskips
+        node = self.advance(node, w) if node is not None else None
+        lnode = self.advance(lnode, lw) if lnode is not None else None
+        ws.append(w)
+        lws.append(lw)
+        if perm_ok and w not in self.set_vocab:
+          perm_ok = False
+        if lperm_ok and lw not in self.set_vocab:
+          lperm_ok = False
+        key = (j - i + 1, i)
+
+        # (1) exact match of the kept words / lemmas
+        entities = self.lookup(node, lnode)
+        if entities is not None:
+          matches[key] = (EXACT, [(entities, None)])
+          continue
+
+        # (2) permuted match
+        if (perm_ok or lperm_ok) and len(ws) <= self.max_set_len:
+          entities = self._perm_lookup(ws, lws)
+          if entities is not None:
+            matches[key] = (PERM, [(entities, None)])
+            continue
+
+        # (3) exact match with one omitted interior word
+        if omitted_interior and len(ws) > 2:
+          found = []
+          for (sn, sln, omit) in skips:
+            if omit < t:
+              entities = self.lookup(sn, sln)
+              if entities is not None:
+                found.append((omit, entities))
+          if found:
+            found.sort(key=lambda x: x[0])
+            matches[key] = (OMIT, [(entities, omit) for (omit, entities) in found])
+    return matches
@@ -100,44 +100,70 @@ def comp_gv_rgx():
   # Just return as one giant regex for now
   return [gvr[0] for gvr in GV_RGXS]
 
-def extract_candidate_mentions(row, gv_rgxs):
+# Candidate mentions start on a token with one of these prefixes, and span at most
+# MAX_GV_WORDS tokens
+GV_PREFIXES = ('c.', 'n.', 'g.', 'r.', 'm.', 'p.', 'IVS')
+MAX_GV_WORDS = 6
+
+def compile_gv_scanner(gv_rgxs):
+  """
+  Compile the (case insensitive) full match of any of gv_rgxs into a single regex, with
+  one named alternative per regex: the lastgroup of a match, 'gv<index>', is the first of
+  gv_rgxs matching the string
+  """
+  return re.compile('^(?:%s)$' % '|'.join('(?P<gv%d>%s)' % (k, gv_rgx) for k, gv_rgx in enumerate(gv_rgxs)),
+                    flags=re.I)
+
+def extract_candidate_mentions(row, gv_rgxs, gv_scanner=None):
+  """
+  Scan the sentence once: from each token with a variant prefix, the concatenations of the
+  following (at most MAX_GV_WORDS) tokens are matched against all regexes at once; the
+  first regex matching any of them wins, with the longest window it matches
+  """
+  if gv_scanner is None:
+    gv_scanner = compile_gv_scanner(gv_rgxs)
   mentions = []
-  covered = []
-  for i,word in enumerate(row.words):
-    if i in covered:
+  covered = set()
+  words = row.words
+  for i, word in enumerate(words):
+    if i in covered or not word.startswith(GV_PREFIXES):
       continue
-    for gv_rgx in gv_rgxs:
-      gv_rgx = '^(%s)$' % gv_rgx
-      if re.match(r'[cngrmp]\.|IVS.*', word):
-        for j in reversed(range(i+1, min(i+7, len(row.words)))):
-          words = row.words[i:j]
-          if re.match(gv_rgx, ''.join(words), flags=re.I):
-            mentions.append(Mention(
-              dd_id=None, 
-              doc_id=row.doc_id, 
-              section_id=row.section_id,
-              sent_id=row.sent_id,
-              wordidxs=range(i,j),
-              mention_id='%s_%s_%s_%s_%s_GV' % (row.doc_id, row.section_id, row.sent_id, i, j),
-              mention_supertype='GV_RGX_MATCH_%d' % (j - i),
-              mention_subtype=gv_rgx.replace('|', '/').replace('\\', '/'),
-              entity=''.join(words),
-              variant_type=None,
-              ivsNum=None,
-              pos=None,
-              posPlus=None,
-              fromPos=None,
-              toPos=None,
-              seq=None,
-              fromSeq=None,
-              toSeq=None,
-              words=words,
-              is_correct=True))
-            covered.extend(range(i,j))
-            break
-        else:
-          continue
-        break
+    best = None
+    joined = ''
+    # NOTE: as in the tmVar based scan this replaces, windows end before the last token
+    for j in xrange(i + 1, min(i + MAX_GV_WORDS + 1, len(words))):
+      joined += words[j - 1]
+      m = gv_scanner.match(joined)
+      if m:
+        k = int(m.lastgroup[2:])
+        if best is None or k <= best[0]:
+          best = (k, j)
+    if best is None:
+      continue
+    k, j = best
+    mention_words = words[i:j]
+    mentions.append(Mention(
+      dd_id=None,
+      doc_id=row.doc_id,
+      section_id=row.section_id,
+      sent_id=row.sent_id,
+      wordidxs=range(i,j),
+      mention_id='%s_%s_%s_%s_%s_GV' % (row.doc_id, row.section_id, row.sent_id, i, j),
+      mention_supertype='GV_RGX_MATCH_%d' % (j - i),
+      mention_subtype=('^(%s)$' % gv_rgxs[k]).replace('|', '/').replace('\\', '/'),
+      entity=''.join(mention_words),
+      variant_type=None,
+      ivsNum=None,
+      pos=None,
+      posPlus=None,
+      fromPos=None,
+      toPos=None,
+      seq=None,
+      fromSeq=None,
+      toSeq=None,
+      words=mention_words,
+      is_correct=True))
+    covered.update(xrange(i, j))
   return mentions
 
 def extract_relative_coords(mention):
@@ -279,22 +305,21 @@ def extract_relative_coords(mention):
 
   return mention
 
-if __name__ == '__main__':
-  GV_RGXs = comp_gv_rgx()
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
+def get_mentions(row):
+  # Skip row if sentence doesn't contain a verb, contains URL, etc.
+  if util.skip_row(row):
+    return []
 
-    # Skip row if sentence doesn't contain a verb, contains URL, etc.
-    if util.skip_row(row):
-      continue
+  # Find candidate mentions & supervise
+  mentions_without_coords = extract_candidate_mentions(row, GV_RGXs, GV_SCANNER)
+  mentions = []
+  for mention_without_coords in mentions_without_coords:
+    mention = extract_relative_coords(mention_without_coords)
+    mentions.append(mention)
+  return mentions
 
-    # Find candidate mentions & supervise
-    mentions_without_coords = extract_candidate_mentions(row, GV_RGXs)
-    mentions = []
-    for mention_without_coords in mentions_without_coords:
-      mention = extract_relative_coords(mention_without_coords)
-      mentions.append(mention)
+GV_RGXs = comp_gv_rgx()
+GV_SCANNER = compile_gv_scanner(GV_RGXs)
 
-    # print output
-    for mention in mentions:
-      util.print_tsv_output(mention)
+if __name__ == '__main__':
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_mentions)
@@ -140,8 +140,4 @@ def create_supervised_relation(row, i, j, dep_dag=None):
 
 if __name__ == '__main__':
   CLINVAR_SUP = dutil.load_hgvs_to_hpo()
-  for line in sys.stdin:
-    row = parser.parse_tsv_row(line)
-    relations = extract_candidate_relations(row)
-    for relation in relations:
-      util.print_tsv_output(relation)
+  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=extract_candidate_relations)
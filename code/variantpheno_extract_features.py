@@ -4,6 +4,7 @@ from collections import namedtuple
 import os
 import sys
 import ddlib
+import config
 
 parser = util.RowParser([
           ('relation_id', 'text'),
@@ -39,4 +40,4 @@ def get_features_for_candidate(row):
   return features
 
 if __name__ == '__main__':
-  util.run_main_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_candidate)
+  util.run_features_tsv(row_parser=parser.parse_tsv_row, row_fn=get_features_for_candidate, opts=config.FEATURES)
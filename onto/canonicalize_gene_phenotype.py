@@ -4,29 +4,77 @@ import os
 APP_HOME = os.environ['GDD_HOME']
 import sys
 sys.path.append('%s/code' % APP_HOME)
+from collections import defaultdict
 import data_util as dutil
+import extractor_util as util
 import argparse
+import fileinput
 
 ### ATTENTION!!!! PLEASE PIPE THE OUTPUT OF THIS SCRIPT THROUGH sort | uniq !!! ###
 ### Doing it within python is a waste of resources. Linux does it much faster.  ###
+### (Unless you use --batch, which outputs each (parent, gene) pair only once.) ###
 
-if __name__ == '__main__':
-  hpo_dag = dutil.read_hpo_dag()
-  parser = argparse.ArgumentParser()
-  parser.add_argument('--only-abnormalities', required=False, action="store_true")
-  args = parser.parse_args()
-  for line in sys.stdin:
+ABNORMALITY = 'HP:0000118'
+
+def canonicalize_lines(lines, hpo_dag, only_abnormalities):
+  for line in lines:
     toks = line.strip().split()
     hpo_id = toks[0]
     ensemble_gene = toks[1]
     parent_ids = dutil.get_parents(hpo_id, hpo_dag) # includes the original hpo_id
 
     assert hpo_id in parent_ids
-    if args.only_abnormalities:
-      if 'HP:0000118' not in parent_ids:
+    if only_abnormalities:
+      if ABNORMALITY not in parent_ids:
         sys.stderr.write('"{0}": not a phenotypic abnormality\n'.format(hpo_id.strip()))
         continue
-      parent_ids.remove('HP:0000118')
+      parent_ids.remove(ABNORMALITY)
     for parent_id in parent_ids:
       sys.stdout.write('{0}\t{1}\n'.format(parent_id, ensemble_gene))
     sys.stdout.flush()
+
+def canonicalize_batch(lines, hpo_dag, only_abnormalities):
+  """
+  Read all of the input first, grouping the genes by hpo_id, so that the ancestors of each
+  hpo_id are looked up once; output pairs are deduplicated as (hpo int, gene int) pairs
+  """
+  genes = {}
+  hpo_genes = defaultdict(set)
+  for line in lines:
+    toks = line.strip().split()
+    hpo_genes[toks[0]].add(genes.setdefault(toks[1], len(genes)))
+  gene_names = [None] * len(genes)
+  for gene, i in genes.iteritems():
+    gene_names[i] = gene
+
+  parent_ints = {}
+  seen = set()
+  writer = util.TsvWriter(sys.stdout)
+  for hpo_id, gene_ints in hpo_genes.iteritems():
+    parent_ids = dutil.get_parents(hpo_id, hpo_dag) # includes the original hpo_id
+    if only_abnormalities:
+      if ABNORMALITY not in parent_ids:
+        sys.stderr.write('"{0}": not a phenotypic abnormality\n'.format(hpo_id.strip()))
+        continue
+      parent_ids.remove(ABNORMALITY)
+    for parent_id in parent_ids:
+      p = parent_ints.setdefault(parent_id, len(parent_ints)) << 32
+      for g in gene_ints:
+        if p | g not in seen:
+          seen.add(p | g)
+          writer.write_line('{0}\t{1}\n'.format(parent_id, gene_names[g]))
+  writer.flush()
+
+if __name__ == '__main__':
+  hpo_dag = dutil.read_hpo_dag()
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--only-abnormalities', required=False, action="store_true")
+  parser.add_argument('--batch', required=False, action="store_true",
+                      help='group the input by hpo_id and output each line only once')
+  parser.add_argument('inputs', nargs='*', help='(hpo_id, gene) files; stdin by default')
+  args = parser.parse_args()
+  lines = fileinput.input(args.inputs)
+  if args.batch:
+    canonicalize_batch(lines, hpo_dag, args.only_abnormalities)
+  else:
+    canonicalize_lines(lines, hpo_dag, args.only_abnormalities)
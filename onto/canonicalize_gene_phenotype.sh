@@ -1,3 +1,3 @@
 #! /bin/bash
 
-${APP_HOME}/onto/canonicalize_gene_phenotype.py | sort | uniq
+${APP_HOME}/onto/canonicalize_gene_phenotype.py --batch
@@ -155,7 +155,7 @@ fi
 # use Harendra's wizard phenotype to gene list; canonicalize it (i.e. for each
 # gene with associated phenotype, associate all parent phenotypes up to 118=phenotypic abnormality
 # with the gene as well
-./canonicalize_gene_phenotype.py manual/harendra_phenotype_to_gene.map | sort | uniq > data/canon_phenotype_to_ensgene.map
+./canonicalize_gene_phenotype.py --batch manual/harendra_phenotype_to_gene.map > data/canon_phenotype_to_ensgene.map
 join -1 1 -2 1 \
   <(cat data/ensembl_genes.tsv | 
     awk -F'[:\t]' '{print $1, $3}' | 
@@ -233,3 +233,7 @@ join -1 1 -2 1 -t$'\t' \
 python prep_pheno_terms.py
 
 ./create_allowed_diseases.sh
+
+# Precompile the static dictionaries loaded by the extractors into binary artifacts
+# (onto/data/artifacts/); these are also rebuilt on demand whenever a source TSV changes
+python ../code/artifacts.py
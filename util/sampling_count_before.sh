@@ -0,0 +1,5 @@
+#! /bin/sh
+# Operations to execute before running the sampling counting pass of UDF $1 (see
+# code/sampling.py): clear the counts of its previous counting pass, in config.SAMPLING's
+# stats-dir
+rm -f ${APP_HOME}/sampling_stats/$1.*.tsv